@@ -0,0 +1,83 @@
+"""
+Compara el generador de miniaturas clásico (decodificación completa) con el rápido
+(vista previa EXIF/HEIF o draft de JPEG) sobre una carpeta de imágenes de ejemplo.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.benchmarkMiniaturas <carpeta> [--repeticiones N]
+
+Cada modo se ejecuta en un proceso aparte para que el pico de memoria (RSS) de uno no contamine al otro.
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import statistics
+import tempfile
+import time
+from fast_api.utilidades import utilidadesMiniaturas
+
+EXTENSIONES = (".jpg", ".jpeg", ".png", ".heic", ".heif", ".webp", ".tif", ".tiff")
+
+def listar_imagenes(carpeta: str):
+    return sorted(
+        os.path.join(carpeta, nombre) for nombre in os.listdir(carpeta)
+        if nombre.lower().endswith(EXTENSIONES)
+    )
+
+def _ejecutar_modo(imagenes, rapido: bool, repeticiones: int, cola):
+    tiempos = []
+    errores = 0
+    with tempfile.TemporaryDirectory() as carpeta_salida:
+        for ruta in imagenes:
+            destino = os.path.join(carpeta_salida, os.path.basename(ruta))
+            for _ in range(repeticiones):
+                inicio = time.perf_counter()
+                try:
+                    utilidadesMiniaturas.miniatura_imagen(ruta, destino, rapido=rapido)
+                except Exception as e:
+                    errores += 1
+                    print(f"  Error con {os.path.basename(ruta)}: {e}")
+                    break
+                tiempos.append(time.perf_counter() - inicio)
+    # ru_maxrss está en KB en Linux
+    pico_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    cola.put({"tiempos": tiempos, "errores": errores, "pico_mb": pico_mb})
+
+def medir(imagenes, rapido: bool, repeticiones: int) -> dict:
+    contexto = multiprocessing.get_context("spawn")
+    cola = contexto.Queue()
+    proceso = contexto.Process(target=_ejecutar_modo, args=(imagenes, rapido, repeticiones, cola))
+    proceso.start()
+    resultado = cola.get()
+    proceso.join()
+    return resultado
+
+def imprimir(nombre: str, res: dict):
+    tiempos = res["tiempos"]
+    if not tiempos:
+        print(f"{nombre:<8} sin resultados ({res['errores']} errores)")
+        return
+    print(f"{nombre:<8} total {sum(tiempos):8.2f}s  media {statistics.mean(tiempos) * 1000:8.1f}ms  "
+          f"mediana {statistics.median(tiempos) * 1000:8.1f}ms  máx {max(tiempos) * 1000:8.1f}ms  "
+          f"pico RSS {res['pico_mb']:7.1f}MB  errores {res['errores']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de generación de miniaturas")
+    parser.add_argument("carpeta", help="Carpeta con imágenes de ejemplo")
+    parser.add_argument("--repeticiones", type=int, default=1)
+    args = parser.parse_args()
+
+    imagenes = listar_imagenes(args.carpeta)
+    if not imagenes:
+        print("No se encontraron imágenes en la carpeta")
+        return
+    print(f"{len(imagenes)} imágenes, {args.repeticiones} repetición(es) por imagen\n")
+    clasico = medir(imagenes, rapido=False, repeticiones=args.repeticiones)
+    rapido = medir(imagenes, rapido=True, repeticiones=args.repeticiones)
+    imprimir("clásico", clasico)
+    imprimir("rápido", rapido)
+    if clasico["tiempos"] and rapido["tiempos"]:
+        print(f"\nAceleración: x{sum(clasico['tiempos']) / sum(rapido['tiempos']):.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,13 @@
 from fast_api import db
+from fast_api import db_async
 from mysql.connector import Error
 import os
+import fast_api.recurso.consultasRecursos as consultasRecursos
+import fast_api.utilidades.utilidadesFicheros as utilidadesFicheros
+import fast_api.seguridad.funcionesSeguridad as funcionesSeguridad
+import fast_api.seguridad.cacheAccesos as cacheAccesos
+import fast_api.recurso.cacheEnlaces as cacheEnlaces
+import fast_api.sincronizacion.consultasSincronizacion as consultasSincronizacion
 
 # Utilizado en el endpoint 1 de Album --------------------------------------------------------------
 def crear_album(nombre: str, descripcion:str, id_persona:int, id_album_padre: int = None):
@@ -37,7 +44,11 @@ def crear_album(nombre: str, descripcion:str, id_persona:int, id_album_padre: in
             query_2 = "INSERT INTO Miembro_Album (id_album, id_persona, rol) VALUES(%s, %s, 'CREADOR')"
             valores_miembro = (id_album, id_persona)
             cursor.execute(query_2, valores_miembro)
+            consultasSincronizacion.registrar_cambios_albumes(cursor, [id_album], 'CREAR')
             connection.commit()
+            if id_album_padre is not None:
+                # La subcarpeta aparece en los enlaces públicos que incluyen al padre
+                cacheEnlaces.invalidar_todo()
             return (True, id_album)
     except Error as e:
         if connection and connection.is_connected():
@@ -84,7 +95,58 @@ def obtener_albumes_usuario(id_usuario: int):
         if connection and connection.is_connected():
             cursor.close()
             connection.close()
+def obtener_albumes_por_ids(id_usuario: int, ids: list):
+    """
+    Como obtener_albumes_usuario pero solo para los álbumes indicados (los que han cambiado, para /sync).
+    Los que no salen son álbumes de los que el usuario ya no es miembro
+    """
+    if not ids:
+        return (True, [])
+    connection = None
+    cursor = None
+    try:
+        connection = db.get_connection()
+        cursor = connection.cursor(dictionary=True)
+        marcadores = ','.join(['%s'] * len(ids))
+        # Misma regla de visibilidad en raíz: si no soy miembro del padre, para mí no tiene padre
+        cursor.execute(f"""
+            SELECT A.id, A.nombre, A.descripcion,
+                   CASE WHEN EXISTS (
+                       SELECT 1 FROM Miembro_Album MP WHERE MP.id_album = A.id_album_padre AND MP.id_persona = %s
+                   ) THEN A.id_album_padre END AS id_album_padre,
+                   A.fecha_creacion, MA.rol, A.fecha_eliminacion
+            FROM Album A
+            JOIN Miembro_Album MA ON A.id = MA.id_album
+            WHERE MA.id_persona = %s AND A.id IN ({marcadores})
+        """, (id_usuario, id_usuario, *ids))
+        return (True, cursor.fetchall())
+    except Error as e:
+        print(f"Error obteniendo albumes por ids: {e}")
+        return (False, str(e))
+    finally:
+        if cursor: cursor.close()
+        if connection and connection.is_connected(): connection.close()
 # Utilizado en el endpoint 3 de Album --------------------------------------------------------------
+_SQL_ES_MIEMBRO = "SELECT COUNT(*) as count FROM Miembro_Album WHERE id_album=%s AND id_persona=%s"
+# Todos los recursos del álbum (sin importar quién los subió), con favorito e id_creador
+_SQL_RECURSOS_ALBUM = """
+    SELECT R.id, R.tipo, R.nombre, R.fecha_subida, R.fecha_real, R.favorito, R.id_creador, RA.id_album, R.estado_procesado, R.enlace
+    FROM Recurso R
+    JOIN Recurso_Album RA ON R.id = RA.id_recurso
+    WHERE RA.id_album = %s AND R.fecha_eliminacion IS NULL
+    ORDER BY R.fecha_real DESC;
+"""
+
+def _preparar_recursos_album(resultados: list):
+    # CORRECCIÓN IMPORTANTE: Generar URLs para que Flutter las vea
+    exp = funcionesSeguridad.caducidad_url_media()
+    for recurso in resultados:
+        recurso['url_visualizacion'] = f"/recurso/archivo/{recurso['id']}"
+        recurso['url_thumbnail'] = consultasRecursos.url_miniatura(recurso, exp)
+        recurso['miniatura_pendiente'] = recurso['estado_procesado'] in consultasRecursos.ESTADOS_PENDIENTES
+        # Ocultamos la ruta física del servidor
+        if 'enlace' in recurso: del recurso['enlace']
+
 def obtener_recursos_album(id_album: int, id_persona: int):
     connection = None
     try:
@@ -92,30 +154,14 @@ def obtener_recursos_album(id_album: int, id_persona: int):
         cursor = connection.cursor(dictionary=True)
         
         # Paso 1: Verificar acceso al álbum
-        check_query = "SELECT COUNT(*) as count FROM Miembro_Album WHERE id_album=%s AND id_persona=%s"
-        cursor.execute(check_query, (id_album, id_persona))
+        cursor.execute(_SQL_ES_MIEMBRO, (id_album, id_persona))
         if cursor.fetchone()['count'] == 0:
             return (False, "No tienes acceso a este album")
             
-        # Paso 2: Obtener TODOS los recursos del álbum (sin importar quién los subió)
-        # Añadimos r.favorito y r.id_creador que suelen ser necesarios
-        query = """
-            SELECT R.id, R.tipo, R.nombre, R.fecha_subida, R.fecha_real, R.favorito, R.id_creador, RA.id_album
-            FROM Recurso R
-            JOIN Recurso_Album RA ON R.id = RA.id_recurso
-            WHERE RA.id_album = %s AND R.fecha_eliminacion IS NULL
-            ORDER BY R.fecha_real DESC;
-        """
-        cursor.execute(query, (id_album,))
+        # Paso 2: Obtener TODOS los recursos del álbum
+        cursor.execute(_SQL_RECURSOS_ALBUM, (id_album,))
         resultados = cursor.fetchall()
-        
-        # CORRECCIÓN IMPORTANTE: Generar URLs para que Flutter las vea
-        for recurso in resultados:
-            recurso['url_visualizacion'] = f"/recurso/archivo/{recurso['id']}"
-            recurso['url_thumbnail'] = f"/recurso/archivo/{recurso['id']}?size=small"
-            # Ocultamos la ruta física del servidor
-            if 'enlace' in recurso: del recurso['enlace']
-            
+        _preparar_recursos_album(resultados)
         return (True, resultados)
     except Error as e:
         print(f"Error en obtener_recursos_album: {e}")
@@ -124,6 +170,20 @@ def obtener_recursos_album(id_album: int, id_persona: int):
         if connection and connection.is_connected():
             cursor.close()
             connection.close()
+async def obtener_recursos_album_async(id_album: int, id_persona: int):
+    """Versión async de obtener_recursos_album: las dos consultas con la misma conexión del pool async"""
+    try:
+        async with db_async.cursor_dict() as cursor:
+            await cursor.execute(_SQL_ES_MIEMBRO, (id_album, id_persona))
+            if (await cursor.fetchone())['count'] == 0:
+                return (False, "No tienes acceso a este album")
+            await cursor.execute(_SQL_RECURSOS_ALBUM, (id_album,))
+            resultados = await cursor.fetchall()
+        _preparar_recursos_album(resultados)
+        return (True, resultados)
+    except db_async.Error as e:
+        print(f"Error en obtener_recursos_album: {e}")
+        return (False, str(e))
 # Utilizado en el endpoint 4 de Album --------------------------------------------------------------
 def peticion_album(id_persona: int, id_persona_compartida: int, id_album:int, rol:str):
     connection = None
@@ -189,7 +249,9 @@ def add_recurso_album(id_recurso:int, id_album:int, id_persona:int):
                 return (False, "No eres miembro de este album")
             # Paso 3: Ejecutamos acción
             cursor.execute(query_3, valores_3)
+            consultasSincronizacion.registrar_cambios_recursos(cursor, [id_recurso], 'AGREGAR_ALBUM')
             connection.commit()
+            cacheEnlaces.invalidar_todo()
             return (True, (id_album,id_recurso))
     except Error as e:
         print(f"Error en la consulta de 'add_recurso_album': {e}")
@@ -220,8 +282,11 @@ def borrar_recurso_album(id_recurso: int, id_album: int, id_persona:int):
             # Paso 2: Ejecutamos
             query_2 = "DELETE FROM Recurso_Album WHERE id_album=%s AND id_recurso=%s;"
             valores_2 = (id_album, id_recurso)
+            # Antes de sacarlo: los miembros del álbum tienen que enterarse de que ya no lo ven
+            consultasSincronizacion.registrar_cambios_recursos(cursor, [id_recurso], 'QUITAR_ALBUM')
             cursor.execute(query_2, valores_2)
             connection.commit()
+            cacheAccesos.invalidar_recursos([id_recurso])
             return (True, (id_album,id_recurso))
     except Error as e:
         print(f"Error en la consulta 'borrar_recurso_album': {e}")
@@ -248,12 +313,17 @@ def salir_de_album(id_album: int, id_usuario: int):
         if res and res[0] == 'CREADOR':
              return False, "El creador no puede 'salir'. Debe eliminar el álbum."
 
+        # Antes de borrar: el que sale deja de ver el álbum y todo lo que contiene
+        consultasSincronizacion.registrar_cambios_albumes(cursor, [id_album], 'SALIR')
+        consultasSincronizacion.registrar_contenido_album(cursor, id_album, [id_usuario], 'SALIR')
         cursor.execute("DELETE FROM Miembro_Album WHERE id_album = %s AND id_persona = %s", (id_album, id_usuario))
         
         if cursor.rowcount == 0:
+            connection.rollback()
             return False, "No eras miembro de este álbum"
 
         connection.commit()
+        cacheAccesos.invalidar_usuario(id_usuario)
         return True, "Has salido del álbum correctamente."
 
     except Exception as e:
@@ -305,6 +375,8 @@ def aceptar_peticion_album(id_persona_invitadora: int, id_usuario_aceptando: int
         # Paso 3: Insertamos al miembro con el rol que tenía asignado
         query_insert = "INSERT INTO Miembro_Album (id_album, id_persona, rol) VALUES (%s, %s, %s);"
         cursor.execute(query_insert, (id_album, id_usuario_aceptando, rol_asignado))
+        consultasSincronizacion.registrar_cambios_albumes(cursor, [id_album], 'NUEVO_MIEMBRO')
+        consultasSincronizacion.registrar_contenido_album(cursor, id_album, [id_usuario_aceptando], 'NUEVO_MIEMBRO')
         connection.commit()
         return (True, "Invitación aceptada correctamente")
     except Exception as e:
@@ -346,14 +418,19 @@ def mover_album(id_album: int, id_nuevo_padre: int, id_persona: int):
         resultado = cursor.fetchone()
         if not resultado or resultado[0] not in ['CREADOR', 'ADMINISTRADOR']:
             return (False, "No tienes permisos suficientes para mover este álbum")
+        # Los miembros del padre antiguo dejan de ver la subcarpeta; los del nuevo la verán (registro tras mover)
+        consultasSincronizacion.registrar_cambios_albumes(cursor, [id_album], 'MOVER')
         # Paso 2:  Llamamos al procedimiento almacenado MoverAlbumSeguro
         args = [id_album, id_nuevo_padre, ""]
         resultado_proc = cursor.callproc('MoverAlbumSeguro', args)
         mensaje_salida = resultado_proc[2] # El resultado del OUT está en la última posición de la lista devuelta por callproc
         if mensaje_salida == 'OK':
+            consultasSincronizacion.registrar_cambios_albumes(cursor, [id_album], 'MOVER')
             connection.commit()
+            cacheEnlaces.invalidar_todo()
             return (True, "Álbum movido correctamente")
         else:
+            connection.rollback()
             return (False, mensaje_salida)
     except Error as e:
         if connection: connection.rollback()
@@ -389,10 +466,14 @@ def mover_recurso_de_album(id_recurso: int, id_album_origen: int, id_album_desti
         # Paso 2: Ejecutar
         if id_album_origen is not None and id_album_destino is not None:
             query = "UPDATE Recurso_Album SET id_album=%s WHERE id_recurso=%s AND id_album=%s"
+            consultasSincronizacion.registrar_cambios_recursos(cursor, [id_recurso], 'MOVER')
             cursor.execute(query, (id_album_destino, id_recurso, id_album_origen))
             if cursor.rowcount == 0:
+                connection.rollback()
                 return (False, "No se encontró el recurso en el álbum origen")
+            consultasSincronizacion.registrar_cambios_recursos(cursor, [id_recurso], 'MOVER')
             connection.commit()
+            cacheAccesos.invalidar_recursos([id_recurso])
             return (True, "Archivo movido correctamente")
         else:
             return (False, "Parámetros incorrectos para mover")
@@ -448,6 +529,10 @@ def eliminar_album_definitivamente(id_album: int, id_usuario: int):
         ids_recursos = [r[0] for r in recursos]
         rutas_fisicas_a_borrar = [r[1] for r in recursos if r[1]] # Guardamos rutas válidas
 
+        # Registro antes de borrar: después ya no quedan relaciones para saber a quién avisar
+        consultasSincronizacion.registrar_cambios_recursos(cursor, ids_recursos, 'ELIMINAR')
+        consultasSincronizacion.registrar_cambios_albumes(cursor, ids_albumes, 'ELIMINAR')
+
         # 4. BORRADO EN CASCADA (Orden importante para evitar errores de FK)
         
         if ids_recursos:
@@ -467,18 +552,17 @@ def eliminar_album_definitivamente(id_album: int, id_usuario: int):
         # D. Borrar los álbumes (MySQL suele requerir borrar hijos antes que padres si no hay CASCADE, 
         # pero al borrarlos por ID en lote suele funcionar si no hay restricciones cíclicas)
         cursor.execute(f"DELETE FROM Album WHERE id IN ({format_strings})", tuple_ids)
+        # Ficheros que ya no usa nadie (recuento con bloqueo, dentro de la transacción)
+        rutas_libres = consultasRecursos.enlaces_sin_referencias(cursor, rutas_fisicas_a_borrar)
 
         connection.commit()
+        cacheAccesos.invalidar_recursos(ids_recursos)
 
-        # 5. Borrado Físico (Solo si la transacción en BD fue exitosa)
+        # 5. Borrado Físico (Solo si la transacción en BD fue exitosa y nadie más usa el fichero)
         count_borrados = 0
-        for ruta in rutas_fisicas_a_borrar:
-            try:
-                if os.path.exists(ruta):
-                    os.remove(ruta)
-                    count_borrados += 1
-            except Exception as e:
-                print(f"Warning borrando archivo {ruta}: {e}")
+        for ruta in rutas_libres:
+            utilidadesFicheros.borrar_fichero_fisico(ruta)
+            count_borrados += 1
 
         return True, f"Eliminado álbum y {count_borrados} archivos definitivamente."
 
@@ -545,6 +629,7 @@ def hacer_rol_album(id_persona:int, id_persona_implicada:int, id_album:int ,nuev
             if rol_persona == "ADMINISTRADOR" and rol_persona_implicada in ["ADMINISTRADOR", "CREADOR"]:
                 return (False, "Un administrador no puede modificar a otro administrador o al creador")
             cursor.execute(query_3, valores_3)
+            consultasSincronizacion.registrar_cambios_albumes(cursor, [id_album], 'CAMBIAR_ROL')
             connection.commit()
             return (True, (id_album, None))
     except Error as e:
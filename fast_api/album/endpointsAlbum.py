@@ -2,6 +2,7 @@ from fastapi import APIRouter, HTTPException, Depends
 import fast_api.album.consultasAlbum as consultasAlbum
 import fast_api.seguridad.funcionesSeguridad as funcionesSeguridad
 from fast_api.album import modeloDatosAlbum
+import fast_api.utilidades.utilidadesFicheros as utilidadesFicheros
 import os
 router = APIRouter()
 
@@ -22,8 +23,8 @@ def obtener_mis_albumes(current_user_id: int = Depends(funcionesSeguridad.get_cu
 
 #-Endpoint 3. Usuario ve contenido de un album
 @router.get("/album/contenido/{id_album}")
-def ver_contenido_album(id_album: int, current_user_id: int = Depends(funcionesSeguridad.get_current_user_id)):
-    exito, recursos = consultasAlbum.obtener_recursos_album(id_album, current_user_id)
+async def ver_contenido_album(id_album: int, current_user_id: int = Depends(funcionesSeguridad.get_current_user_id)):
+    exito, recursos = await consultasAlbum.obtener_recursos_album_async(id_album, current_user_id)
     if not exito: 
         raise HTTPException(status_code=403, detail=str(recursos))
     return recursos
@@ -108,14 +109,8 @@ def borrar_album_endpoint(id_album: int, current_user_id: int = Depends(funcione
     conteo = 0
     if isinstance(resultado, list):
         for ruta in resultado:
-            try:
-                if os.path.exists(ruta): os.remove(ruta)
-                # Borrar thumb
-                ruta_thumb = ruta.replace("uploads", "thumbnails")
-                if os.path.exists(ruta_thumb): os.remove(ruta_thumb)
-                conteo += 1
-            except Exception as e:
-                print(f"Error borrando archivo físico: {e}")
+            utilidadesFicheros.borrar_fichero_fisico(ruta)
+            conteo += 1
     return {"mensaje": f"Álbum eliminado definitivamente. {conteo} archivos liberados."}
 
 #~Endpoint 14. Usuario ve los miembros de un album
@@ -1,7 +1,10 @@
 import os
+import time
 import mysql.connector
 from mysql.connector import pooling
+from mysql.connector.errors import PoolError
 from dotenv import load_dotenv
+from fast_api import metricasPool, perfiladorSQL
 load_dotenv()
 db_config = {
     'user': os.getenv('DB_USER'),
@@ -10,16 +13,41 @@ db_config = {
     'database': 'moiselincloud',
     'port': 3306
 }
+# Cuánto espera una petición a que quede libre una conexión antes de rendirse (con el pool lleno)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "32"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+ESPERA_REINTENTO = 0.05
+
 connection_pool = mysql.connector.pooling.MySQLConnectionPool(
     pool_name="moiselin_pool",
-    pool_size=32,
+    pool_size=DB_POOL_SIZE,
     pool_reset_session=True,
     **db_config
 )
 def get_connection():
-    try:
-        connection = connection_pool.get_connection()
-        return connection
-    except mysql.connector.Error as err:
-        print(f"Error obteniendo conexión del pool: {err}")
-        return None
\ No newline at end of file
+    """
+    Conexión del pool. Si está agotado no falla al momento: reintenta hasta DB_POOL_TIMEOUT segundos
+    y después lanza PoolError (es un mysql.connector.Error: lo recogen los except Error de las consultas).
+    La espera es un time.sleep: nunca llamarla desde un "async def" (usar run_in_threadpool o db_async).
+    La conexión va envuelta para las métricas (metricasPool): se usa igual que la original.
+    """
+    inicio = time.monotonic()
+    limite = inicio + DB_POOL_TIMEOUT
+    agotado = False
+    while True:
+        try:
+            conexion = perfiladorSQL.envolver(connection_pool.get_connection())
+            return metricasPool.medir(conexion, (time.monotonic() - inicio) * 1000)
+        except PoolError as err:
+            # mysql.connector no tiene cola de espera: el pool lanza PoolError en cuanto no queda ninguna libre
+            if not agotado:
+                agotado = True
+                metricasPool.anotar_agotamiento()
+            if time.monotonic() >= limite:
+                metricasPool.anotar_timeout((time.monotonic() - inicio) * 1000)
+                print(f"Error obteniendo conexión del pool: {err}")
+                raise PoolError(f"No hay conexiones libres en el pool tras {DB_POOL_TIMEOUT}s")
+            time.sleep(ESPERA_REINTENTO)
+
+def estadisticas_pool(umbral_fuga: float = metricasPool.UMBRAL_FUGA_SEGUNDOS) -> dict:
+    return metricasPool.estadisticas(DB_POOL_SIZE, umbral_fuga)
@@ -0,0 +1,83 @@
+import os
+import asyncio
+from contextlib import asynccontextmanager
+import aiomysql
+from fast_api import db, perfiladorSQL
+
+# Pool asíncrono (aiomysql) para los endpoints async de lectura más frecuentes (listados, galería, login).
+# Una petición que espera a la BD libera el event loop en vez de ocupar un hilo del threadpool de AnyIO.
+# Convive con el pool síncrono de db.py: mismas credenciales, sus propias conexiones.
+# Si no quedan conexiones libres, la petición espera en la cola del pool hasta DB_POOL_TIMEOUT segundos.
+#
+# Las conexiones en MySQL son DB_POOL_SIZE (síncrono) + DB_POOL_ASYNC_MAX: con los valores por defecto 40,
+# por debajo de max_connections (151) y sin gastar en la Pi memoria del servidor para sesiones ociosas.
+# Aquí bastan pocas: solo las usan lecturas cortas y ninguna retiene la conexión mientras espera otra cosa.
+
+DB_POOL_MIN = int(os.getenv("DB_POOL_ASYNC_MIN", "2"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_ASYNC_MAX", "8"))
+# MySQL cierra las conexiones inactivas (wait_timeout): se renuevan antes
+DB_POOL_RECICLAR = 3600
+
+Error = aiomysql.Error
+
+_pool = None
+_lock = asyncio.Lock()
+
+async def iniciar():
+    """Crea el pool (lo llama el lifespan de main.py; si no, se crea en el primer uso)"""
+    global _pool
+    async with _lock:
+        if _pool is None:
+            _pool = await aiomysql.create_pool(
+                host=db.db_config['host'],
+                port=db.db_config['port'],
+                user=db.db_config['user'],
+                password=db.db_config['password'],
+                db=db.db_config['database'],
+                minsize=DB_POOL_MIN,
+                maxsize=DB_POOL_MAX,
+                pool_recycle=DB_POOL_RECICLAR,
+                # Sin transacción abierta entre consultas: cada lectura ve los últimos datos confirmados
+                # (y el pool no tiene que descartar conexiones que vuelven con una transacción a medias)
+                autocommit=True,
+                charset='utf8mb4',
+            )
+    return _pool
+
+async def cerrar():
+    global _pool
+    async with _lock:
+        if _pool is not None:
+            _pool.close()
+            await _pool.wait_closed()
+            _pool = None
+
+@asynccontextmanager
+async def conexion():
+    """
+    async with db_async.conexion() as connection: ...
+    La conexión vuelve al pool al salir. Con el pool agotado más de DB_POOL_TIMEOUT segundos lanza
+    OperationalError (un aiomysql.Error, como los fallos de la propia consulta)
+    """
+    pool = _pool or await iniciar()
+    try:
+        connection = await asyncio.wait_for(pool.acquire(), timeout=db.DB_POOL_TIMEOUT)
+    except asyncio.TimeoutError:
+        print(f"Error obteniendo conexión del pool async: agotado ({pool.size}/{pool.maxsize})")
+        raise aiomysql.OperationalError(f"No hay conexiones libres en el pool tras {db.DB_POOL_TIMEOUT}s")
+    try:
+        yield connection
+    finally:
+        pool.release(connection)
+
+@asynccontextmanager
+async def cursor_dict():
+    """Atajo para las lecturas: cursor que devuelve diccionarios, como cursor(dictionary=True)"""
+    async with conexion() as connection:
+        async with connection.cursor(aiomysql.DictCursor) as cursor:
+            yield perfiladorSQL.envolver_async(cursor)
+
+def estadisticas() -> dict:
+    if _pool is None:
+        return {"iniciado": False}
+    return {"iniciado": True, "tamano": _pool.size, "libres": _pool.freesize, "maximo": _pool.maxsize}
@@ -0,0 +1,141 @@
+from contextlib import contextmanager
+from typing import Any, Iterable, List, Optional, Sequence
+from fast_api import db
+
+# Ejecutor común para las consultas: sustituye el bloque de siempre
+#     connection = None / try: get_connection, cursor ... / finally: cursor.close(); connection.close()
+# por un "with" que devuelve la conexión al pool pase lo que pase (return a mitad, excepción...):
+#
+#     with ejecutorSQL.conexion() as sql:           # lecturas (o escrituras con sql.commit())
+#         fila = sql.fetch_one("SELECT ... WHERE id = %s", (id,))
+#
+#     with ejecutorSQL.transaction() as sql:        # commit al salir, rollback si hay excepción
+#         sql.execute("UPDATE ...", (...))
+#
+# Los errores de MySQL (mysql.connector.Error) no se capturan aquí: cada consulta decide qué devolver.
+#
+# Lo usan consultasPersona, consultasSeguridad (la parte síncrona), reclamar_trabajo / fallar_trabajo,
+# contenido_visible y, en consultasRecursos, subir_recurso, reemplazar_recurso_simple y verificar_espacio_usuario.
+# consultasAlbum y el resto de consultas siguen con el bloque try/finally (todas cierran en el finally), igual
+# que migrar.py, que aplica DDL en autocommit. Las funciones nuevas de consultas se escriben con el ejecutor;
+# las que reciben el cursor de quien llama (encolar_trabajo, registrar_cambios_*) valen con los dos porque solo
+# usan execute().
+#
+# Sin sentencias preparadas en el servidor: el pool hace COM_RESET_CONNECTION al recibir cada conexión de
+# vuelta (pool_reset_session) y eso las cierra, así que solo durarían un "with", donde casi ninguna sentencia
+# se repite. Prepararlas costaría una ida y vuelta más sin ahorrar nada.
+
+class Ejecutor:
+    def __init__(self, connection):
+        self.connection = connection
+        self._cursor = None          # Cursor de texto (buffered, diccionarios) reutilizado
+        self.rowcount = 0
+        self.lastrowid = None
+
+    def _cursor_texto(self):
+        if self._cursor is None:
+            self._cursor = self.connection.cursor(dictionary=True, buffered=True)
+        return self._cursor
+
+    def _ejecutar(self, sql: str, params: Sequence = ()):
+        cursor = self._cursor_texto()
+        cursor.execute(sql, tuple(params))
+        return cursor
+
+    def _apuntar(self, cursor):
+        self.rowcount = cursor.rowcount
+        self.lastrowid = cursor.lastrowid
+
+    def fetch_all(self, sql: str, params: Sequence = ()) -> List[dict]:
+        cursor = self._ejecutar(sql, params)
+        filas = cursor.fetchall()
+        self._apuntar(cursor)
+        return filas
+
+    def fetch_one(self, sql: str, params: Sequence = ()) -> Optional[dict]:
+        cursor = self._ejecutar(sql, params)
+        fila = cursor.fetchone()
+        self._apuntar(cursor)
+        return fila
+
+    def fetch_value(self, sql: str, params: Sequence = ()) -> Any:
+        """Primera columna de la primera fila (COUNT, SUM...). None si no hay filas"""
+        fila = self.fetch_one(sql, params)
+        return next(iter(fila.values())) if fila else None
+
+    def execute(self, sql: str, params: Sequence = ()) -> int:
+        """INSERT / UPDATE / DELETE. Devuelve las filas afectadas (lastrowid queda en self.lastrowid)"""
+        cursor = self._ejecutar(sql, params)
+        self._apuntar(cursor)
+        return cursor.rowcount
+
+    def execute_many(self, sql: str, filas: Iterable[Sequence]) -> int:
+        """Misma sentencia con muchos parámetros. Los INSERT ... VALUES se juntan en un solo INSERT de varias filas"""
+        filas = [tuple(f) for f in filas]
+        if not filas:
+            return 0
+        cursor = self._cursor_texto()
+        cursor.executemany(sql, filas)
+        self._apuntar(cursor)
+        return cursor.rowcount
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def cerrar(self):
+        if self._cursor is not None:
+            try:
+                self._cursor.close()
+            except Exception as e:
+                print(f"Warning ejecutorSQL: error cerrando cursor: {e}")
+        self._cursor = None
+
+@contextmanager
+def conexion():
+    """Conexión del pool para lecturas. Lo que no se confirme con sql.commit() se descarta al devolverla"""
+    connection = db.get_connection()
+    ejecutor = Ejecutor(connection)
+    try:
+        yield ejecutor
+    finally:
+        ejecutor.cerrar()
+        connection.close()
+
+@contextmanager
+def transaction():
+    """Commit si el bloque termina bien (también con return), rollback si sale una excepción"""
+    connection = db.get_connection()
+    ejecutor = Ejecutor(connection)
+    try:
+        connection.autocommit = False
+        yield ejecutor
+        connection.commit()
+    except BaseException:
+        try:
+            connection.rollback()
+        except Exception as e:
+            print(f"Warning ejecutorSQL: error en rollback: {e}")
+        raise
+    finally:
+        ejecutor.cerrar()
+        connection.close()
+
+# Atajos para las consultas de una sola sentencia
+def fetch_one(sql: str, params: Sequence = ()) -> Optional[dict]:
+    with conexion() as ejecutor:
+        return ejecutor.fetch_one(sql, params)
+
+def fetch_all(sql: str, params: Sequence = ()) -> List[dict]:
+    with conexion() as ejecutor:
+        return ejecutor.fetch_all(sql, params)
+
+def fetch_value(sql: str, params: Sequence = ()) -> Any:
+    with conexion() as ejecutor:
+        return ejecutor.fetch_value(sql, params)
+
+def execute_many(sql: str, filas: Iterable[Sequence]) -> int:
+    with transaction() as ejecutor:
+        return ejecutor.execute_many(sql, filas)
@@ -1,15 +1,24 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.concurrency import run_in_threadpool
 import uvicorn
 import os
+from fast_api import db_async, metricasPool, perfiladorSQL
 import fast_api.persona.endpointsPersona as endpointsPersona
 import fast_api.album.endpointsAlbum as endpointsAlbum
 import fast_api.recurso.endpointsRecursos as endpointsRecursos
 import fast_api.recurso.endpointsEnlaces as endpointsEnlaces
+import fast_api.sincronizacion.endpointsSincronizacion as endpointsSincronizacion
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from contextlib import asynccontextmanager
 import fast_api.recurso.consultasRecursos as consultasRecursos
+import fast_api.utilidades.utilidadesFicheros as utilidadesFicheros
+import fast_api.utilidades.utilidadesTrabajos as utilidadesTrabajos
+import fast_api.utilidades.utilidadesMultimedia as utilidadesMultimedia
+import fast_api.recurso.consultasTrabajos as consultasTrabajos
+import fast_api.recurso.consultasEnlaces as consultasEnlaces
+import fast_api.sincronizacion.consultasSincronizacion as consultasSincronizacion
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 STATIC_DIR = os.path.join(BASE_DIR, "static")
@@ -18,9 +27,21 @@ STATIC_DIR = os.path.join(BASE_DIR, "static")
 async def lifespan(app: FastAPI):
     scheduler = AsyncIOScheduler()
     scheduler.add_job(consultasRecursos.purgar_papelera_automatica, 'interval', hours=24)
+    scheduler.add_job(utilidadesFicheros.limpiar_cargas_abandonadas, 'interval', hours=6)
+    scheduler.add_job(consultasTrabajos.purgar_trabajos_completados, 'interval', hours=24)
+    scheduler.add_job(consultasEnlaces.volcar_usos, 'interval', minutes=1)
+    scheduler.add_job(consultasSincronizacion.purgar_registro_cambios, 'interval', hours=24)
+    scheduler.add_job(metricasPool.avisar_fugas, 'interval', minutes=1)
     scheduler.start()
+    await db_async.iniciar()
+    utilidadesMultimedia.iniciar()
+    utilidadesTrabajos.iniciar_workers()
     yield
+    utilidadesTrabajos.detener_workers()
+    utilidadesMultimedia.detener()
     scheduler.shutdown()
+    await run_in_threadpool(consultasEnlaces.volcar_usos) # Las visitas a enlaces que aún no se habían escrito
+    await db_async.cerrar()
 
 app = FastAPI(
     title="MoiselinCloud API",
@@ -38,11 +59,16 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Las cabeceras del perfilador también tienen que verse desde la app web
+    expose_headers=["X-DB-Time", "X-DB-Queries"],
 )
+# Con DB_PERFILADOR apagado solo comprueba la bandera y pasa la petición
+app.add_middleware(perfiladorSQL.MiddlewarePerfilador)
 app.include_router(endpointsPersona.router)
 app.include_router(endpointsAlbum.router)
 app.include_router(endpointsRecursos.router)
 app.include_router(endpointsEnlaces.router)
+app.include_router(endpointsSincronizacion.router)
 @app.get("/")
 def home():
     return {"mensaje": "Bienvenido a la API de MoiselinCloud. Todo funciona correctamente."}
@@ -0,0 +1,207 @@
+import os
+import sys
+import time
+import threading
+import traceback
+import weakref
+from typing import Optional
+
+# Métricas del pool síncrono de db.py. Cada conexión que entrega get_connection va envuelta en
+# ConexionMedida: al cerrarla sabemos cuánto tiempo la tuvo quien la pidió (función y módulo).
+# Con esto se distingue "el pool está saturado" (esperas largas, agotamientos) de "una consulta es lenta"
+# (retención larga en una función concreta) y se ven las conexiones que nunca se devuelven.
+
+# Una conexión retenida más de esto se considera una posible fuga
+UMBRAL_FUGA_SEGUNDOS = float(os.getenv("POOL_UMBRAL_FUGA", "30"))
+# Marcos de pila que se guardan por conexión (sin leer el código fuente hasta que se pide el informe)
+PROFUNDIDAD_PILA = int(os.getenv("POOL_PROFUNDIDAD_PILA", "8"))
+# Límites (ms) de los histogramas; el último cubo es "más que el último límite"
+LIMITES_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# Módulos que piden la conexión en nombre de otro: se atribuye a la función que los llamó
+MODULOS_INTERMEDIOS = {"fast_api.ejecutorSQL", "contextlib"}
+
+class Histograma:
+    """Recuento por cubos, más total y máximo. No es thread-safe: se usa con _lock cogido"""
+    __slots__ = ("cubos", "cuenta", "total_ms", "maximo_ms")
+
+    def __init__(self):
+        self.cubos = [0] * (len(LIMITES_MS) + 1)
+        self.cuenta = 0
+        self.total_ms = 0.0
+        self.maximo_ms = 0.0
+
+    def anotar(self, ms: float):
+        indice = len(LIMITES_MS)
+        for i, limite in enumerate(LIMITES_MS):
+            if ms <= limite:
+                indice = i
+                break
+        self.cubos[indice] += 1
+        self.cuenta += 1
+        self.total_ms += ms
+        if ms > self.maximo_ms:
+            self.maximo_ms = ms
+
+    def percentil(self, p: float) -> Optional[float]:
+        """Límite superior del cubo donde cae el percentil (None si está vacío o cae en el último)"""
+        if not self.cuenta:
+            return None
+        objetivo = p * self.cuenta
+        acumulado = 0
+        for i, cantidad in enumerate(self.cubos):
+            acumulado += cantidad
+            if acumulado >= objetivo:
+                return LIMITES_MS[i] if i < len(LIMITES_MS) else None
+        return None
+
+    def resumen(self) -> dict:
+        etiquetas = [f"<={l}ms" for l in LIMITES_MS] + [f">{LIMITES_MS[-1]}ms"]
+        return {
+            "cuenta": self.cuenta,
+            "media_ms": round(self.total_ms / self.cuenta, 2) if self.cuenta else None,
+            "p50_ms": self.percentil(0.5),
+            "p95_ms": self.percentil(0.95),
+            "p99_ms": self.percentil(0.99),
+            "maximo_ms": round(self.maximo_ms, 2),
+            "cubos": dict(zip(etiquetas, self.cubos)),
+        }
+
+_lock = threading.Lock()
+_espera = Histograma()        # Tiempo dentro de get_connection
+_retencion = Histograma()     # Desde que se entrega hasta close()
+_por_funcion = {}             # "modulo.funcion" -> Histograma de retención
+_activas = {}                 # id de la conexión -> {"funcion", "desde", "hilo", "pila"}
+_contadores = {
+    "entregadas": 0,
+    "agotamientos": 0,         # Peticiones que encontraron el pool vacío y tuvieron que esperar
+    "timeouts": 0,             # ...y de ellas, las que se rindieron tras DB_POOL_TIMEOUT
+    "perdidas": 0,             # Conexiones que el recolector de basura se llevó sin que nadie hiciera close()
+}
+_fugas_avisadas = set()
+
+def _llamador(marco) -> str:
+    return f"{marco.f_globals.get('__name__', '?')}.{marco.f_code.co_name}"
+
+def anotar_agotamiento():
+    with _lock:
+        _contadores["agotamientos"] += 1
+
+def anotar_timeout(espera_ms: float):
+    with _lock:
+        _contadores["timeouts"] += 1
+        _espera.anotar(espera_ms)
+
+class ConexionMedida:
+    """
+    Envoltorio de PooledMySQLConnection: todo se delega en la conexión real salvo close(),
+    que además apunta el tiempo de retención. Los atributos (p.ej. autocommit) también se delegan.
+    """
+    __slots__ = ("_conexion", "_clave", "_desde", "_funcion", "_cerrada", "__weakref__")
+
+    def __init__(self, conexion, funcion: str, desde: float, clave: int):
+        object.__setattr__(self, "_conexion", conexion)
+        object.__setattr__(self, "_funcion", funcion)
+        object.__setattr__(self, "_desde", desde)
+        object.__setattr__(self, "_clave", clave)
+        object.__setattr__(self, "_cerrada", False)
+
+    def __getattr__(self, nombre):
+        return getattr(self._conexion, nombre)
+
+    def __setattr__(self, nombre, valor):
+        setattr(self._conexion, nombre, valor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if not self._cerrada:
+            object.__setattr__(self, "_cerrada", True)
+            _anotar_devolucion(self._clave, self._funcion, (time.monotonic() - self._desde) * 1000)
+        return self._conexion.close()
+
+def _anotar_devolucion(clave: int, funcion: str, ms: float):
+    with _lock:
+        _activas.pop(clave, None)
+        _fugas_avisadas.discard(clave)
+        _retencion.anotar(ms)
+        historial = _por_funcion.get(funcion)
+        if historial is None:
+            historial = _por_funcion[funcion] = Histograma()
+        historial.anotar(ms)
+
+def _descartada(clave: int):
+    """La ConexionMedida se destruyó: si seguía activa nadie la cerró (fuga real)"""
+    with _lock:
+        if _activas.pop(clave, None) is not None:
+            _contadores["perdidas"] += 1
+        _fugas_avisadas.discard(clave)
+
+_siguiente_clave = 0
+
+def medir(conexion, espera_ms: float, profundidad: int = 2) -> ConexionMedida:
+    """Envuelve la conexión recién sacada del pool. 'profundidad' = marcos hasta quien llamó a get_connection"""
+    global _siguiente_clave
+    marco = sys._getframe(profundidad)
+    while marco.f_back is not None and marco.f_globals.get("__name__") in MODULOS_INTERMEDIOS:
+        marco = marco.f_back
+    pila = traceback.StackSummary.extract(traceback.walk_stack(marco), limit=PROFUNDIDAD_PILA, lookup_lines=False)
+    funcion = _llamador(marco)
+    ahora = time.monotonic()
+    with _lock:
+        _siguiente_clave += 1
+        clave = _siguiente_clave
+        _contadores["entregadas"] += 1
+        _espera.anotar(espera_ms)
+        _activas[clave] = {"funcion": funcion, "desde": ahora, "hilo": threading.current_thread().name, "pila": pila}
+    medida = ConexionMedida(conexion, funcion, ahora, clave)
+    weakref.finalize(medida, _descartada, clave)
+    return medida
+
+def fugas(umbral: float = UMBRAL_FUGA_SEGUNDOS) -> list:
+    """Conexiones retenidas más de 'umbral' segundos, con la pila de quien las pidió"""
+    ahora = time.monotonic()
+    with _lock:
+        activas = [(clave, dict(info)) for clave, info in _activas.items() if ahora - info["desde"] >= umbral]
+    resultado = []
+    for clave, info in sorted(activas, key=lambda a: a[1]["desde"]):
+        resultado.append({
+            "id": clave,
+            "funcion": info["funcion"],
+            "hilo": info["hilo"],
+            "segundos": round(ahora - info["desde"], 1),
+            "pila": [f"{m.filename}:{m.lineno} en {m.name}" for m in reversed(info["pila"])],
+        })
+    return resultado
+
+def avisar_fugas():
+    """Para el scheduler: imprime una vez cada conexión que pasa del umbral"""
+    for fuga in fugas():
+        with _lock:
+            if fuga["id"] in _fugas_avisadas:
+                continue
+            _fugas_avisadas.add(fuga["id"])
+        print(f"Warning pool: conexión retenida {fuga['segundos']}s por {fuga['funcion']} ({fuga['hilo']})\n  "
+              + "\n  ".join(fuga["pila"]))
+
+def estadisticas(tamano_pool: int, umbral: float = UMBRAL_FUGA_SEGUNDOS) -> dict:
+    with _lock:
+        en_uso = len(_activas)
+        datos = {
+            "tamano": tamano_pool,
+            "en_uso": en_uso,
+            "libres": max(0, tamano_pool - en_uso),
+            **_contadores,
+            "espera": _espera.resumen(),
+            "retencion": _retencion.resumen(),
+            # Las que más tiempo acumulan primero: ahí es donde se va el pool
+            "por_funcion": {
+                funcion: historial.resumen()
+                for funcion, historial in sorted(_por_funcion.items(), key=lambda f: -f[1].total_ms)
+            },
+        }
+    datos["fugas"] = fugas(umbral)
+    return datos
@@ -0,0 +1,205 @@
+"""
+Migraciones del esquema: actualiza una base de datos ya desplegada sin borrar tablas (creacion.sql empieza
+con DROP TABLE y solo sirve para instalaciones nuevas).
+
+Uso (desde la raíz del repositorio):
+    python -m fast_api.migrar              # aplica las pendientes de modelado_base_datos/migraciones/
+    python -m fast_api.migrar --estado     # lista aplicadas y pendientes sin tocar nada
+    python -m fast_api.migrar --explain    # EXPLAIN de las consultas más usadas (qué índice elige MySQL)
+
+Cada fichero NNN_descripcion.sql es una migración; su número es la versión. Las aplicadas quedan en
+Version_Esquema. Una sentencia que choca con algo que ya existe (tabla, columna o índice creados por una
+versión reciente de creacion.sql) se da por aplicada: así la misma migración vale para una BD antigua y
+para una recién creada. MySQL hace commit implícito con cada DDL: si una migración falla a medias, al
+repetirla las sentencias ya hechas se saltan por ese mismo motivo.
+"""
+import argparse
+import os
+import re
+import time
+from mysql.connector import Error
+from fast_api import db
+
+MIGRACIONES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                               "modelado_base_datos", "migraciones")
+# ER_TABLE_EXISTS_ERROR, ER_DUP_FIELDNAME, ER_DUP_KEYNAME, ER_FK_DUP_NAME
+ERRORES_YA_APLICADA = {1050, 1060, 1061, 1826}
+
+_SQL_VERSION_ESQUEMA = """
+    CREATE TABLE IF NOT EXISTS Version_Esquema (
+        version INT PRIMARY KEY,
+        nombre VARCHAR(200) NOT NULL,
+        fecha_aplicada DATETIME DEFAULT CURRENT_TIMESTAMP,
+        duracion_ms INT NOT NULL
+    ) ENGINE=InnoDB
+"""
+
+def listar_migraciones() -> list:
+    """[(version, nombre_fichero, ruta)] ordenadas por versión"""
+    migraciones = []
+    for nombre in os.listdir(MIGRACIONES_DIR):
+        coincide = re.match(r"^(\d+)_.+\.sql$", nombre)
+        if coincide:
+            migraciones.append((int(coincide.group(1)), nombre, os.path.join(MIGRACIONES_DIR, nombre)))
+    migraciones.sort()
+    versiones = [m[0] for m in migraciones]
+    if len(versiones) != len(set(versiones)):
+        raise SystemExit("Hay dos migraciones con el mismo número de versión")
+    return migraciones
+
+def sentencias(ruta: str) -> list:
+    """Separa el fichero en sentencias (sin comentarios '--'). Las migraciones no llevan procedimientos"""
+    with open(ruta, encoding="utf-8") as f:
+        texto = "\n".join(re.sub(r"--.*$", "", linea) for linea in f.read().splitlines())
+    return [s.strip() for s in texto.split(";") if s.strip()]
+
+def versiones_aplicadas(cursor) -> set:
+    cursor.execute(_SQL_VERSION_ESQUEMA)
+    cursor.execute("SELECT version FROM Version_Esquema")
+    return {fila[0] for fila in cursor.fetchall()}
+
+def aplicar(cursor, version: int, nombre: str, ruta: str):
+    inicio = time.monotonic()
+    for sentencia in sentencias(ruta):
+        try:
+            cursor.execute(sentencia)
+        except Error as e:
+            if e.errno in ERRORES_YA_APLICADA:
+                print(f"    ya estaba: {e.msg}")
+                continue
+            raise
+    duracion_ms = int((time.monotonic() - inicio) * 1000)
+    cursor.execute(
+        "INSERT INTO Version_Esquema (version, nombre, duracion_ms) VALUES (%s, %s, %s)",
+        (version, nombre, duracion_ms)
+    )
+    return duracion_ms
+
+def migrar(solo_estado: bool = False):
+    connection = None
+    cursor = None
+    try:
+        connection = db.get_connection()
+        connection.autocommit = True
+        cursor = connection.cursor()
+        aplicadas = versiones_aplicadas(cursor)
+        pendientes = [m for m in listar_migraciones() if m[0] not in aplicadas]
+        for version, nombre, _ in listar_migraciones():
+            print(f"  {'[x]' if version in aplicadas else '[ ]'} {nombre}")
+        if solo_estado or not pendientes:
+            print("Esquema al día" if not pendientes else f"{len(pendientes)} migración(es) pendiente(s)")
+            return
+        for version, nombre, ruta in pendientes:
+            print(f"Aplicando {nombre}...")
+            duracion_ms = aplicar(cursor, version, nombre, ruta)
+            print(f"    OK ({duracion_ms} ms)")
+    except Error as e:
+        # Lo aplicado hasta aquí queda registrado: al volver a lanzar se sigue desde la que falló
+        raise SystemExit(f"Error migrando: {e}")
+    finally:
+        if cursor: cursor.close()
+        if connection: connection.close()
+
+#-------------------------------------------------------------------------------------------------------
+#                                  EXPLAIN DE LAS CONSULTAS CALIENTES
+#--------------------------------------------------------------------------------------------------------
+# Las consultas son las mismas que ejecutan los módulos consultas* (importadas cuando son constantes);
+# los parámetros salen de datos reales: el usuario con más recursos, uno de sus álbumes y un enlace.
+
+def _consultas_calientes(muestra: dict) -> list:
+    import fast_api.recurso.consultasRecursos as consultasRecursos
+    import fast_api.album.consultasAlbum as consultasAlbum
+    import fast_api.recurso.consultasEnlaces as consultasEnlaces
+    u, r, a, e = muestra["usuario"], muestra["recurso"], muestra["album"], muestra["enlace"]
+    return [
+        ("obtener_recursos (listado completo)", consultasRecursos._SQL_RECURSOS_USUARIO, (u, u)),
+        ("obtener_recurso_por_id (cada miniatura/archivo)", consultasRecursos._SQL_RECURSO_CON_ACCESO, (r, u, u, u)),
+        ("obtener_recursos_album", consultasAlbum._SQL_RECURSOS_ALBUM, (a,)),
+        ("albumes del usuario (obtener_albumes_usuario)", """
+            SELECT A.id, A.nombre, MA.rol FROM Album A JOIN Miembro_Album MA ON A.id = MA.id_album
+            WHERE MA.id_persona = %s
+        """, (u,)),
+        ("subálbumes (mover_album, árbol de enlaces)", "SELECT id FROM Album WHERE id_album_padre = %s", (a,)),
+        ("compartidos conmigo", """
+            SELECT r.id FROM Recurso r JOIN Recurso_Compartido rc ON r.id = rc.id_recurso WHERE rc.id_receptor = %s
+        """, (u,)),
+        ("verificar_espacio_usuario (cuota, cada subida)", """
+            SELECT P.almacenamiento_maximo, COALESCE(SUM(R.tamano), 0) as usado
+            FROM Persona P
+            LEFT JOIN Recurso R ON P.id = R.id_creador AND R.fecha_eliminacion IS NULL
+            WHERE P.id = %s
+            GROUP BY P.id
+        """, (u,)),
+        ("check_recurso_existe_en_album (cada subida)", """
+            SELECT r.id FROM Recurso r
+            WHERE r.id_creador = %s AND r.nombre = %s AND r.fecha_eliminacion IS NULL
+              AND NOT EXISTS (SELECT 1 FROM Recurso_Album ra WHERE ra.id_recurso = r.id)
+            LIMIT 1
+        """, (u, muestra["nombre"])),
+        ("papelera del usuario", """
+            SELECT id FROM Recurso WHERE id_creador = %s AND fecha_eliminacion IS NOT NULL ORDER BY fecha_eliminacion DESC
+        """, (u,)),
+        ("purgar_papelera_automatica", """
+            SELECT id FROM Recurso WHERE fecha_eliminacion IS NOT NULL AND fecha_eliminacion < DATE_SUB(NOW(), INTERVAL %s DAY)
+        """, (30,)),
+        ("contenido de un enlace (CTE recursiva)", consultasEnlaces._SQL_CONTENIDO + """
+            SELECT Contenido.carpeta, R.id FROM Contenido JOIN Recurso R ON R.id = Contenido.id_recurso
+            WHERE R.fecha_eliminacion IS NULL ORDER BY Contenido.carpeta, R.nombre, R.id LIMIT 100
+        """, (e, e)),
+        ("sincronización (/sync)", """
+            SELECT seq, entidad, id_entidad, operacion FROM Registro_Cambios
+            WHERE id_persona = %s AND seq > %s ORDER BY seq LIMIT 1001
+        """, (u, 0)),
+    ]
+
+def _muestra(cursor) -> dict:
+    def valor(sql, params=()):
+        cursor.execute(sql, params)
+        fila = cursor.fetchone()
+        return fila[0] if fila else 0
+    usuario = valor("SELECT id_creador FROM Recurso GROUP BY id_creador ORDER BY COUNT(*) DESC LIMIT 1")
+    return {
+        "usuario": usuario,
+        "recurso": valor("SELECT MAX(id) FROM Recurso WHERE id_creador = %s", (usuario,)),
+        "nombre": valor("SELECT nombre FROM Recurso WHERE id_creador = %s LIMIT 1", (usuario,)) or "",
+        "album": valor("SELECT MIN(id_album) FROM Miembro_Album WHERE id_persona = %s", (usuario,)),
+        "enlace": valor("SELECT MAX(id) FROM EnlacePublico"),
+    }
+
+def explicar():
+    connection = None
+    cursor = None
+    try:
+        connection = db.get_connection()
+        cursor = connection.cursor(dictionary=True, buffered=True)
+        cursor_muestra = connection.cursor(buffered=True)
+        muestra = _muestra(cursor_muestra)
+        cursor_muestra.close()
+        print(f"Datos de muestra: {muestra}\n")
+        for titulo, sql, params in _consultas_calientes(muestra):
+            cursor.execute("EXPLAIN " + sql.strip().rstrip(";"), params)
+            print(f"== {titulo}")
+            print(f"   {'tabla':<22} {'tipo':<8} {'índice':<32} {'filas':>8}  extra")
+            for fila in cursor.fetchall():
+                print(f"   {str(fila['table']):<22} {str(fila['type']):<8} {str(fila['key']):<32} "
+                      f"{str(fila['rows']):>8}  {fila['Extra'] or ''}")
+            print()
+        # Tipo ALL o "Using filesort" en una tabla grande = falta un índice
+    except Error as e:
+        raise SystemExit(f"Error en EXPLAIN: {e}")
+    finally:
+        if cursor: cursor.close()
+        if connection: connection.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Migraciones del esquema de MoiselinCloud")
+    parser.add_argument("--estado", action="store_true", help="Solo listar aplicadas y pendientes")
+    parser.add_argument("--explain", action="store_true", help="EXPLAIN de las consultas más usadas")
+    args = parser.parse_args()
+    if args.explain:
+        explicar()
+    else:
+        migrar(solo_estado=args.estado)
+
+if __name__ == "__main__":
+    main()
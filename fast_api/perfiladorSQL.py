@@ -0,0 +1,315 @@
+import os
+import re
+import time
+import logging
+import threading
+from contextvars import ContextVar
+from functools import lru_cache
+from logging.handlers import RotatingFileHandler
+from typing import Optional
+
+# Perfilador de consultas: cuánto tarda cada sentencia, cuántas filas devuelve y qué endpoint la lanzó.
+# Se activa con DB_PERFILADOR=1 (o en caliente desde /admin/perfilador). Apagado, el único coste es
+# comprobar la bandera al pedir un cursor y al empezar cada petición.
+#
+# Las sentencias se agrupan por huella (el SQL sin literales: "WHERE id = ?", "IN (?+)") y por ruta
+# (la plantilla de FastAPI, p.ej. /album/contenido/{id_album}). "por_peticion" alto en una huella = N+1.
+# Las que pasan de UMBRAL_LENTA_MS van además al log rotativo de consultas lentas.
+
+activo = os.getenv("DB_PERFILADOR", "0").strip().lower() in ("1", "true", "si", "sí")
+UMBRAL_LENTA_MS = float(os.getenv("DB_PERFILADOR_UMBRAL_MS", "200"))
+LOG_LENTAS = os.getenv(
+    "DB_PERFILADOR_LOG",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "consultas_lentas.log")
+)
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_COPIAS = 3
+# Huellas distintas que se guardan por ruta (las de menos tiempo total se descartan al informar)
+MAX_HUELLAS_INFORME = 20
+SIN_PETICION = "(fondo)"  # Scheduler, workers de procesado...
+SIN_RUTA = "(sin ruta)"   # 404 y estáticos: con la URL de cada uno como clave _por_ruta crecería sin límite
+
+# Estado de la petición en curso: lo crea el middleware y lo heredan los hilos del threadpool (contextvars)
+_peticion: ContextVar[Optional[dict]] = ContextVar("perfilador_peticion", default=None)
+
+_lock = threading.Lock()
+_por_ruta = {}  # ruta -> {"peticiones", "consultas", "total_ms", "huellas": {huella: estadística}}
+_logger = None
+
+#-------------------------------------------------------------------------------------------------------
+#                                              HUELLAS
+#--------------------------------------------------------------------------------------------------------
+_RE_COMENTARIOS = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_RE_CADENAS = re.compile(r"'(?:[^'\\]|\\.)*'")
+_RE_NUMEROS = re.compile(r"\b\d+(?:\.\d+)?\b")
+_RE_MARCADORES = re.compile(r"%s|%\(\w+\)s")
+_RE_LISTAS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_RE_VALUES = re.compile(r"(VALUES\s*\(\?\+?\))(?:\s*,\s*\(\?\+?\))+", re.I)
+_RE_ESPACIOS = re.compile(r"\s+")
+
+@lru_cache(maxsize=2048)
+def huella(sql: str) -> str:
+    """Mismo SQL con distintos valores o distinto número de elementos en un IN -> misma huella"""
+    texto = _RE_COMENTARIOS.sub(" ", sql)
+    texto = _RE_CADENAS.sub("?", texto)
+    texto = _RE_MARCADORES.sub("?", texto)
+    texto = _RE_NUMEROS.sub("?", texto)
+    texto = _RE_LISTAS.sub("(?+)", texto)
+    texto = _RE_VALUES.sub(r"\1+", texto)
+    return _RE_ESPACIOS.sub(" ", texto).strip()
+
+def _num_parametros(params) -> int:
+    if not params:
+        return 0
+    return len(params)
+
+#-------------------------------------------------------------------------------------------------------
+#                                              REGISTRO
+#--------------------------------------------------------------------------------------------------------
+
+def _log_lentas() -> logging.Logger:
+    global _logger
+    if _logger is None:
+        with _lock:
+            if _logger is None:
+                logger = logging.getLogger("moiselin.consultas_lentas")
+                logger.setLevel(logging.INFO)
+                logger.propagate = False
+                try:
+                    os.makedirs(os.path.dirname(LOG_LENTAS), exist_ok=True)
+                    manejador = RotatingFileHandler(LOG_LENTAS, maxBytes=LOG_MAX_BYTES, backupCount=LOG_COPIAS, encoding="utf-8")
+                except OSError as e:
+                    print(f"Warning perfilador: no se puede abrir {LOG_LENTAS} ({e}), las lentas van a la consola")
+                    manejador = logging.StreamHandler()
+                manejador.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+                logger.addHandler(manejador)
+                _logger = logger
+    return _logger
+
+def _nueva_estadistica() -> dict:
+    return {"llamadas": 0, "total_ms": 0.0, "max_ms": 0.0, "filas": 0, "parametros": 0}
+
+def _sumar(estadistica: dict, ms: float, filas: int, parametros: int):
+    estadistica["llamadas"] += 1
+    estadistica["total_ms"] += ms
+    estadistica["filas"] += max(filas, 0)
+    estadistica["parametros"] += parametros
+    if ms > estadistica["max_ms"]:
+        estadistica["max_ms"] = ms
+
+def _volcar(ruta: str, consultas: list, peticiones: int):
+    """Suma al agregado global las sentencias de una petición (o una suelta fuera de petición)"""
+    with _lock:
+        datos = _por_ruta.get(ruta)
+        if datos is None:
+            datos = _por_ruta[ruta] = {"peticiones": 0, "consultas": 0, "total_ms": 0.0, "huellas": {}}
+        datos["peticiones"] += peticiones
+        for consulta in consultas:
+            datos["consultas"] += 1
+            datos["total_ms"] += consulta["ms"]
+            estadistica = datos["huellas"].get(consulta["huella"])
+            if estadistica is None:
+                estadistica = datos["huellas"][consulta["huella"]] = _nueva_estadistica()
+            _sumar(estadistica, consulta["ms"], consulta["filas"], consulta["parametros"])
+
+def _registrar(sql: str, parametros: int, filas: int, ms: float) -> dict:
+    consulta = {"huella": huella(sql), "parametros": parametros, "filas": filas, "ms": ms}
+    peticion = _peticion.get()
+    if ms >= UMBRAL_LENTA_MS:
+        origen = f"{peticion['metodo']} {peticion['camino']}" if peticion else SIN_PETICION
+        _log_lentas().info(f"{ms:.1f}ms filas={filas if filas >= 0 else '?'} params={parametros} [{origen}] {consulta['huella']}")
+    if peticion is not None:
+        peticion["consultas"].append(consulta)
+    else:
+        _volcar(SIN_PETICION, [consulta], 0)
+    return consulta
+
+#-------------------------------------------------------------------------------------------------------
+#                                      ENVOLTORIOS DE CONEXIÓN Y CURSOR
+#--------------------------------------------------------------------------------------------------------
+
+class CursorPerfilado:
+    """Mide execute / executemany / callproc. Las filas leídas después (fetch*) se suman a la última sentencia"""
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._ultima = None
+
+    def __getattr__(self, nombre):
+        return getattr(self._cursor, nombre)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def _medir(self, sql: str, parametros: int, ejecutar):
+        inicio = time.perf_counter()
+        resultado = ejecutar()
+        ms = (time.perf_counter() - inicio) * 1000
+        # Cursores buffered o escrituras: rowcount ya es definitivo. Sin buffer vale -1 hasta leer
+        filas = self._cursor.rowcount if self._cursor.rowcount is not None else -1
+        self._ultima = _registrar(sql, parametros, filas, ms)
+        self._ultima["contar_filas"] = filas < 0
+        return resultado
+
+    def execute(self, sql, params=None, *args, **kwargs):
+        return self._medir(sql, _num_parametros(params), lambda: self._cursor.execute(sql, params, *args, **kwargs))
+
+    def executemany(self, sql, filas):
+        filas = list(filas)
+        return self._medir(sql, sum(_num_parametros(f) for f in filas), lambda: self._cursor.executemany(sql, filas))
+
+    def callproc(self, nombre, args=()):
+        return self._medir(f"CALL {nombre}", _num_parametros(args), lambda: self._cursor.callproc(nombre, args))
+
+    def _leidas(self, inicio: float, cantidad: int):
+        if self._ultima is not None:
+            self._ultima["ms"] += (time.perf_counter() - inicio) * 1000
+            if self._ultima.get("contar_filas"):
+                self._ultima["filas"] = max(self._ultima["filas"], 0) + cantidad
+
+    def fetchall(self):
+        inicio = time.perf_counter()
+        filas = self._cursor.fetchall()
+        self._leidas(inicio, len(filas))
+        return filas
+
+    def fetchone(self):
+        inicio = time.perf_counter()
+        fila = self._cursor.fetchone()
+        self._leidas(inicio, 1 if fila is not None else 0)
+        return fila
+
+    def fetchmany(self, *args, **kwargs):
+        inicio = time.perf_counter()
+        filas = self._cursor.fetchmany(*args, **kwargs)
+        self._leidas(inicio, len(filas))
+        return filas
+
+class ConexionPerfilada:
+    """Conexión que entrega cursores perfilados; el resto (commit, autocommit, close...) se delega"""
+    __slots__ = ("_conexion",)
+
+    def __init__(self, conexion):
+        object.__setattr__(self, "_conexion", conexion)
+
+    def __getattr__(self, nombre):
+        return getattr(self._conexion, nombre)
+
+    def __setattr__(self, nombre, valor):
+        setattr(self._conexion, nombre, valor)
+
+    def cursor(self, *args, **kwargs):
+        return CursorPerfilado(self._conexion.cursor(*args, **kwargs))
+
+def envolver(conexion):
+    return ConexionPerfilada(conexion) if activo else conexion
+
+class CursorPerfiladoAsync:
+    """Lo mismo para los cursores de aiomysql (db_async)"""
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._ultima = None
+
+    def __getattr__(self, nombre):
+        return getattr(self._cursor, nombre)
+
+    async def execute(self, sql, params=None):
+        inicio = time.perf_counter()
+        resultado = await self._cursor.execute(sql, params)
+        ms = (time.perf_counter() - inicio) * 1000
+        # aiomysql lee el resultado entero en execute: rowcount ya es el número de filas
+        self._ultima = _registrar(sql, _num_parametros(params), self._cursor.rowcount, ms)
+        return resultado
+
+    async def fetchall(self):
+        return await self._cursor.fetchall()
+
+    async def fetchone(self):
+        return await self._cursor.fetchone()
+
+def envolver_async(cursor):
+    return CursorPerfiladoAsync(cursor) if activo else cursor
+
+#-------------------------------------------------------------------------------------------------------
+#                                               MIDDLEWARE
+#--------------------------------------------------------------------------------------------------------
+
+class MiddlewarePerfilador:
+    """
+    Middleware ASGI: abre el registro de la petición, añade X-DB-Time (ms) y X-DB-Queries a la respuesta
+    y, al terminar, suma sus sentencias a la plantilla de ruta que resolvió FastAPI.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not activo:
+            await self.app(scope, receive, send)
+            return
+        peticion = {"metodo": scope.get("method", ""), "camino": scope.get("path", ""), "consultas": []}
+        token = _peticion.set(peticion)
+
+        async def send_con_cabeceras(mensaje):
+            if mensaje["type"] == "http.response.start":
+                consultas = peticion["consultas"]
+                total_ms = sum(c["ms"] for c in consultas)
+                cabeceras = list(mensaje.get("headers", []))
+                cabeceras.append((b"x-db-time", f"{total_ms:.1f}".encode()))
+                cabeceras.append((b"x-db-queries", str(len(consultas)).encode()))
+                mensaje = {**mensaje, "headers": cabeceras}
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, send_con_cabeceras)
+        finally:
+            _peticion.reset(token)
+            plantilla = getattr(scope.get("route"), "path", None)
+            _volcar(f"{peticion['metodo']} {plantilla}" if plantilla else SIN_RUTA, peticion["consultas"], 1)
+
+#-------------------------------------------------------------------------------------------------------
+#                                                INFORME
+#--------------------------------------------------------------------------------------------------------
+
+def activar(valor: bool):
+    global activo
+    activo = valor
+
+def reiniciar():
+    with _lock:
+        _por_ruta.clear()
+
+def estadisticas() -> dict:
+    with _lock:
+        rutas = []
+        for ruta, datos in _por_ruta.items():
+            peticiones = datos["peticiones"]
+            huellas = sorted(datos["huellas"].items(), key=lambda h: -h[1]["total_ms"])[:MAX_HUELLAS_INFORME]
+            rutas.append({
+                "ruta": ruta,
+                "peticiones": peticiones,
+                "consultas": datos["consultas"],
+                "total_ms": round(datos["total_ms"], 1),
+                "consultas_por_peticion": round(datos["consultas"] / peticiones, 1) if peticiones else None,
+                "ms_por_peticion": round(datos["total_ms"] / peticiones, 1) if peticiones else None,
+                "sentencias": [
+                    {
+                        "huella": texto,
+                        "llamadas": e["llamadas"],
+                        # Más de 1 por petición en un SELECT por id suele ser un bucle (N+1)
+                        "por_peticion": round(e["llamadas"] / peticiones, 1) if peticiones else None,
+                        "total_ms": round(e["total_ms"], 1),
+                        "media_ms": round(e["total_ms"] / e["llamadas"], 2),
+                        "max_ms": round(e["max_ms"], 1),
+                        "filas": e["filas"],
+                        "parametros": e["parametros"],
+                    }
+                    for texto, e in huellas
+                ],
+            })
+    rutas.sort(key=lambda r: -r["total_ms"])
+    return {"activo": activo, "umbral_lenta_ms": UMBRAL_LENTA_MS, "log_lentas": LOG_LENTAS, "rutas": rutas}
@@ -1,9 +1,11 @@
 from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.concurrency import run_in_threadpool
 from passlib.context import CryptContext
 import fast_api.persona.consultasPersona as consultasPersona
 import fast_api.seguridad.consultasSeguridad as consultasSeguridad
 import fast_api.seguridad.funcionesSeguridad as funcionesSeguridad
 import fast_api.persona.modeloDatosPersona as modeloDatos
+from fast_api import db, db_async, metricasPool, perfiladorSQL
 
 router = APIRouter()
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -37,19 +39,21 @@ def registrar_usuario(usuario: modeloDatos.PersonaRegistro):
 
 #~Endpoint 3. Loggeo de Usuario
 @router.post("/persona/login")
-def login_usuario(datos: modeloDatos.Login, request: Request):
+async def login_usuario(datos: modeloDatos.Login, request: Request):
     client_ip = request.client.host
-    bloqueado, msg = consultasSeguridad.verificar_ip_bloqueada(client_ip)
+    bloqueado, msg = await consultasSeguridad.verificar_ip_bloqueada_async(client_ip)
     if not bloqueado: raise HTTPException(status_code=429, detail=msg)
-    exito, usuario_db = consultasPersona.verificar_credenciales(datos.correo)
+    exito, usuario_db = await consultasPersona.verificar_credenciales_async(datos.correo)
     valido = False
     if exito and usuario_db:
-        if pwd_context.verify(datos.contra, usuario_db['contrasena']):
+        # bcrypt es CPU pura (~decenas de ms): fuera del event loop
+        if await run_in_threadpool(pwd_context.verify, datos.contra, usuario_db['contrasena']):
             valido = True
     if not valido:
-        consultasSeguridad.registrar_intento_fallido(client_ip)
+        # Escritura con transacción (SELECT + UPDATE): se queda en el pool síncrono
+        await run_in_threadpool(consultasSeguridad.registrar_intento_fallido, client_ip)
         raise HTTPException(status_code=401, detail="Credenciales incorrectas")
-    consultasSeguridad.limpiar_intentos(client_ip)
+    await consultasSeguridad.limpiar_intentos_async(client_ip)
     token = funcionesSeguridad.crear_token_acceso(
         data={
             "sub": str(usuario_db['id']), 
@@ -116,6 +120,27 @@ def cambiar_cuota_usuario(datos: modeloDatos.CambioCuota, admin_id: int = Depend
     if not exito: raise HTTPException(status_code=400, detail=msg)
     return {"mensaje": msg}
 
+#~Endpoint 10b. Estado del pool de conexiones: esperas, retención por función, agotamientos y posibles fugas
+@router.get("/admin/pool")
+def estado_pool(umbral_fuga: float = metricasPool.UMBRAL_FUGA_SEGUNDOS, admin_id: int = Depends(requerir_admin)):
+    return {
+        "pool": db.estadisticas_pool(umbral_fuga),
+        "pool_async": db_async.estadisticas(),
+    }
+
+#~Endpoint 10c. Perfilador de consultas: tiempo y número de sentencias por ruta y huella SQL
+@router.get("/admin/perfilador")
+def ver_perfilador(admin_id: int = Depends(requerir_admin)):
+    return perfiladorSQL.estadisticas()
+
+#~Endpoint 10d. Encender / apagar el perfilador en caliente (reiniciar=true borra lo acumulado)
+@router.put("/admin/perfilador")
+def cambiar_perfilador(activo: bool, reiniciar: bool = False, admin_id: int = Depends(requerir_admin)):
+    perfiladorSQL.activar(activo)
+    if reiniciar:
+        perfiladorSQL.reiniciar()
+    return {"activo": perfiladorSQL.activo}
+
 #~Endpoint 11. Sirve para que un usuario pueda ver el almacenamiento restante
 @router.get("/persona/almacenamiento")
 def ver_mi_almacenamiento(current_user_id: int = Depends(funcionesSeguridad.get_current_user_id)):
@@ -0,0 +1,77 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional, Any
+import fast_api.seguridad.cacheAccesos as cacheAccesos
+
+# Caché en memoria de los enlaces públicos (/s/{token}). Un enlace que circula por un grupo de WhatsApp
+# recibe cientos de visitas en un minuto y todas piden lo mismo:
+#   ("enlace", token)            -> fila de EnlacePublico (caducidad, hash de la contraseña...)
+#   ("contenido", token, pagina) -> página del contenido ya resuelto (items, totales)
+#   ("html", token, pagina)      -> página renderizada, solo para enlaces sin contraseña
+# Saber qué enlaces contienen un recurso exigiría recorrer los subálbumes, así que cualquier cambio de
+# contenido vacía la caché entera: son pocas entradas y se rehacen con una consulta cada una.
+
+TTL_SEGUNDOS = float(os.getenv("ENLACE_CACHE_TTL", "60"))
+MAX_ENTRADAS = int(os.getenv("ENLACE_CACHE_MAX", "1000"))
+
+_entradas = OrderedDict()  # clave -> (caduca, valor)
+_lock = threading.Lock()
+_estadisticas = {"aciertos": 0, "fallos": 0, "invalidaciones": 0}
+
+# Visitas pendientes de escribir en EnlacePublico.veces_usado (las vuelca consultasEnlaces.volcar_usos)
+_usos = {}  # id_enlace -> visitas
+_lock_usos = threading.Lock()
+
+def obtener(*clave) -> Optional[Any]:
+    with _lock:
+        entrada = _entradas.get(clave)
+        if entrada is None or entrada[0] < time.monotonic():
+            if entrada is not None:
+                del _entradas[clave]
+            _estadisticas["fallos"] += 1
+            return None
+        _entradas.move_to_end(clave)
+        _estadisticas["aciertos"] += 1
+        return entrada[1]
+
+def guardar(valor: Any, *clave):
+    """Los valores se comparten entre peticiones: quien los lea no debe modificarlos"""
+    with _lock:
+        _entradas[clave] = (time.monotonic() + TTL_SEGUNDOS, valor)
+        _entradas.move_to_end(clave)
+        while len(_entradas) > MAX_ENTRADAS:
+            _entradas.popitem(last=False)
+
+def invalidar_todo(*_):
+    with _lock:
+        _entradas.clear()
+        _estadisticas["invalidaciones"] += 1
+
+# Borrar, mover, renombrar o reemplazar un recurso ya avisa a cacheAccesos: nos colgamos de ese aviso
+cacheAccesos.suscribir(invalidar_todo)
+
+def contar_uso(id_enlace: int):
+    with _lock_usos:
+        _usos[id_enlace] = _usos.get(id_enlace, 0) + 1
+
+def extraer_usos() -> dict:
+    """Entrega las visitas acumuladas y empieza de cero"""
+    global _usos
+    with _lock_usos:
+        usos, _usos = _usos, {}
+    return usos
+
+def devolver_usos(usos: dict):
+    """Si el volcado falla, las visitas vuelven al contador para el siguiente intento"""
+    with _lock_usos:
+        for id_enlace, visitas in usos.items():
+            _usos[id_enlace] = _usos.get(id_enlace, 0) + visitas
+
+def estadisticas() -> dict:
+    with _lock:
+        datos = {**_estadisticas, "entradas": len(_entradas), "ttl": TTL_SEGUNDOS}
+    with _lock_usos:
+        datos["usos_pendientes"] = sum(_usos.values())
+    return datos
@@ -0,0 +1,206 @@
+from fast_api import db, ejecutorSQL
+from mysql.connector import Error
+from typing import List, Optional, Tuple, Any
+import fast_api.recurso.cacheEnlaces as cacheEnlaces
+
+POR_PAGINA_ENLACE = 100
+
+#-------------------------------------------------------------------------------------------------------
+#                           CONTENIDO DE UN ENLACE PÚBLICO (con subálbumes)
+#--------------------------------------------------------------------------------------------------------
+# Un enlace puede llevar recursos sueltos y álbumes. Los álbumes se expanden con todo su subárbol en una
+# sola consulta (CTE recursiva): cada fila sale ya con su carpeta ('Viaje/Día 1'), sin una consulta por nivel.
+# La usan tanto la página HTML (paginada) como el ZIP (que conserva las carpetas).
+# Solo se expanden los álbumes de los que el creador del enlace sigue siendo miembro: si lo echan (o el enlace
+# se creó con un id ajeno) el álbum deja de publicarse. crear_enlace_publico ya lo comprueba al crear.
+
+_SQL_CONTENIDO = """
+    WITH RECURSIVE Arbol (id_album, carpeta) AS (
+        SELECT A.id, CAST(REPLACE(A.nombre, '/', '_') AS CHAR(1000))
+        FROM EnlacePublico_Contenido C
+        JOIN EnlacePublico E ON E.id = C.id_enlace
+        JOIN Album A ON A.id = C.id_album
+        JOIN Miembro_Album M ON M.id_album = A.id AND M.id_persona = E.id_creador
+        WHERE C.id_enlace = %s AND A.fecha_eliminacion IS NULL
+        UNION ALL
+        SELECT H.id, CONCAT(Arbol.carpeta, '/', REPLACE(H.nombre, '/', '_'))
+        FROM Album H
+        JOIN Arbol ON H.id_album_padre = Arbol.id_album
+        WHERE H.fecha_eliminacion IS NULL
+    ),
+    Contenido (carpeta, id_recurso) AS (
+        SELECT '', C.id_recurso
+        FROM EnlacePublico_Contenido C
+        WHERE C.id_enlace = %s AND C.id_recurso IS NOT NULL
+        UNION ALL
+        SELECT Arbol.carpeta, RA.id_recurso
+        FROM Arbol
+        JOIN Recurso_Album RA ON RA.id_album = Arbol.id_album
+    )
+"""
+
+def contenido_visible(id_persona: int, ids_recursos: List[int], ids_albumes: List[int]) -> Tuple[bool, Any]:
+    """
+    ¿Puede el usuario publicar todo esto? Álbumes: tiene que ser miembro. Recursos: propios, compartidos
+    con él o dentro de un álbum del que es miembro. Devuelve (True, None) o (False, motivo).
+    """
+    ids_recursos = list(set(ids_recursos))
+    ids_albumes = list(set(ids_albumes))
+    try:
+        with ejecutorSQL.conexion() as sql:
+            if ids_albumes:
+                marcadores = ','.join(['%s'] * len(ids_albumes))
+                miembro = sql.fetch_value(
+                    f"SELECT COUNT(*) FROM Miembro_Album WHERE id_persona = %s AND id_album IN ({marcadores})",
+                    (id_persona, *ids_albumes)
+                )
+                if miembro != len(ids_albumes):
+                    return False, "No eres miembro de alguno de los álbumes"
+            if ids_recursos:
+                marcadores = ','.join(['%s'] * len(ids_recursos))
+                visibles = sql.fetch_value(f"""
+                    SELECT COUNT(DISTINCT Visibles.id_recurso) FROM (
+                        SELECT RP.id_recurso FROM Recurso_Persona RP
+                        WHERE RP.id_persona = %s AND RP.id_recurso IN ({marcadores})
+                        UNION
+                        SELECT RC.id_recurso FROM Recurso_Compartido RC
+                        WHERE RC.id_receptor = %s AND RC.id_recurso IN ({marcadores})
+                        UNION
+                        SELECT RA.id_recurso FROM Recurso_Album RA
+                        JOIN Miembro_Album MA ON MA.id_album = RA.id_album
+                        WHERE MA.id_persona = %s AND RA.id_recurso IN ({marcadores})
+                    ) AS Visibles
+                """, (id_persona, *ids_recursos, id_persona, *ids_recursos, id_persona, *ids_recursos))
+                if visibles != len(ids_recursos):
+                    return False, "No tienes acceso a alguno de los recursos"
+        return True, None
+    except Error as e:
+        print(f"Error comprobando contenido del enlace: {e}")
+        return False, str(e)
+
+def obtener_enlace(token: str) -> Optional[dict]:
+    """Fila del enlace (cacheada por token). None si no existe o falla la BD"""
+    link = cacheEnlaces.obtener("enlace", token)
+    if link is not None:
+        return link
+    connection = None
+    cursor = None
+    try:
+        connection = db.get_connection()
+        cursor = connection.cursor(dictionary=True)
+        # veces_usado no se lee: cambia en cada visita y lo lleva el contador en memoria
+        cursor.execute("""
+            SELECT id, token, id_recurso, id_album, id_creador, fecha_creacion, fecha_expiracion, password_hash
+            FROM EnlacePublico WHERE token = %s
+        """, (token,))
+        link = cursor.fetchone()
+        if link:
+            cacheEnlaces.guardar(link, "enlace", token)
+        return link
+    except Error as e:
+        print(f"Error obteniendo enlace {token}: {e}")
+        return None
+    finally:
+        if cursor: cursor.close()
+        if connection and connection.is_connected(): connection.close()
+
+def obtener_contenido_enlace_cacheado(token: str, id_enlace: int, pagina: int = 1) -> Tuple[bool, Any]:
+    contenido = cacheEnlaces.obtener("contenido", token, pagina)
+    if contenido is not None:
+        return True, contenido
+    exito, contenido = obtener_contenido_enlace(id_enlace, pagina)
+    if exito:
+        cacheEnlaces.guardar(contenido, "contenido", token, pagina)
+    return exito, contenido
+
+def obtener_contenido_enlace(id_enlace: int, pagina: int = 1, por_pagina: int = POR_PAGINA_ENLACE) -> Tuple[bool, Any]:
+    """
+    Página del contenido de un enlace, ordenado por carpeta y nombre.
+    Devuelve {"items", "total", "tamano_total", "pagina", "paginas"}: los totales salen de la misma
+    consulta (funciones ventana), no hace falta un COUNT aparte.
+    """
+    connection = None
+    cursor = None
+    pagina = max(1, pagina)
+    try:
+        connection = db.get_connection()
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute(_SQL_CONTENIDO + """
+            SELECT Contenido.carpeta, R.id, R.nombre, R.tipo, R.tamano,
+                   COUNT(*) OVER () AS total, SUM(R.tamano) OVER () AS tamano_total
+            FROM Contenido
+            JOIN Recurso R ON R.id = Contenido.id_recurso
+            WHERE R.fecha_eliminacion IS NULL
+            ORDER BY Contenido.carpeta, R.nombre, R.id
+            LIMIT %s OFFSET %s
+        """, (id_enlace, id_enlace, por_pagina, (pagina - 1) * por_pagina))
+        items = cursor.fetchall()
+        total = items[0]['total'] if items else 0
+        tamano_total = int(items[0]['tamano_total'] or 0) if items else 0
+        for item in items:
+            del item['total'], item['tamano_total']
+        if not items and pagina > 1:
+            # Página fuera de rango: el total hay que pedirlo a la primera
+            exito, primera = obtener_contenido_enlace(id_enlace, 1, 1)
+            if exito:
+                total, tamano_total = primera['total'], primera['tamano_total']
+        return True, {
+            "items": items,
+            "total": total,
+            "tamano_total": tamano_total,
+            "pagina": pagina,
+            "paginas": max(1, -(-total // por_pagina)),
+        }
+    except Error as e:
+        print(f"Error obteniendo contenido del enlace {id_enlace}: {e}")
+        return False, str(e)
+    finally:
+        if cursor: cursor.close()
+        if connection and connection.is_connected(): connection.close()
+
+def obtener_archivos_enlace(id_enlace: int) -> Tuple[bool, Any]:
+    """Todos los ficheros del enlace para el ZIP: lista de {"enlace", "carpeta", "nombre"}"""
+    connection = None
+    cursor = None
+    try:
+        connection = db.get_connection()
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute(_SQL_CONTENIDO + """
+            SELECT R.enlace, Contenido.carpeta, R.nombre
+            FROM Contenido
+            JOIN Recurso R ON R.id = Contenido.id_recurso
+            WHERE R.fecha_eliminacion IS NULL
+            ORDER BY Contenido.carpeta, R.nombre, R.id
+        """, (id_enlace, id_enlace))
+        return True, cursor.fetchall()
+    except Error as e:
+        print(f"Error obteniendo archivos del enlace {id_enlace}: {e}")
+        return False, str(e)
+    finally:
+        if cursor: cursor.close()
+        if connection and connection.is_connected(): connection.close()
+
+def volcar_usos():
+    """
+    Escribe en EnlacePublico.veces_usado las visitas contadas en memoria (cacheEnlaces.contar_uso).
+    Lo llama el scheduler cada minuto y el apagado del servidor: una UPDATE por enlace y lote, no por visita.
+    """
+    usos = cacheEnlaces.extraer_usos()
+    if not usos:
+        return
+    connection = None
+    cursor = None
+    try:
+        connection = db.get_connection()
+        cursor = connection.cursor()
+        cursor.executemany(
+            "UPDATE EnlacePublico SET veces_usado = veces_usado + %s WHERE id = %s",
+            [(visitas, id_enlace) for id_enlace, visitas in usos.items()]
+        )
+        connection.commit()
+    except Error as e:
+        print(f"Error volcando usos de enlaces: {e}")
+        cacheEnlaces.devolver_usos(usos)
+    finally:
+        if cursor: cursor.close()
+        if connection and connection.is_connected(): connection.close()
@@ -1,62 +1,93 @@
 import os
-from PIL import Image
-import cv2
+import json
+import base64
 from fast_api import db
+from fast_api import db_async
+from fast_api import ejecutorSQL
 from mysql.connector import Error
 from datetime import datetime
 from typing import Optional, Tuple, Any, List
 import shutil
 import fast_api.utilidades.utilidadesMetadatos as utilidadesMetadatos
+import fast_api.utilidades.utilidadesFicheros as utilidadesFicheros
+import fast_api.utilidades.utilidadesHttp as utilidadesHttp
+import fast_api.recurso.consultasTrabajos as consultasTrabajos
+import fast_api.seguridad.cacheAccesos as cacheAccesos
+import fast_api.recurso.cacheEnlaces as cacheEnlaces
+import fast_api.seguridad.funcionesSeguridad as funcionesSeguridad
+import fast_api.sincronizacion.consultasSincronizacion as consultasSincronizacion
 
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 STATIC_DIR = os.path.join(BASE_DIR, "static")
 UPLOADS_DIR = os.path.join(STATIC_DIR, "uploads")
 THUMBNAILS_DIR = os.path.join(STATIC_DIR, "thumbnails")
+ESTADOS_PENDIENTES = ("PENDIENTE", "PROCESANDO")
+TIPOS_RECURSO = ("IMAGEN", "VIDEO", "AUDIO", "ARCHIVO")
+# Listado paginado de /recurso/mis_recursos
+LIMITE_PAGINA_DEFECTO = 100
+LIMITE_PAGINA_MAX = 500
 
 
 #-------------------------------------------------------------------------------------------------------
 #                                    OBTENCION DE RECURSOS
 #--------------------------------------------------------------------------------------------------------
 
+def url_miniatura(recurso: dict, exp: int) -> str:
+    """URL firmada de la miniatura (ruta /media: sin JWT ni consulta de permisos). Necesita 'enlace' en la fila"""
+    return funcionesSeguridad.firmar_url_media(
+        os.path.basename(recurso['enlace']), recurso['tipo'], "small", utilidadesHttp.version_recurso(recurso), exp
+    )
+
+
+def _preparar_listado(recursos: List[dict]):
+    """URLs y flags que espera la app. Quita 'enlace': la ruta física no sale del servidor"""
+    exp = funcionesSeguridad.caducidad_url_media()
+    for recurso in recursos:
+        recurso['url_visualizacion'] = f"/recurso/archivo/{recurso['id']}"
+        recurso['url_thumbnail'] = url_miniatura(recurso, exp)
+        del recurso['enlace']
+        recurso['miniatura_pendiente'] = recurso['estado_procesado'] in ESTADOS_PENDIENTES
+        recurso['es_compartido'] = False # Por defecto, la lógica de Flutter no lo distingue visualmente, se mezclan.
+
+# Usamos UNION para combinar:
+# 1. Recursos propios (Recurso_Persona)
+# 2. Recursos compartidos conmigo (Recurso_Compartido)
+_SQL_RECURSOS_USUARIO = """
+    SELECT id, tipo, nombre, fecha_real, fecha_subida, favorito, id_album_padre, fecha_eliminacion, estado_procesado, enlace
+    FROM (
+        -- TUS RECURSOS
+        SELECT r.id, r.tipo, r.nombre, r.fecha_real, r.fecha_subida, r.favorito, ra.id_album as id_album_padre, r.fecha_eliminacion, r.estado_procesado, r.enlace
+        FROM Recurso r
+        JOIN Recurso_Persona rp ON r.id = rp.id_recurso
+        LEFT JOIN Recurso_Album ra ON r.id = ra.id_recurso
+        WHERE rp.id_persona = %s
+
+        UNION
+
+        -- RECURSOS COMPARTIDOS CONTIGO
+        SELECT r.id, r.tipo, r.nombre, r.fecha_real, r.fecha_subida, r.favorito, NULL as id_album_padre, r.fecha_eliminacion, r.estado_procesado, r.enlace
+        FROM Recurso r
+        JOIN Recurso_Compartido rc ON r.id = rc.id_recurso
+        WHERE rc.id_receptor = %s
+    ) AS TodosRecursos
+    ORDER BY fecha_real DESC
+"""
+
 def obtener_recursos(id_persona: int):
+    """Listado completo (sin paginar). Se mantiene para las versiones de la app que no mandan cursor"""
     connection = None
     try:
         connection = db.get_connection()
         if connection.is_connected():
             cursor = connection.cursor(dictionary=True)
-            # Usamos UNION para combinar:
-            # 1. Recursos propios (Recurso_Persona)
-            # 2. Recursos compartidos conmigo (Recurso_Compartido)
-            query = """
-                SELECT id, tipo, nombre, fecha_real, fecha_subida, favorito, id_album_padre, fecha_eliminacion
-                FROM (
-                    -- TUS RECURSOS
-                    SELECT r.id, r.tipo, r.nombre, r.fecha_real, r.fecha_subida, r.favorito, ra.id_album as id_album_padre, r.fecha_eliminacion
-                    FROM Recurso r 
-                    JOIN Recurso_Persona rp ON r.id = rp.id_recurso 
-                    LEFT JOIN Recurso_Album ra ON r.id = ra.id_recurso
-                    WHERE rp.id_persona = %s 
-                    
-                    UNION
-                    
-                    -- RECURSOS COMPARTIDOS CONTIGO
-                    SELECT r.id, r.tipo, r.nombre, r.fecha_real, r.fecha_subida, r.favorito, NULL as id_album_padre, r.fecha_eliminacion
-                    FROM Recurso r
-                    JOIN Recurso_Compartido rc ON r.id = rc.id_recurso
-                    WHERE rc.id_receptor = %s 
-                ) AS TodosRecursos
-                ORDER BY fecha_real DESC
-            """
+            query = _SQL_RECURSOS_USUARIO
             # Pasamos el ID dos veces (una para cada SELECT del UNION)
             valores = (id_persona, id_persona)
             cursor.execute(query, valores)
             recursos = cursor.fetchall()
             
-            for recurso in recursos:
-                recurso['url_visualizacion'] = f"/recurso/archivo/{recurso['id']}"
-                recurso['url_thumbnail'] = f"/recurso/archivo/{recurso['id']}?size=small"
-                recurso['es_compartido'] = False # Por defecto, la lógica de Flutter no lo distingue visualmente, se mezclan.
+            _preparar_listado(recursos)
             return (True, recursos)
     except Error as e:
         print(f"Error en obtener recursos: {e}")
@@ -66,38 +97,209 @@ def obtener_recursos(id_persona: int):
             if 'cursor' in locals(): cursor.close()
             connection.close()
 
-def obtener_recurso_por_id(id_recurso: int, id_persona: int):
+async def obtener_recursos_async(id_persona: int):
+    """Igual que obtener_recursos pero con el pool async: no ocupa un hilo mientras espera a MySQL"""
+    try:
+        async with db_async.cursor_dict() as cursor:
+            await cursor.execute(_SQL_RECURSOS_USUARIO, (id_persona, id_persona))
+            recursos = await cursor.fetchall()
+        _preparar_listado(recursos)
+        return (True, recursos)
+    except db_async.Error as e:
+        print(f"Error en obtener recursos: {e}")
+        return (False, str(e))
+
+#-------------------------------------------------------------------------------------------------------
+#                                    LISTADO PAGINADO (keyset)
+#--------------------------------------------------------------------------------------------------------
+# Orden (fecha_real DESC, id DESC). El cursor es la clave de la última fila entregada: la página siguiente
+# empieza justo después con un WHERE sobre el índice idx_recurso_fecha, sin OFFSET que recorra lo anterior.
+# MySQL pone los NULL al final en orden DESC: los recursos sin fecha_real forman el último tramo del listado.
+
+def codificar_cursor(fecha_real: Optional[datetime], id_recurso: int) -> str:
+    datos = {"f": fecha_real.isoformat() if fecha_real else None, "i": id_recurso}
+    return base64.urlsafe_b64encode(json.dumps(datos, separators=(",", ":")).encode()).decode().rstrip("=")
+
+def decodificar_cursor(cursor: str) -> Tuple[Optional[datetime], int]:
+    """Lanza ValueError si el cursor no es uno de los nuestros"""
+    try:
+        datos = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        fecha = datetime.fromisoformat(datos["f"]) if datos["f"] is not None else None
+        return fecha, int(datos["i"])
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Cursor no válido: {e}")
+
+def _condicion_cursor(fecha: Optional[datetime], id_recurso: int) -> Tuple[str, tuple]:
+    if fecha is None:
+        return "(r.fecha_real IS NULL AND r.id < %s)", (id_recurso,)
+    return ("(r.fecha_real < %s OR (r.fecha_real = %s AND r.id < %s) OR r.fecha_real IS NULL)",
+            (fecha, fecha, id_recurso))
+
+def obtener_recursos_pagina(id_persona: int, limite: int = LIMITE_PAGINA_DEFECTO, cursor: Optional[str] = None,
+                            tipo: Optional[str] = None, id_album: Optional[int] = None, favoritos: bool = False,
+                            incluir_papelera: bool = False) -> Tuple[bool, Any]:
+    """
+    Una página de los recursos propios y compartidos conmigo, con los filtros aplicados en la BD.
+    Devuelve {"recursos": [...], "siguiente_cursor": str o None (no hay más)}
+    """
+    limite = max(1, min(limite, LIMITE_PAGINA_MAX))
+    try:
+        posicion = decodificar_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return (False, str(e))
+
+    filtros = []
+    valores_filtros = []
+    if not incluir_papelera:
+        filtros.append("r.fecha_eliminacion IS NULL")
+    if tipo:
+        filtros.append("r.tipo = %s")
+        valores_filtros.append(tipo)
+    if favoritos:
+        filtros.append("r.favorito = 1")
+    if posicion:
+        condicion, valores_cursor = _condicion_cursor(*posicion)
+        filtros.append(condicion)
+        valores_filtros.extend(valores_cursor)
+
+    columnas = "r.id, r.tipo, r.nombre, r.fecha_real, r.fecha_subida, r.favorito, r.fecha_eliminacion, r.estado_procesado, r.enlace"
+    # Cada rama trae como mucho limite+1 filas ya ordenadas; la fila de más indica que hay otra página
+    filtros_propios = ["rp.id_persona = %s"] + filtros
+    valores = [id_persona] + valores_filtros
+    if id_album is not None:
+        filtros_propios.append("EXISTS (SELECT 1 FROM Recurso_Album ra2 WHERE ra2.id_recurso = r.id AND ra2.id_album = %s)")
+        valores.append(id_album)
+    ramas = [f"""
+        (SELECT {columnas}, (SELECT MIN(ra.id_album) FROM Recurso_Album ra WHERE ra.id_recurso = r.id) AS id_album_padre
+         FROM Recurso_Persona rp
+         JOIN Recurso r ON r.id = rp.id_recurso
+         WHERE {" AND ".join(filtros_propios)}
+         ORDER BY r.fecha_real DESC, r.id DESC
+         LIMIT %s)
+    """]
+    valores.append(limite + 1)
+    # Lo compartido conmigo no está en ningún álbum mío: con filtro de álbum no aplica
+    if id_album is None:
+        ramas.append(f"""
+        (SELECT {columnas}, NULL AS id_album_padre
+         FROM Recurso_Compartido rc
+         JOIN Recurso r ON r.id = rc.id_recurso
+         WHERE {" AND ".join(["rc.id_receptor = %s"] + filtros)}
+         ORDER BY r.fecha_real DESC, r.id DESC
+         LIMIT %s)
+        """)
+        valores += [id_persona] + valores_filtros + [limite + 1]
+
+    # UNION ALL: los repetidos se quitan abajo sin que MySQL tenga que comparar todas las filas
+    query = " UNION ALL ".join(ramas) + " ORDER BY fecha_real DESC, id DESC LIMIT %s"
+    valores.append((limite + 1) * len(ramas))
+
+    connection = None
+    db_cursor = None
+    try:
+        connection = db.get_connection()
+        db_cursor = connection.cursor(dictionary=True)
+        db_cursor.execute(query, tuple(valores))
+        filas = db_cursor.fetchall()
+    except Error as e:
+        print(f"Error en obtener recursos paginados: {e}")
+        return (False, str(e))
+    finally:
+        if db_cursor: db_cursor.close()
+        if connection and connection.is_connected(): connection.close()
+
+    # Un recurso propio que además me han compartido sale en las dos ramas
+    vistos = set()
+    recursos = []
+    for fila in filas:
+        if fila['id'] not in vistos:
+            vistos.add(fila['id'])
+            recursos.append(fila)
+    siguiente = None
+    if len(recursos) > limite:
+        recursos = recursos[:limite]
+        ultimo = recursos[-1]
+        siguiente = codificar_cursor(ultimo['fecha_real'], ultimo['id'])
+    _preparar_listado(recursos)
+    return (True, {"recursos": recursos, "siguiente_cursor": siguiente})
+
+def obtener_recursos_por_ids(id_persona: int, ids: List[int]) -> Tuple[bool, Any]:
+    """
+    Estado actual de los recursos indicados que el usuario puede ver (mismas reglas que obtener_recurso_por_id).
+    Los que no salen ya no son visibles para él. Lo usa /sync con los recursos que han cambiado
+    """
+    if not ids:
+        return (True, [])
     connection = None
     cursor = None
     try:
         connection = db.get_connection()
         cursor = connection.cursor(dictionary=True)
-        
-        # Ahora comprobamos 3 cosas: Dueño, Compartido individual o Miembro del Álbum
-        query = """
-            SELECT R.* FROM Recurso R
-            WHERE R.id = %s 
+        marcadores = ','.join(['%s'] * len(ids))
+        cursor.execute(f"""
+            SELECT R.id, R.tipo, R.nombre, R.fecha_real, R.fecha_subida, R.favorito, R.fecha_eliminacion, R.estado_procesado, R.enlace,
+                   (SELECT MIN(RA.id_album) FROM Recurso_Album RA WHERE RA.id_recurso = R.id) AS id_album_padre
+            FROM Recurso R
+            WHERE R.id IN ({marcadores})
             AND (
-                -- 1. Eres el dueño
                 EXISTS (SELECT 1 FROM Recurso_Persona RP WHERE RP.id_recurso = R.id AND RP.id_persona = %s)
-                OR 
-                -- 2. Te lo han compartido individualmente
-                EXISTS (SELECT 1 FROM Recurso_Compartido RC WHERE RC.id_recurso = R.id AND RC.id_receptor = %s)
-                OR
-                -- 3. Eres miembro del álbum que contiene este recurso (NUEVO)
-                EXISTS (
+                OR EXISTS (SELECT 1 FROM Recurso_Compartido RC WHERE RC.id_recurso = R.id AND RC.id_receptor = %s)
+                OR EXISTS (
                     SELECT 1 FROM Recurso_Album RA
                     JOIN Miembro_Album MA ON RA.id_album = MA.id_album
                     WHERE RA.id_recurso = R.id AND MA.id_persona = %s
                 )
             )
-        """
+        """, (*ids, id_persona, id_persona, id_persona))
+        recursos = cursor.fetchall()
+        _preparar_listado(recursos)
+        return (True, recursos)
+    except Error as e:
+        print(f"Error en obtener_recursos_por_ids: {e}")
+        return (False, str(e))
+    finally:
+        if cursor: cursor.close()
+        if connection and connection.is_connected(): connection.close()
+
+# Ahora comprobamos 3 cosas: Dueño, Compartido individual o Miembro del Álbum
+_SQL_RECURSO_CON_ACCESO = """
+    SELECT R.* FROM Recurso R
+    WHERE R.id = %s
+    AND (
+        -- 1. Eres el dueño
+        EXISTS (SELECT 1 FROM Recurso_Persona RP WHERE RP.id_recurso = R.id AND RP.id_persona = %s)
+        OR
+        -- 2. Te lo han compartido individualmente
+        EXISTS (SELECT 1 FROM Recurso_Compartido RC WHERE RC.id_recurso = R.id AND RC.id_receptor = %s)
+        OR
+        -- 3. Eres miembro del álbum que contiene este recurso (NUEVO)
+        EXISTS (
+            SELECT 1 FROM Recurso_Album RA
+            JOIN Miembro_Album MA ON RA.id_album = MA.id_album
+            WHERE RA.id_recurso = R.id AND MA.id_persona = %s
+        )
+    )
+"""
+
+def obtener_recurso_por_id(id_recurso: int, id_persona: int):
+    # Cada miniatura de la galería pasa por aquí: primero miramos la caché de accesos
+    recurso = cacheAccesos.obtener(id_persona, id_recurso)
+    if recurso is not None:
+        return (True, recurso)
+    generacion = cacheAccesos.generacion(id_persona, id_recurso)
+    connection = None
+    cursor = None
+    try:
+        connection = db.get_connection()
+        cursor = connection.cursor(dictionary=True)
+        query = _SQL_RECURSO_CON_ACCESO
         # Pasamos id_persona TRES veces (una para cada comprobación)
         cursor.execute(query, (id_recurso, id_persona, id_persona, id_persona))
         
         resultado = cursor.fetchone()
         if not resultado:
             return (False, "Recurso no encontrado o sin acceso")
+        cacheAccesos.guardar(id_persona, id_recurso, resultado, generacion)
         return (True, resultado)
         
     except Error as e:
@@ -107,6 +309,24 @@ def obtener_recurso_por_id(id_recurso: int, id_persona: int):
         if cursor: cursor.close()
         if connection: connection.close()
 
+async def obtener_recurso_por_id_async(id_recurso: int, id_persona: int):
+    """Versión async de obtener_recurso_por_id (misma caché de accesos)"""
+    recurso = cacheAccesos.obtener(id_persona, id_recurso)
+    if recurso is not None:
+        return (True, recurso)
+    generacion = cacheAccesos.generacion(id_persona, id_recurso)
+    try:
+        async with db_async.cursor_dict() as cursor:
+            await cursor.execute(_SQL_RECURSO_CON_ACCESO, (id_recurso, id_persona, id_persona, id_persona))
+            resultado = await cursor.fetchone()
+        if not resultado:
+            return (False, "Recurso no encontrado o sin acceso")
+        cacheAccesos.guardar(id_persona, id_recurso, resultado, generacion)
+        return (True, resultado)
+    except db_async.Error as e:
+        print(f"Error en obtener_recurso_por_id: {e}")
+        return (False, str(e))
+
 def eliminar_definitivamente_bd(id_recurso: int, id_usuario: int) -> Tuple[bool, Any]:
     connection = None
     try: 
@@ -125,12 +345,14 @@ def eliminar_definitivamente_bd(id_recurso: int, id_usuario: int) -> Tuple[bool,
                 enlace = resultado[0]
                 cursor.execute(query_2, valores_2)
                 total = cursor.fetchone()[0]
+                consultasSincronizacion.registrar_cambios_recursos(cursor, [id_recurso], 'ELIMINAR')
                 cursor.execute(query_3, valores)
+                # El trigger borra el Recurso al irse el último dueño, pero el fichero físico
+                # puede seguir en uso por otros recursos con el mismo contenido (deduplicación)
+                libre = total == 1 and bool(enlaces_sin_referencias(cursor, [enlace]))
                 connection.commit()
-                if total == 1:
-                    return (True, enlace)
-                else:
-                    return (True, None)
+                cacheAccesos.invalidar_recursos([id_recurso])
+                return (True, enlace if libre else None)
             else:
                 return (False, "El recurso no existe")
     except Error as e:
@@ -178,6 +400,7 @@ def compartir_recurso_bd(id_recurso, id_emisor, id_receptor):
                 
                 sql_insert = "INSERT INTO Recurso_Compartido (id_recurso, id_emisor, id_receptor) VALUES (%s, %s, %s)"
                 cursor.execute(sql_insert, (id_recurso, id_emisor, id_receptor))
+                consultasSincronizacion.registrar_cambios_recursos(cursor, [id_recurso], 'COMPARTIR')
                 conexion.commit()
                 return True, "Recurso compartido exitosamente."
             else:
@@ -222,9 +445,11 @@ def obtener_compartidos_conmigo(id_receptor):
             resultados = cursor.fetchall()
 
             # --- CORRECCIÓN: Generar URLs válidas para Flutter ---
+            exp = funcionesSeguridad.caducidad_url_media()
             for recurso in resultados:
                 recurso['url_visualizacion'] = f"/recurso/archivo/{recurso['id']}"
-                recurso['url_thumbnail'] = f"/recurso/archivo/{recurso['id']}?size=small"
+                recurso['url_thumbnail'] = url_miniatura(recurso, exp)
+                recurso['miniatura_pendiente'] = recurso['estado_procesado'] in ESTADOS_PENDIENTES
                 # Opcional: Borrar la ruta física por seguridad para no enviarla al cliente
                 if 'enlace' in recurso:
                     del recurso['enlace']
@@ -284,6 +509,7 @@ def responder_peticion_recurso(id_emisor, id_receptor, id_recurso, aceptar):
                     VALUES (%s, %s, %s)
                 """
                 cursor.execute(sql_insert, (id_recurso, id_emisor, id_receptor))
+                consultasSincronizacion.registrar_cambios_recursos(cursor, [id_recurso], 'COMPARTIR')
             conexion.commit()
             return True, f"Solicitud {nuevo_estado.lower()} correctamente."
     except Exception as e:
@@ -346,13 +572,21 @@ def renombrar_recurso_seguro(id_recurso: int, nuevo_nombre_completo: str, id_usu
                 return False, "DUPLICADO"
             else:
                 # El usuario confirmó reemplazar: BORRAMOS el otro archivo de la BD
+                cursor.execute("SELECT enlace FROM Recurso WHERE id = %s", (otro_archivo['id'],))
+                enlace_reemplazado = cursor.fetchone()['enlace']
+                consultasSincronizacion.registrar_cambios_recursos(cursor, [otro_archivo['id']], 'ELIMINAR')
                 cursor.execute("DELETE FROM Recurso WHERE id = %s", (otro_archivo['id'],))
         
         # 4. Renombrar el nuestro
         sql_update = "UPDATE Recurso SET nombre = %s WHERE id = %s"
         cursor.execute(sql_update, (nuevo_nombre_completo, id_recurso))
+        consultasSincronizacion.registrar_cambios_recursos(cursor, [id_recurso], 'RENOMBRAR')
+        rutas_libres = enlaces_sin_referencias(cursor, [enlace_reemplazado]) if otro_archivo else []
         
         connection.commit()
+        cacheAccesos.invalidar_recursos([id_recurso] + ([otro_archivo['id']] if otro_archivo else []))
+        for ruta in rutas_libres:
+            utilidadesFicheros.borrar_fichero_fisico(ruta)
         return True, "Nombre actualizado correctamente"
 
     except Exception as e:
@@ -375,7 +609,9 @@ def cambiar_fecha_recurso(id_recurso:int, fecha:datetime, id_persona:int):
             if cursor.rowcount == 0:
                 connection.rollback()
                 return (False, "No se encontró el recurso")
+            consultasSincronizacion.registrar_cambios_recursos(cursor, [id_recurso], 'CAMBIAR_FECHA')
             connection.commit()
+            cacheAccesos.invalidar_recursos([id_recurso])
             return (True, f"Recurso {id_recurso} actualizada correctamente")
     except Error as e:
         if connection and connection.is_connected():
@@ -395,9 +631,13 @@ def marcar_favorito_bd(id_recurso: int, id_usuario: int, estado: bool):
         # Solo el creador puede marcar como favorito su recurso
         sql = "UPDATE Recurso SET favorito = %s WHERE id = %s AND id_creador = %s"
         cursor.execute(sql, (1 if estado else 0, id_recurso, id_usuario))
+        actualizados = cursor.rowcount
+        if actualizados > 0:
+            consultasSincronizacion.registrar_cambios_recursos(cursor, [id_recurso], 'FAVORITO')
         connection.commit()
+        cacheAccesos.invalidar_recursos([id_recurso])
         
-        if cursor.rowcount > 0:
+        if actualizados > 0:
             return True, "Estado de favorito actualizado"
         return False, "No se encontró el recurso o no tienes permiso"
     except Error as e:
@@ -456,9 +696,13 @@ def mover_a_papelera(id_recurso: int, id_usuario: int) -> Tuple[bool, Any]:
         # Actualizamos la fecha de eliminación
         sql = "UPDATE Recurso SET fecha_eliminacion = NOW() WHERE id = %s AND id_creador = %s"
         cursor.execute(sql, (id_recurso, id_usuario))
+        actualizados = cursor.rowcount
+        if actualizados > 0:
+            consultasSincronizacion.registrar_cambios_recursos(cursor, [id_recurso], 'PAPELERA')
         connection.commit()
+        cacheAccesos.invalidar_recursos([id_recurso])
         
-        if cursor.rowcount > 0:
+        if actualizados > 0:
             return True, "Recurso movido a la papelera"
         else:
             return False, "No se encontró el recurso o no eres el creador"
@@ -476,7 +720,8 @@ def obtener_papelera_bd(id_usuario: int) -> Tuple[bool, Any]:
         connection = db.get_connection()
         cursor = connection.cursor(dictionary=True)
         sql = """
-            SELECT * FROM Recurso 
+            SELECT id, id_creador, tipo, enlace, nombre, fecha_real, fecha_subida, fecha_eliminacion, tamano, favorito, estado_procesado
+            FROM Recurso 
             WHERE id_creador = %s AND fecha_eliminacion IS NOT NULL 
             ORDER BY fecha_eliminacion DESC
         """
@@ -484,8 +729,11 @@ def obtener_papelera_bd(id_usuario: int) -> Tuple[bool, Any]:
         resultado = cursor.fetchall()
         
         # Opcional: Agregar URLs también aquí por si quieres mostrar miniaturas en la papelera
+        exp = funcionesSeguridad.caducidad_url_media()
         for recurso in resultado:
-            recurso['url_thumbnail'] = f"/recurso/archivo/{recurso['id']}?size=small"
+            recurso['url_thumbnail'] = url_miniatura(recurso, exp)
+            recurso['miniatura_pendiente'] = recurso['estado_procesado'] in ESTADOS_PENDIENTES
+            del recurso['enlace']
 
         return True, resultado
     except Exception as e:
@@ -503,9 +751,13 @@ def restaurar_recurso_bd(id_recurso: int, id_usuario: int) -> Tuple[bool, Any]:
         cursor = connection.cursor()
         sql = "UPDATE Recurso SET fecha_eliminacion = NULL WHERE id = %s AND id_creador = %s"
         cursor.execute(sql, (id_recurso, id_usuario))
+        actualizados = cursor.rowcount
+        if actualizados > 0:
+            consultasSincronizacion.registrar_cambios_recursos(cursor, [id_recurso], 'RESTAURAR')
         connection.commit()
+        cacheAccesos.invalidar_recursos([id_recurso])
         
-        if cursor.rowcount > 0:
+        if actualizados > 0:
             return True, "Restaurado"
         return False, "No se encontró en la papelera"
     except Exception as e:
@@ -532,7 +784,7 @@ def mover_a_papelera_lote(ids: List[int], id_usuario: int) -> Tuple[bool, str]:
 
         # Placeholders para la lista de IDs (%s, %s, %s...)
         format_strings = ','.join(['%s'] * len(ids))
-        
+
         # --- PASO 1: Identificar recursos PROPIOS (Eres el creador del recurso) ---
         query_owner = f"SELECT id FROM Recurso WHERE id IN ({format_strings}) AND id_creador = %s"
         cursor.execute(query_owner, tuple(ids) + (id_usuario,))
@@ -547,6 +799,7 @@ def mover_a_papelera_lote(ids: List[int], id_usuario: int) -> Tuple[bool, str]:
             fmt_propio = ','.join(['%s'] * len(ids_propio))
             cursor.execute(f"UPDATE Recurso SET fecha_eliminacion = NOW() WHERE id IN ({fmt_propio})", tuple(ids_propio))
             count_propio = cursor.rowcount
+            consultasSincronizacion.registrar_cambios_recursos(cursor, ids_propio, 'PAPELERA')
 
         # --- PASO 2: Procesar los AJENOS (No eres el creador) ---
         # Calculamos cuáles son los ajenos restando los propios a la lista total
@@ -576,6 +829,8 @@ def mover_a_papelera_lote(ids: List[int], id_usuario: int) -> Tuple[bool, str]:
             cursor.execute(query_album_perms, params_album)
             
             enlaces_a_borrar = cursor.fetchall()
+            # Se registra antes de sacarlos del álbum, mientras sus miembros siguen relacionados
+            consultasSincronizacion.registrar_cambios_recursos(cursor, {rid for rid, _ in enlaces_a_borrar}, 'PAPELERA')
             
             # Borramos la relación Recurso-Album (Sacar de la carpeta)
             for rid, aid in enlaces_a_borrar:
@@ -590,6 +845,12 @@ def mover_a_papelera_lote(ids: List[int], id_usuario: int) -> Tuple[bool, str]:
             
             if ids_restantes:
                 fmt_rest = ','.join(['%s'] * len(ids_restantes))
+                # Solo los que de verdad estaban compartidos conmigo, y antes de borrar la relación
+                cursor.execute(
+                    f"SELECT id_recurso FROM Recurso_Compartido WHERE id_recurso IN ({fmt_rest}) AND id_receptor = %s",
+                    tuple(ids_restantes) + (id_usuario,)
+                )
+                consultasSincronizacion.registrar_cambios_recursos(cursor, [r[0] for r in cursor.fetchall()], 'PAPELERA')
                 query_viewer = f"DELETE FROM Recurso_Compartido WHERE id_recurso IN ({fmt_rest}) AND id_receptor = %s"
                 cursor.execute(query_viewer, tuple(ids_restantes) + (id_usuario,))
                 count_compartido = cursor.rowcount
@@ -601,6 +862,7 @@ def mover_a_papelera_lote(ids: List[int], id_usuario: int) -> Tuple[bool, str]:
                     return False, "Error: No tienes permisos para eliminar algunos recursos (no eres dueño ni administrador)."
 
         connection.commit()
+        cacheAccesos.invalidar_recursos(ids)
         
         total = count_propio + count_album + count_compartido
         return True, f"Procesados: {count_propio} a papelera, {count_album} sacados de álbum, {count_compartido} dejados de seguir."
@@ -624,6 +886,8 @@ def mover_recursos_lote(ids: List[int], id_album_destino: Optional[int], id_usua
         cursor = connection.cursor()
         
         format_strings = ','.join(['%s'] * len(ids))
+        # Antes y después de mover: se enteran los miembros del álbum de origen y los del destino
+        consultasSincronizacion.registrar_cambios_recursos(cursor, ids, 'MOVER')
         
         # 1. Borramos las asociaciones previas de estos recursos con cualquier álbum
         # (Para sacarlos de donde estén)
@@ -640,8 +904,10 @@ def mover_recursos_lote(ids: List[int], id_album_destino: Optional[int], id_usua
             # Preparamos tuplas (id_recurso, id_album) para executemany
             datos_insertar = [(id_r, id_album_destino) for id_r in ids]
             cursor.executemany(sql_insert, datos_insertar)
+            consultasSincronizacion.registrar_cambios_recursos(cursor, ids, 'MOVER')
             
         connection.commit()
+        cacheAccesos.invalidar_recursos(ids)
         dest = "la raíz" if id_album_destino is None else "la carpeta destino"
         return True, f"Archivos movidos a {dest}"
 
@@ -655,7 +921,7 @@ def mover_recursos_lote(ids: List[int], id_album_destino: Optional[int], id_usua
 #                                   SUBIDA DE ARCHIVOS
 #----------------------------------------------------------------------------------------------------
 
-def procesar_archivo_local(id_usuario: int, ruta_fisica: str, nombre_original: str, tipo: str, fecha: Optional[datetime], id_album: Optional[int], reemplazar: bool) -> Tuple[bool, Any]:
+def procesar_archivo_local(id_usuario: int, ruta_fisica: str, nombre_original: str, tipo: str, fecha: Optional[datetime], id_album: Optional[int], reemplazar: bool, hash_contenido: Optional[str] = None) -> Tuple[bool, Any]:
     # 1. Verificar Cuota
     try:
         tamano = os.path.getsize(ruta_fisica)
@@ -672,91 +938,56 @@ def procesar_archivo_local(id_usuario: int, ruta_fisica: str, nombre_original: s
         os.remove(ruta_fisica)
         return False, "DUPLICADO" # Señal para error 409
 
-    # 3. Generar Miniatura (Lógica reutilizada)
-    carpeta_miniatura = THUMBNAILS_DIR
-    os.makedirs(carpeta_miniatura, exist_ok=True)
-    nombre_fisico = os.path.basename(ruta_fisica)
-    
-    try:
-        if tipo == "IMAGEN":
-            ruta_thumb = os.path.join(carpeta_miniatura, nombre_fisico)
-            with Image.open(ruta_fisica) as img:
-                img.thumbnail((300, 300))
-                if img.mode in ("RGBA", "P"): img = img.convert("RGB")
-                img.save(ruta_thumb)
-        elif tipo == "VIDEO":
-            nombre_thumb_jpg = os.path.splitext(nombre_fisico)[0] + ".jpg"
-            ruta_thumb = os.path.join(carpeta_miniatura, nombre_thumb_jpg)
-            cam = cv2.VideoCapture(ruta_fisica)
-            try:
-                cam.set(cv2.CAP_PROP_POS_FRAMES, 10)
-                ret, frame = cam.read()
-                if ret:
-                    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    with Image.fromarray(frame_rgb) as img:
-                        img.thumbnail((300, 300))
-                        img.save(ruta_thumb, format="JPEG")
-            finally:
-                cam.release()
-    except Exception as e:
-        print(f"Warning miniatura: {e}")
-
-    metadatos_extraidos = None
-    if tipo in ["IMAGEN", "VIDEO"]:
-        try:
-            metadatos_extraidos = utilidadesMetadatos.obtener_exif(ruta_fisica)
-            if metadatos_extraidos and metadatos_extraidos.get("fecha"):
-                fecha = metadatos_extraidos['fecha']
-        except Exception as e:
-            print(f"Error extrayendo metadatos en chunk upload: {e}")
-    # 5. Guardar en BD
+    # 3. Guardar en BD (si ya guardamos un fichero con el mismo contenido, se reutiliza: ver _enlace_por_hash) y encolar miniatura + metadatos (los procesan los workers de utilidadesTrabajos)
     if id_existente and reemplazar:
         # En caso de reemplazo, usamos el ID existente
-        exito, resultado = reemplazar_recurso_simple(id_existente, ruta_fisica, tipo, tamano, fecha, id_usuario)
-        if exito and metadatos_extraidos:
-            guardar_metadatos(id_existente, metadatos_extraidos)
+        exito, resultado = reemplazar_recurso_simple(id_existente, ruta_fisica, tipo, tamano, fecha, id_usuario, hash_contenido, encolar=True)
+        if exito:
+            # El fichero anterior solo se borra si ya no lo usa ningún otro recurso
+            liberar_ficheros_sin_referencias([resultado])
+            return exito, id_existente
         return exito, resultado
     else:
         # Caso nuevo recurso
-        exito, id_recurso = subir_recurso(id_usuario, tipo, ruta_fisica, nombre_original, tamano, fecha, id_album)
-        
-        # SI LA SUBIDA FUE ÉXITOSA, GUARDAMOS LOS METADATOS
-        if exito and metadatos_extraidos:
-            guardar_metadatos(id_recurso, metadatos_extraidos) # <--- AQUÍ SE GUARDAN
-            
-        return exito, id_recurso
+        return subir_recurso(id_usuario, tipo, ruta_fisica, nombre_original, tamano, fecha, id_album, hash_contenido, encolar=True)
 
-def subir_recurso(id_creador: int, tipo: str, enlace: str, nombre: str, tamano: int, fecha_real: Optional[datetime] = None, id_album: Optional[int] = None ) -> Tuple[bool, Any]:
-    connection = None
+def subir_recurso(id_creador: int, tipo: str, enlace: str, nombre: str, tamano: int, fecha_real: Optional[datetime] = None, id_album: Optional[int] = None, hash_contenido: Optional[str] = None, encolar: bool = False, fichero_nuevo: bool = True) -> Tuple[bool, Any]:
+    """
+    fichero_nuevo=True: 'enlace' es el fichero que se acaba de subir; si ya hay uno con el mismo contenido se
+    usa ese y el subido se borra. fichero_nuevo=False (registrar_por_hash): 'enlace' es de otro recurso y
+    tiene que seguir existiendo al insertar, si no se devuelve (False, "NO_EXISTE").
+    """
     try:
-        connection = db.get_connection()
-        connection.autocommit = False 
-        if connection.is_connected():
-            cursor = connection.cursor()
-            query_1 = "INSERT INTO Recurso (id_creador, tipo, enlace, nombre, tamano, fecha_real) VALUES(%s,%s,%s,%s,%s,%s)"
-            valores = (id_creador, tipo, enlace, nombre, tamano, fecha_real)
-            cursor.execute(query_1, valores)
-            id_recurso = cursor.lastrowid
+        with ejecutorSQL.transaction() as sql:
+            enlace_final = enlace
+            if hash_contenido:
+                enlace_existente = _enlace_por_hash(sql, hash_contenido, tamano)
+                if enlace_existente:
+                    enlace_final = enlace_existente
+                elif not fichero_nuevo:
+                    return (False, "NO_EXISTE")
+            query_1 = "INSERT INTO Recurso (id_creador, tipo, enlace, nombre, tamano, fecha_real, hash_contenido) VALUES(%s,%s,%s,%s,%s,%s,%s)"
+            valores = (id_creador, tipo, enlace_final, nombre, tamano, fecha_real, hash_contenido)
+            sql.execute(query_1, valores)
+            id_recurso = sql.lastrowid
             if id_album is not None:
                 query_3 = "INSERT INTO Recurso_Album (id_album, id_recurso) VALUES (%s, %s)"
-                cursor.execute(query_3, (id_album, id_recurso))
-            connection.commit()
-            return (True, id_recurso)
+                sql.execute(query_3, (id_album, id_recurso))
+            if encolar:
+                consultasTrabajos.encolar_trabajo(sql, id_recurso)
+            consultasSincronizacion.registrar_cambios_recursos(sql, [id_recurso], 'CREAR')
     except Error as e:
-        if connection and connection.is_connected():
-            connection.rollback()
         print(f"Error en subir recurso en MySql: {e}")
         return (False, str(e))
-    finally:
-        if connection is not None and connection.is_connected():
-            if 'cursor' in locals(): cursor.close()
-            connection.close()
-
-def verificar_espacio_usuario(id_usuario: int, tamano_nuevo_archivo: int) -> Tuple[bool, str]:
-    connection = None
+    if fichero_nuevo and enlace_final != enlace:
+        _borrar_copia_subida(enlace)
+    if id_album is not None:
+        cacheEnlaces.invalidar_todo()
+    return (True, id_recurso)
+
+def verificar_espacio_usuario(id_usuario: int, tamano_nuevo_archivo: int, comprobar_disco: bool = True) -> Tuple[bool, str]:
+    # comprobar_disco=False cuando el recurso reutiliza un fichero ya guardado (no ocupa disco nuevo, pero sí cuota)
     try:
-        connection = db.get_connection()
-        cursor = connection.cursor(dictionary=True)
         sql_user = """
             SELECT P.almacenamiento_maximo, COALESCE(SUM(R.tamano), 0) as usado
             FROM Persona P
@@ -764,15 +995,15 @@ def verificar_espacio_usuario(id_usuario: int, tamano_nuevo_archivo: int) -> Tup
             WHERE P.id = %s
             GROUP BY P.id
         """
-        cursor.execute(sql_user, (id_usuario,))
-        datos = cursor.fetchone()
+        datos = ejecutorSQL.fetch_one(sql_user, (id_usuario,))
         if not datos: return False, "Usuario no encontrado"
         limite_usuario = datos['almacenamiento_maximo'] # Puede ser None (Ilimitado)
         usado_usuario = datos['usado']
+        # La conexión ya ha vuelto al pool: lo que queda es disco
         if not os.path.exists(UPLOADS_DIR):
             os.makedirs(UPLOADS_DIR, exist_ok=True)
         total, used, free = shutil.disk_usage(UPLOADS_DIR)
-        if tamano_nuevo_archivo > free:
+        if comprobar_disco and tamano_nuevo_archivo > free:
             return False, "El servidor está lleno (Espacio físico agotado)."
         if limite_usuario is not None:
             if (usado_usuario + tamano_nuevo_archivo) > limite_usuario:
@@ -780,8 +1011,6 @@ def verificar_espacio_usuario(id_usuario: int, tamano_nuevo_archivo: int) -> Tup
         return True, "OK"
     except Error as e:
         return False, str(e)
-    finally:
-        if connection: connection.close()
 
 def check_recurso_existe_en_album(id_usuario: int, nombre: str, id_album: Optional[int]) -> Optional[int]:
     connection = None
@@ -838,14 +1067,17 @@ def revocar_acceso_recurso(id_recurso: int, id_propietario: int, id_usuario_a_el
         if cursor.fetchone()[0] == 0:
              return (False, "No eres propietario de este recurso")
 
-        # 2. Eliminar al otro usuario
+        # 2. Eliminar al otro usuario (registrado antes: así él también recibe el cambio)
+        consultasSincronizacion.registrar_cambios_recursos(cursor, [id_recurso], 'REVOCAR')
         delete = "DELETE FROM Recurso_Persona WHERE id_recurso=%s AND id_persona=%s"
         cursor.execute(delete, (id_recurso, id_usuario_a_eliminar))
         
         if cursor.rowcount == 0:
+            connection.rollback()
             return (False, "El usuario no tenía acceso a este recurso")
             
         connection.commit()
+        cacheAccesos.invalidar_recursos([id_recurso])
         return (True, "Acceso revocado")
     except Error as e:
         return (False, str(e))
@@ -881,12 +1113,14 @@ def revocar_todos_accesos_recurso(id_recurso: int, id_persona: int):
                 return (False, "Acción denegada: Solo el creador original puede revocar todos los accesos")
 
             # 2. EJECUCIÓN: Borramos a todos de la tabla intermedia MENOS al creador.
+            consultasSincronizacion.registrar_cambios_recursos(cursor, [id_recurso], 'REVOCAR')
             query_delete = "DELETE FROM Recurso_Persona WHERE id_recurso = %s AND id_persona != %s"
             cursor.execute(query_delete, (id_recurso, id_persona))
             
             personas_eliminadas = cursor.rowcount
             
             connection.commit()
+            cacheAccesos.invalidar_recursos([id_recurso])
             
             if personas_eliminadas == 0:
                 return (True, "Nadie más tenía acceso, no se realizaron cambios.")
@@ -902,37 +1136,36 @@ def revocar_todos_accesos_recurso(id_recurso: int, id_persona: int):
         if cursor: cursor.close()
         if connection and connection.is_connected(): connection.close()
 
-def reemplazar_recurso_simple(id_recurso: int, nuevo_enlace: str, nuevo_tipo: str, nuevo_tamano: int, nueva_fecha_real: Optional[datetime], id_usuario: int) -> Tuple[bool, Any]:
-    connection = None
+def reemplazar_recurso_simple(id_recurso: int, nuevo_enlace: str, nuevo_tipo: str, nuevo_tamano: int, nueva_fecha_real: Optional[datetime], id_usuario: int, nuevo_hash: Optional[str] = None, encolar: bool = False) -> Tuple[bool, Any]:
     try:
-        connection = db.get_connection()
-        connection.autocommit = False
-        cursor = connection.cursor()
+        with ejecutorSQL.transaction() as sql:
+            resultado = sql.fetch_one("SELECT enlace FROM Recurso WHERE id = %s AND id_creador = %s", (id_recurso, id_usuario))
+            if not resultado:
+                return False, "Recurso original no encontrado"
+            ruta_vieja = resultado['enlace']
 
-        cursor.execute("SELECT enlace FROM Recurso WHERE id = %s AND id_creador = %s", (id_recurso, id_usuario))
-        resultado = cursor.fetchone()
-        
-        if not resultado:
-            return False, "Recurso original no encontrado"
-        ruta_vieja = resultado[0]
-
-        # Actualizamos Hash también
-        sql_update = """
-            UPDATE Recurso 
-            SET enlace = %s, tipo = %s, tamano = %s, fecha_real = %s, fecha_subida = NOW(), fecha_eliminacion = NULL
-            WHERE id = %s AND id_creador = %s
-        """
-        cursor.execute(sql_update, (nuevo_enlace, nuevo_tipo, nuevo_tamano, nueva_fecha_real, id_recurso, id_usuario))
-        
-        connection.commit()
-        return True, ruta_vieja
+            # Mismo contenido ya guardado (puede ser el propio fichero anterior): se reutiliza
+            enlace_final = (_enlace_por_hash(sql, nuevo_hash, nuevo_tamano) if nuevo_hash else None) or nuevo_enlace
 
+            # Actualizamos Hash también
+            sql_update = """
+                UPDATE Recurso 
+                SET enlace = %s, tipo = %s, tamano = %s, fecha_real = %s, hash_contenido = %s, fecha_subida = NOW(), fecha_eliminacion = NULL
+                WHERE id = %s AND id_creador = %s
+            """
+            sql.execute(sql_update, (enlace_final, nuevo_tipo, nuevo_tamano, nueva_fecha_real, nuevo_hash, id_recurso, id_usuario))
+            if encolar:
+                # Los metadatos del fichero anterior ya no valen: el worker guardará los nuevos
+                sql.execute("DELETE FROM Metadatos WHERE id_recurso = %s", (id_recurso,))
+                consultasTrabajos.encolar_trabajo(sql, id_recurso)
+            consultasSincronizacion.registrar_cambios_recursos(sql, [id_recurso], 'REEMPLAZAR')
     except Error as e:
-        if connection: connection.rollback()
         print(e)
         return False, str(e)
-    finally:
-        if connection: connection.close()
+    cacheAccesos.invalidar_recursos([id_recurso])
+    if enlace_final != nuevo_enlace:
+        _borrar_copia_subida(nuevo_enlace)
+    return True, ruta_vieja
 
 def guardar_metadatos(id_recurso, meta):
     connection = None
@@ -960,6 +1193,159 @@ def guardar_metadatos(id_recurso, meta):
     finally:
         if connection: connection.close()
 
+def _borrar_copia_subida(ruta: str):
+    """La subida reutilizó un fichero ya guardado: sobra la copia recién ensamblada (el recurso ya está en BD)"""
+    try:
+        os.remove(ruta)
+    except OSError as e:
+        print(f"Warning: no se pudo borrar la copia duplicada {ruta}: {e}")
+
+def _enlace_por_hash(sql, hash_contenido: str, tamano: int) -> Optional[str]:
+    """
+    Ruta física de un fichero ya guardado con ese contenido (o None). Se llama con el ejecutor de la transacción
+    que inserta / actualiza el Recurso: el FOR UPDATE (sobre idx_recurso_hash) bloquea los recursos que usan
+    esa ruta hasta el commit, así un borrado concurrente del último de ellos espera y al recontar
+    (enlaces_sin_referencias) ya ve el recurso nuevo en vez de borrar el fichero.
+    """
+    filas = sql.fetch_all("SELECT enlace FROM Recurso WHERE hash_contenido = %s AND tamano = %s FOR UPDATE", (hash_contenido, tamano))
+    for fila in filas:
+        # Solo nos vale si el fichero sigue en disco
+        if fila['enlace'] and os.path.exists(fila['enlace']):
+            return fila['enlace']
+    return None
+
+def enlaces_sin_referencias(cursor, enlaces: List[str]) -> List[str]:
+    """
+    De una lista de rutas físicas, devuelve las que ya no usa ningún Recurso.
+    Con la deduplicación varios recursos comparten fichero: el recuento de filas
+    que apuntan a cada ruta hace de contador de referencias.
+    Lectura con bloqueo (FOR UPDATE sobre idx_recurso_enlace): hay que llamarla en la misma transacción que
+    borra los recursos, antes del commit. Si una subida está reutilizando la ruta (_enlace_por_hash) espera
+    a que termine y la cuenta; y ninguna subida posterior la encuentra, porque ya no queda recurso que la use.
+    """
+    enlaces = list({e for e in enlaces if e})
+    if not enlaces:
+        return []
+    format_strings = ','.join(['%s'] * len(enlaces))
+    cursor.execute(f"SELECT DISTINCT enlace FROM Recurso WHERE enlace IN ({format_strings}) FOR UPDATE", tuple(enlaces))
+    en_uso = {fila['enlace'] if isinstance(fila, dict) else fila[0] for fila in cursor.fetchall()}
+    return [e for e in enlaces if e not in en_uso]
+
+def liberar_ficheros_sin_referencias(enlaces: List[str]):
+    """Borra del disco (original y miniatura) las rutas que ya no referencia ningún Recurso"""
+    connection = None
+    cursor = None
+    try:
+        connection = db.get_connection()
+        connection.autocommit = False
+        cursor = connection.cursor()
+        # Los bloqueos del recuento se mantienen hasta haber borrado los ficheros
+        for ruta in enlaces_sin_referencias(cursor, enlaces):
+            utilidadesFicheros.borrar_fichero_fisico(ruta)
+        connection.commit()
+    except Error as e:
+        print(f"Error liberando ficheros: {e}")
+    finally:
+        if cursor: cursor.close()
+        if connection and connection.is_connected(): connection.close()
+
+def buscar_hashes_propios(id_usuario: int, hashes: List[str]) -> dict:
+    """
+    Devuelve {(hash, tamano): {id, enlace, fecha_real}} de los ficheros que el usuario ya tiene guardados.
+    Solo se buscan recursos propios: así nadie puede "reclamar" un fichero ajeno conociendo solo su hash.
+    """
+    hashes = list({h for h in hashes if h})
+    if not hashes:
+        return {}
+    connection = None
+    cursor = None
+    try:
+        connection = db.get_connection()
+        cursor = connection.cursor(dictionary=True)
+        format_strings = ','.join(['%s'] * len(hashes))
+        sql = f"""
+            SELECT r.id, r.enlace, r.fecha_real, r.hash_contenido, r.tamano
+            FROM Recurso r
+            JOIN Recurso_Persona rp ON r.id = rp.id_recurso
+            WHERE rp.id_persona = %s AND r.hash_contenido IN ({format_strings})
+        """
+        cursor.execute(sql, (id_usuario, *hashes))
+        encontrados = {}
+        for fila in cursor.fetchall():
+            clave = (fila['hash_contenido'], fila['tamano'])
+            # Solo nos vale si el fichero sigue en disco
+            if clave not in encontrados and fila['enlace'] and os.path.exists(fila['enlace']):
+                encontrados[clave] = fila
+        return encontrados
+    except Error as e:
+        print(f"Error buscando hashes: {e}")
+        return {}
+    finally:
+        if cursor: cursor.close()
+        if connection and connection.is_connected(): connection.close()
+
+def copiar_metadatos(id_origen: int, id_destino: int):
+    connection = None
+    try:
+        connection = db.get_connection()
+        cursor = connection.cursor()
+        sql = """
+            INSERT INTO Metadatos (id_recurso, dispositivo, iso, apertura, velocidad, latitud, longitud, ancho, alto)
+            SELECT %s, dispositivo, iso, apertura, velocidad, latitud, longitud, ancho, alto
+            FROM Metadatos WHERE id_recurso = %s
+        """
+        cursor.execute(sql, (id_destino, id_origen))
+        connection.commit()
+    except Exception as e:
+        print(f"Error copiando metadatos: {e}")
+    finally:
+        if connection: connection.close()
+
+def registrar_por_hash(id_usuario: int, archivos: List[Any]) -> List[dict]:
+    """
+    Crea directamente los recursos cuyo contenido ya está en el servidor, sin que el cliente suba los bytes.
+    Para cada archivo devuelve un estado:
+      CREADO      -> recurso creado reutilizando el fichero existente (id_recurso)
+      NO_EXISTE   -> el servidor no tiene ese contenido: hay que subirlo por /upload/chunk
+      DUPLICADO   -> ya hay un recurso con ese nombre en el álbum destino
+      SIN_ESPACIO -> se superaría la cuota del usuario
+      ERROR       -> fallo al guardar en BD
+    """
+    existentes = buscar_hashes_propios(id_usuario, [a.hash.lower() for a in archivos])
+    resultados = []
+    for archivo in archivos:
+        resultado = {"hash": archivo.hash, "nombre": archivo.nombre}
+        origen = existentes.get((archivo.hash.lower(), archivo.tamano))
+        if not origen:
+            resultado["estado"] = "NO_EXISTE"
+            resultados.append(resultado)
+            continue
+        # La cuota se cuenta por recurso, aunque el fichero físico sea compartido
+        puede, msg = verificar_espacio_usuario(id_usuario, archivo.tamano, comprobar_disco=False)
+        if not puede:
+            resultado["estado"] = "SIN_ESPACIO"
+            resultado["detalle"] = msg
+            resultados.append(resultado)
+            continue
+        if check_recurso_existe_en_album(id_usuario, archivo.nombre, archivo.id_album):
+            resultado["estado"] = "DUPLICADO"
+            resultados.append(resultado)
+            continue
+        fecha = archivo.fecha or origen['fecha_real']
+        exito, id_recurso = subir_recurso(id_usuario, archivo.tipo, origen['enlace'], archivo.nombre, archivo.tamano, fecha, archivo.id_album, archivo.hash.lower(), fichero_nuevo=False)
+        if id_recurso == "NO_EXISTE":
+            # El fichero de origen se borró entre la búsqueda y la inserción
+            resultado["estado"] = "NO_EXISTE"
+        elif exito:
+            copiar_metadatos(origen['id'], id_recurso)
+            resultado["estado"] = "CREADO"
+            resultado["id_recurso"] = id_recurso
+        else:
+            resultado["estado"] = "ERROR"
+            resultado["detalle"] = str(id_recurso)
+        resultados.append(resultado)
+    return resultados
+
 #-------------------------------------------------------------------------------------------------------
 #                       Funciones que se ejecutan de manera temporal
 #----------------------------------------------------------------------------------------------------
@@ -973,6 +1359,7 @@ def purgar_papelera_automatica(dias_retencion: int = 30):
     connection = None
     try:
         connection = db.get_connection()
+        connection.autocommit = False
         cursor = connection.cursor(dictionary=True)
         
         # 1. Buscar archivos caducados (MySQL syntax)
@@ -993,40 +1380,24 @@ def purgar_papelera_automatica(dias_retencion: int = 30):
 
         print(f"Encontrados {len(archivos_a_borrar)} archivos antiguos para eliminar permanentemente.")
 
-        # 2. Borrar archivos físicos
-        ids_a_borrar = []
-        for recurso in archivos_a_borrar:
-            ids_a_borrar.append(recurso['id'])
-            
-            # Borrar Original
-            ruta_original = recurso['enlace']
-            try:
-                if os.path.exists(ruta_original):
-                    os.remove(ruta_original)
-            except Exception as e:
-                print(f"Error borrando físico {ruta_original}: {e}")
-
-            # Borrar Miniatura
-            try:
-                ruta_thumb = ruta_original.replace("uploads", "thumbnails")
-                if os.path.exists(ruta_thumb):
-                    os.remove(ruta_thumb)
-                else:
-                    # Intentar con extensión jpg por si acaso (para videos)
-                    nombre_sin_ext = os.path.splitext(ruta_thumb)[0]
-                    ruta_thumb_jpg = nombre_sin_ext + ".jpg"
-                    if os.path.exists(ruta_thumb_jpg):
-                        os.remove(ruta_thumb_jpg)
-            except Exception as e:
-                print(f"Error borrando thumbnail de {recurso['id']}: {e}")
-
-        # 3. Borrar de la Base de Datos (En lote)
-        if ids_a_borrar:
-            format_strings = ','.join(['%s'] * len(ids_a_borrar))
-            sql_delete = f"DELETE FROM Recurso WHERE id IN ({format_strings})"
-            cursor.execute(sql_delete, tuple(ids_a_borrar))
-            connection.commit()
-            print(f"Eliminados {cursor.rowcount} registros de la base de datos correctamente.")
+        ids_a_borrar = [recurso['id'] for recurso in archivos_a_borrar]
+
+        # 2. Borrar de la Base de Datos (En lote)
+        format_strings = ','.join(['%s'] * len(ids_a_borrar))
+        consultasSincronizacion.registrar_cambios_recursos(cursor, ids_a_borrar, 'ELIMINAR')
+        sql_delete = f"DELETE FROM Recurso WHERE id IN ({format_strings})"
+        cursor.execute(sql_delete, tuple(ids_a_borrar))
+        eliminados = cursor.rowcount
+        # Ficheros que ya no use ningún otro recurso (recuento con bloqueo, antes del commit)
+        rutas_libres = enlaces_sin_referencias(cursor, [recurso['enlace'] for recurso in archivos_a_borrar])
+        connection.commit()
+        cacheAccesos.invalidar_recursos(ids_a_borrar)
+        print(f"Eliminados {eliminados} registros de la base de datos correctamente.")
+
+        # 3. Borrar archivos físicos (original y miniatura)
+        for ruta in rutas_libres:
+            utilidadesFicheros.borrar_fichero_fisico(ruta)
+        print(f"Liberados {len(rutas_libres)} ficheros físicos.")
 
     except Exception as e:
         print(f"Error CRÍTICO en purga automática: {e}")
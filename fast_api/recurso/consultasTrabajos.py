@@ -0,0 +1,169 @@
+import os
+from fast_api import db, ejecutorSQL
+import fast_api.seguridad.cacheAccesos as cacheAccesos
+import fast_api.sincronizacion.consultasSincronizacion as consultasSincronizacion
+from mysql.connector import Error
+from typing import Optional, Tuple, Any
+
+MAX_INTENTOS = 3
+# Tras el fallo n el trabajo espera RETARDO_BASE_SEGUNDOS * 2^(n-1) antes de volver a reclamarse
+RETARDO_BASE_SEGUNDOS = int(os.getenv("TRABAJOS_RETARDO_BASE", "30"))
+
+#-------------------------------------------------------------------------------------------------------
+#                       COLA PERSISTENTE DE PROCESADO (miniaturas y metadatos)
+#--------------------------------------------------------------------------------------------------------
+# Los trabajos viven en la tabla Trabajo_Procesado, así sobreviven a un reinicio del servidor.
+# Se encolan en la misma transacción que crea el Recurso (ver subir_recurso / reemplazar_recurso_simple).
+
+def encolar_trabajo(cursor, id_recurso: int):
+    """Encola un trabajo usando el cursor o el ejecutor (y la transacción) de quien llama"""
+    cursor.execute("UPDATE Recurso SET estado_procesado = 'PENDIENTE' WHERE id = %s", (id_recurso,))
+    cursor.execute("INSERT INTO Trabajo_Procesado (id_recurso) VALUES (%s)", (id_recurso,))
+
+def reclamar_trabajo() -> Optional[dict]:
+    """
+    Coge el trabajo pendiente más antiguo y lo marca EN_PROCESO.
+    SKIP LOCKED permite que varios workers reclamen a la vez sin pisarse.
+    """
+    try:
+        with ejecutorSQL.transaction() as sql:
+            trabajo = sql.fetch_one("""
+                SELECT T.id, T.id_recurso, T.intentos, R.enlace, R.tipo
+                FROM Trabajo_Procesado T
+                JOIN Recurso R ON R.id = T.id_recurso
+                WHERE T.estado = 'PENDIENTE' AND T.disponible_desde <= NOW()
+                ORDER BY T.id
+                LIMIT 1
+                FOR UPDATE OF T SKIP LOCKED
+            """)
+            if not trabajo:
+                return None
+            sql.execute("""
+                UPDATE Trabajo_Procesado
+                SET estado = 'EN_PROCESO', intentos = intentos + 1, fecha_inicio = NOW()
+                WHERE id = %s
+            """, (trabajo['id'],))
+            sql.execute("UPDATE Recurso SET estado_procesado = 'PROCESANDO' WHERE id = %s", (trabajo['id_recurso'],))
+            return trabajo
+    except Error as e:
+        print(f"Error reclamando trabajo: {e}")
+        return None
+
+def completar_trabajo(id_trabajo: int, id_recurso: int, meta: Optional[dict]) -> Tuple[bool, Any]:
+    """Guarda metadatos (y la fecha real si venía en el EXIF) y cierra el trabajo en una sola transacción"""
+    connection = None
+    cursor = None
+    try:
+        connection = db.get_connection()
+        connection.autocommit = False
+        cursor = connection.cursor()
+        if meta:
+            cursor.execute("DELETE FROM Metadatos WHERE id_recurso = %s", (id_recurso,))
+            cursor.execute("""
+                INSERT INTO Metadatos (id_recurso, dispositivo, iso, apertura, velocidad, latitud, longitud, ancho, alto)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, (id_recurso, meta["dispositivo"], meta["iso"], meta["apertura"], meta["velocidad"],
+                  meta["latitud"], meta["longitud"], meta["ancho"], meta["alto"]))
+            if meta.get("fecha"):
+                cursor.execute("UPDATE Recurso SET fecha_real = %s WHERE id = %s", (meta["fecha"], id_recurso))
+        cursor.execute("UPDATE Recurso SET estado_procesado = 'COMPLETADO' WHERE id = %s", (id_recurso,))
+        cursor.execute("""
+            UPDATE Trabajo_Procesado SET estado = 'COMPLETADO', error = NULL, fecha_fin = NOW()
+            WHERE id = %s
+        """, (id_trabajo,))
+        # Las miniaturas y la fecha real ya están: los clientes tienen que volver a pedir el recurso
+        consultasSincronizacion.registrar_cambios_recursos(cursor, [id_recurso], 'PROCESADO')
+        connection.commit()
+        cacheAccesos.invalidar_recursos([id_recurso])
+        return True, "OK"
+    except Error as e:
+        if connection: connection.rollback()
+        print(f"Error completando trabajo {id_trabajo}: {e}")
+        return False, str(e)
+    finally:
+        if cursor: cursor.close()
+        if connection and connection.is_connected(): connection.close()
+
+def fallar_trabajo(id_trabajo: int, id_recurso: int, intentos: int, error: str):
+    """Devuelve el trabajo a la cola (con espera exponencial) o lo marca ERROR si ya agotó los intentos"""
+    estado = 'ERROR' if intentos >= MAX_INTENTOS else 'PENDIENTE'
+    # Sin espera, un fichero que siempre falla gastaría todos los intentos seguidos
+    retardo = RETARDO_BASE_SEGUNDOS * 2 ** max(intentos - 1, 0)
+    try:
+        with ejecutorSQL.transaction() as sql:
+            sql.execute("""
+                UPDATE Trabajo_Procesado
+                SET estado = %s, error = %s, fecha_fin = NOW(), disponible_desde = NOW() + INTERVAL %s SECOND
+                WHERE id = %s
+            """, (estado, error[:500], retardo, id_trabajo))
+            sql.execute("UPDATE Recurso SET estado_procesado = %s WHERE id = %s", (estado, id_recurso))
+    except Error as e:
+        print(f"Error marcando fallo del trabajo {id_trabajo}: {e}")
+
+def recuperar_trabajos_interrumpidos() -> int:
+    """
+    Al arrancar, los trabajos que quedaron EN_PROCESO (el servidor se cayó a mitad) vuelven a la cola.
+    Supone un único proceso servidor, que es como se despliega en la Raspberry.
+    """
+    connection = None
+    cursor = None
+    try:
+        connection = db.get_connection()
+        connection.autocommit = False
+        cursor = connection.cursor()
+        cursor.execute("""
+            UPDATE Recurso R JOIN Trabajo_Procesado T ON T.id_recurso = R.id
+            SET R.estado_procesado = 'PENDIENTE'
+            WHERE T.estado = 'EN_PROCESO'
+        """)
+        cursor.execute("UPDATE Trabajo_Procesado SET estado = 'PENDIENTE' WHERE estado = 'EN_PROCESO'")
+        recuperados = cursor.rowcount
+        connection.commit()
+        return recuperados
+    except Error as e:
+        if connection: connection.rollback()
+        print(f"Error recuperando trabajos: {e}")
+        return 0
+    finally:
+        if cursor: cursor.close()
+        if connection and connection.is_connected(): connection.close()
+
+def obtener_estado_procesado(id_recurso: int) -> Optional[dict]:
+    connection = None
+    cursor = None
+    try:
+        connection = db.get_connection()
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT R.estado_procesado, T.intentos, T.error
+            FROM Recurso R
+            LEFT JOIN Trabajo_Procesado T ON T.id = (
+                SELECT MAX(T2.id) FROM Trabajo_Procesado T2 WHERE T2.id_recurso = R.id
+            )
+            WHERE R.id = %s
+        """, (id_recurso,))
+        return cursor.fetchone()
+    except Error as e:
+        print(f"Error obteniendo estado de procesado: {e}")
+        return None
+    finally:
+        if cursor: cursor.close()
+        if connection and connection.is_connected(): connection.close()
+
+def purgar_trabajos_completados(dias: int = 7):
+    """Los trabajos terminados solo sirven de histórico: se borran pasados unos días"""
+    connection = None
+    cursor = None
+    try:
+        connection = db.get_connection()
+        cursor = connection.cursor()
+        cursor.execute("""
+            DELETE FROM Trabajo_Procesado
+            WHERE estado = 'COMPLETADO' AND fecha_fin < NOW() - INTERVAL %s DAY
+        """, (dias,))
+        connection.commit()
+    except Error as e:
+        print(f"Error purgando trabajos: {e}")
+    finally:
+        if cursor: cursor.close()
+        if connection and connection.is_connected(): connection.close()
@@ -1,5 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException, Request, Form
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 import secrets
 from fast_api import db
@@ -8,10 +8,12 @@ from typing import Optional
 from pydantic import BaseModel
 import fast_api.seguridad.funcionesSeguridad as funcionesSeguridad
 import os
-import zipfile
-import io
 from fastapi.responses import StreamingResponse
 from fast_api.recurso import modeloDatosRecurso
+import fast_api.recurso.consultasEnlaces as consultasEnlaces
+import fast_api.recurso.cacheEnlaces as cacheEnlaces
+import fast_api.utilidades.utilidadesHttp as utilidadesHttp
+import fast_api.utilidades.utilidadesZip as utilidadesZip
 
 
 router = APIRouter()
@@ -32,6 +34,10 @@ def generar_token():
 
 @router.post("/share/crear")
 def crear_enlace_publico(datos: modeloDatosRecurso.CrearEnlace, current_user_id: int = Depends(funcionesSeguridad.get_current_user_id)):
+    # Solo se puede publicar lo que uno mismo puede ver (los álbumes se publican con todas sus subcarpetas)
+    visible, motivo = consultasEnlaces.contenido_visible(current_user_id, datos.ids_recursos, datos.ids_albumes)
+    if not visible:
+        raise HTTPException(status_code=403, detail=motivo)
     conn = db.get_connection()
     cursor = conn.cursor()
     try:
@@ -68,129 +74,129 @@ def crear_enlace_publico(datos: modeloDatosRecurso.CrearEnlace, current_user_id:
 
 # --- ENDPOINTS PÚBLICOS (Para la abuela) ---
 
+# Cookie de desbloqueo: se emite tras acertar la contraseña una vez (bcrypt) y limitada a /s/{token}
+COOKIE_DESBLOQUEO = "desbloqueo_enlace"
+
+def _desbloqueado(request: Request, link: dict) -> bool:
+    """True si el enlace no tiene contraseña o el navegador trae una cookie de desbloqueo válida (solo HMAC)"""
+    if not link['password_hash']:
+        return True
+    return funcionesSeguridad.verificar_desbloqueo_enlace(
+        link['token'], link['password_hash'], request.cookies.get(COOKIE_DESBLOQUEO)
+    )
+
+def _comprobar_acceso_enlace(request: Request, link: Optional[dict]):
+    """Para las descargas: enlace existente, sin caducar y desbloqueado"""
+    if not link:
+        raise HTTPException(status_code=404, detail="Enlace no encontrado")
+    if link['fecha_expiracion'] and link['fecha_expiracion'] < datetime.now():
+        raise HTTPException(status_code=410, detail="Enlace caducado")
+    if not _desbloqueado(request, link):
+        raise HTTPException(status_code=403, detail="Enlace protegido: introduce la contraseña")
+
 @router.get("/s/{token}", response_class=HTMLResponse)
-def ver_enlace(token: str, request: Request):
-    return procesar_vista_enlace(token, request, None)
+def ver_enlace(token: str, request: Request, pagina: int = 1):
+    return procesar_vista_enlace(token, request, None, pagina)
 
 @router.post("/s/{token}", response_class=HTMLResponse)
 def verificar_password_enlace(token: str, request: Request, password: str = Form(...)):
     return procesar_vista_enlace(token, request, password)
 
-def procesar_vista_enlace(token: str, request: Request, password_input: str = None):
-    conn = db.get_connection()
-    cursor = conn.cursor(dictionary=True)
-    try:
-        # 1. Buscar enlace
-        cursor.execute("SELECT * FROM EnlacePublico WHERE token = %s", (token,))
-        link = cursor.fetchone()
-
-        if not link:
-            return templates.TemplateResponse("compartido.html", {"request": request, "error": "Enlace no encontrado."})
-
-        # 2. Validaciones (Expiración y Password) - IGUAL QUE ANTES
-        if link['fecha_expiracion'] and link['fecha_expiracion'] < datetime.now():
-            return templates.TemplateResponse("compartido.html", {"request": request, "error": "Caducado."})
-
-        if link['password_hash']:
-            if not password_input:
-                return templates.TemplateResponse("compartido.html", {"request": request, "protegido": True})
-            if not funcionesSeguridad.verificar_contra(password_input, link['password_hash']):
-                return templates.TemplateResponse("compartido.html", {"request": request, "protegido": True, "msg_error": "Pass incorrecta"})
-
-        # 3. OBTENER CONTENIDO MÚLTIPLE
-        # Buscamos en la tabla de contenido
-        cursor.execute("""
-            SELECT r.nombre, r.tipo, r.tamano, 'RECURSO' as tipo_item 
-            FROM EnlacePublico_Contenido c
-            JOIN Recurso r ON c.id_recurso = r.id
-            WHERE c.id_enlace = %s
-        """, (link['id'],))
-        recursos = cursor.fetchall()
-
-        cursor.execute("""
-            SELECT a.nombre, 'ALBUM' as tipo_item 
-            FROM EnlacePublico_Contenido c
-            JOIN Album a ON c.id_album = a.id
-            WHERE c.id_enlace = %s
-        """, (link['id'],))
-        albumes = cursor.fetchall()
-        
-        lista_items = albumes + recursos
-        
-        # Calcular tamaño total aprox
-        total_size = sum([r['tamano'] for r in recursos]) if recursos else 0
-        total_size_str = f"{total_size / (1024*1024):.2f} MB"
-
-        return templates.TemplateResponse("compartido.html", {
-            "request": request,
-            "token": token,
-            "lista_items": lista_items, # Pasamos la lista a la plantilla
-            "cantidad": len(lista_items),
-            "tamano_total": total_size_str
-        })
-
-    finally:
-        conn.close()
+def procesar_vista_enlace(token: str, request: Request, password_input: str = None, pagina: int = 1):
+    # 1. Buscar enlace (cacheado por token: un enlace popular no toca la BD en cada visita)
+    link = consultasEnlaces.obtener_enlace(token)
+
+    if not link:
+        return templates.TemplateResponse("compartido.html", {"request": request, "error": "Enlace no encontrado."})
+
+    # 2. Validaciones (Expiración y Password) - IGUAL QUE ANTES
+    if link['fecha_expiracion'] and link['fecha_expiracion'] < datetime.now():
+        return templates.TemplateResponse("compartido.html", {"request": request, "error": "Caducado."})
+
+    # Con la cookie de desbloqueo no se vuelve a pasar por bcrypt (paginar, volver a la página...)
+    desbloquear = False
+    if not _desbloqueado(request, link):
+        if not password_input:
+            return templates.TemplateResponse("compartido.html", {"request": request, "protegido": True})
+        if not funcionesSeguridad.verificar_contra(password_input, link['password_hash']):
+            return templates.TemplateResponse("compartido.html", {"request": request, "protegido": True, "msg_error": "Pass incorrecta"})
+        desbloquear = True
+
+    # Las visitas se suman en memoria y se escriben en lote (consultasEnlaces.volcar_usos)
+    cacheEnlaces.contar_uso(link['id'])
+
+    # Sin contraseña la página es igual para todos: se sirve ya renderizada
+    if not link['password_hash']:
+        html = cacheEnlaces.obtener("html", token, pagina)
+        if html is not None:
+            return HTMLResponse(html)
+
+    # 3. OBTENER CONTENIDO: recursos sueltos + álbumes con todas sus subcarpetas, paginado
+    exito, contenido = consultasEnlaces.obtener_contenido_enlace_cacheado(token, link['id'], pagina)
+    if not exito:
+        return templates.TemplateResponse("compartido.html", {"request": request, "error": "No se pudo cargar el contenido."})
+
+    total_size_str = f"{contenido['tamano_total'] / (1024*1024):.2f} MB"
+
+    respuesta = templates.TemplateResponse("compartido.html", {
+        "request": request,
+        "token": token,
+        "lista_items": contenido['items'], # Pasamos la lista a la plantilla
+        "cantidad": contenido['total'],
+        "tamano_total": total_size_str,
+        "pagina": contenido['pagina'],
+        "paginas": contenido['paginas']
+    })
+    if not link['password_hash']:
+        cacheEnlaces.guardar(respuesta.body, "html", token, pagina)
+    if desbloquear:
+        respuesta.set_cookie(
+            COOKIE_DESBLOQUEO,
+            funcionesSeguridad.firmar_desbloqueo_enlace(token, link['password_hash']),
+            max_age=funcionesSeguridad.ENLACE_DESBLOQUEO_TTL,
+            path=f"/s/{token}",
+            httponly=True,
+            samesite="lax",
+            secure=request.url.scheme == "https"
+        )
+    return respuesta
 
 @router.get("/s/{token}/download")
-def descargar_directo(token: str):
-    """Descarga el archivo real si el token es válido y (opcionalmente) si ya pasó el check de pass (simplificado aquí)"""
+def descargar_directo(request: Request, token: str):
+    """Descarga el archivo real si el token es válido y, si tiene contraseña, ya se desbloqueó (cookie)"""
+    link = consultasEnlaces.obtener_enlace(token)
+    _comprobar_acceso_enlace(request, link)
     conn = db.get_connection()
     cursor = conn.cursor(dictionary=True)
     try:
-        cursor.execute("SELECT * FROM EnlacePublico WHERE token = %s", (token,))
-        link = cursor.fetchone()
-        
-        # Aquí deberíamos re-validar password (cookies o sesión), pero para MVP asumimos
-        # que si llega aquí es porque el usuario ya sabe la URL o pasó por el HTML
-        
-        if link and link['id_recurso']:
-             cursor.execute("SELECT enlace, nombre FROM Recurso WHERE id = %s", (link['id_recurso'],))
+        if link['id_recurso']:
+             cursor.execute("SELECT id, enlace, nombre, fecha_subida, tamano, hash_contenido FROM Recurso WHERE id = %s", (link['id_recurso'],))
              res = cursor.fetchone()
              if res and os.path.exists(res['enlace']):
-                 return FileResponse(res['enlace'], filename=res['nombre'])
+                 # Según MODO_ENTREGA lo envía Python o el servidor web de delante
+                 return utilidadesHttp.responder_fichero(
+                     request, res['enlace'], utilidadesHttp.etag_recurso(res), res['fecha_subida'], filename=res['nombre']
+                 )
         
         raise HTTPException(status_code=404, detail="Archivo no encontrado")
     finally:
         conn.close()
 
 @router.get("/s/{token}/download-zip")
-def descargar_zip(token: str):
-    conn = db.get_connection()
-    cursor = conn.cursor(dictionary=True)
-    try:
-        cursor.execute("SELECT * FROM EnlacePublico WHERE token = %s", (token,))
-        link = cursor.fetchone()
-        if not link: raise HTTPException(404)
-        
-        # NOTA: Aquí asumimos que el usuario ya validó pass antes o es público. 
-        # Para máxima seguridad, deberías pedir pass aquí también o usar una cookie de sesión temporal.
-
-        # Obtener rutas de archivos
-        cursor.execute("""
-            SELECT r.enlace, r.nombre 
-            FROM EnlacePublico_Contenido c
-            JOIN Recurso r ON c.id_recurso = r.id
-            WHERE c.id_enlace = %s
-        """, (link['id'],))
-        archivos = cursor.fetchall()
-        
-        # (Para esta versión v1, solo zipeamos archivos sueltos, no entramos recursivamente en carpetas para no complicar el código)
-
-        # Crear ZIP en memoria
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-            for arch in archivos:
-                if os.path.exists(arch['enlace']):
-                    zip_file.write(arch['enlace'], arcname=arch['nombre'])
-        
-        zip_buffer.seek(0)
-        
-        return StreamingResponse(
-            zip_buffer, 
-            media_type="application/zip", 
-            headers={"Content-Disposition": f"attachment; filename=compartido_{token}.zip"}
-        )
-
-    finally:
-        conn.close()
\ No newline at end of file
+def descargar_zip(request: Request, token: str):
+    link = consultasEnlaces.obtener_enlace(token)
+    _comprobar_acceso_enlace(request, link)
+
+    # Rutas de todos los archivos, álbumes incluidos (con sus subcarpetas), en una sola consulta
+    exito, archivos = consultasEnlaces.obtener_archivos_enlace(link['id'])
+    if not exito:
+        raise HTTPException(status_code=500, detail="No se pudo obtener el contenido del enlace")
+
+    # El ZIP se va generando mientras se envía: memoria constante sea cual sea el tamaño
+    return StreamingResponse(
+        utilidadesZip.generar_zip(utilidadesZip.nombres_unicos(
+            (arch['enlace'], arch['carpeta'], arch['nombre']) for arch in archivos
+        )),
+        media_type="application/zip", 
+        headers={"Content-Disposition": f"attachment; filename=compartido_{token}.zip"}
+    )
@@ -1,12 +1,19 @@
 import os
+import time
 import uuid
 from datetime import datetime
 from typing import Optional
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, Body
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, Body, Request
+from fastapi.concurrency import run_in_threadpool
 import fast_api.recurso.consultasRecursos as consultasRecursos
 import fast_api.seguridad.funcionesSeguridad as funcionesSeguridad
 from fast_api.recurso import modeloDatosRecurso
 import fast_api.utilidades.utilidadesFicheros as utilidadesFicheros
+import fast_api.utilidades.utilidadesTrabajos as utilidadesTrabajos
+import fast_api.utilidades.utilidadesMiniaturas as utilidadesMiniaturas
+import fast_api.utilidades.utilidadesMultimedia as utilidadesMultimedia
+import fast_api.utilidades.utilidadesHttp as utilidadesHttp
+import fast_api.recurso.consultasTrabajos as consultasTrabajos
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 STATIC_DIR = os.path.join(BASE_DIR, "static")
 UPLOADS_DIR = os.path.join(STATIC_DIR, "uploads")
@@ -20,10 +27,23 @@ router = APIRouter()
 
 #~Endpoint 1. Usuario ve sus propios recursos
 @router.get("/recurso/mis_recursos")
-def mis_recursos(current_user_id: int = Depends(funcionesSeguridad.get_current_user_id)):
-    exito, recursos = consultasRecursos.obtener_recursos(current_user_id)
-    if not exito: raise HTTPException(status_code=400, detail=str(recursos))
-    return recursos
+async def mis_recursos(cursor: Optional[str] = None, limite: Optional[int] = None, tipo: Optional[str] = None,
+                       id_album: Optional[int] = None, favoritos: bool = False, incluir_papelera: bool = False,
+                       current_user_id: int = Depends(funcionesSeguridad.get_current_user_id)):
+    # Sin parámetros de paginación ni filtros: la lista completa de siempre (apps antiguas)
+    if cursor is None and limite is None and tipo is None and id_album is None and not favoritos and not incluir_papelera:
+        exito, recursos = await consultasRecursos.obtener_recursos_async(current_user_id)
+        if not exito: raise HTTPException(status_code=400, detail=str(recursos))
+        return recursos
+    # Paginado: {"recursos": [...], "siguiente_cursor": "..."} -> pedir la siguiente con ?cursor=...
+    if tipo is not None and tipo not in consultasRecursos.TIPOS_RECURSO:
+        raise HTTPException(status_code=400, detail=f"Tipo no válido. Opciones: {', '.join(consultasRecursos.TIPOS_RECURSO)}")
+    exito, pagina = await run_in_threadpool(
+        consultasRecursos.obtener_recursos_pagina, current_user_id, limite or consultasRecursos.LIMITE_PAGINA_DEFECTO, cursor,
+        tipo, id_album, favoritos, incluir_papelera
+    )
+    if not exito: raise HTTPException(status_code=400, detail=str(pagina))
+    return pagina
 
 #~Endpoint 2. Usuario obtiene metadatos de un recurso
 @router.get("/recurso/metadatos/{id_recurso}")
@@ -74,7 +94,7 @@ def responder_solicitud_recurso(datos: modeloDatosRecurso.RespuestaPeticionRecur
     return {"mensaje": mensaje}
 
 @router.delete("/compartidos/salir/{id_recurso}")
-async def salir_de_recurso_compartido(
+def salir_de_recurso_compartido(
     id_recurso: int, 
     current_user_id: int = Depends(funcionesSeguridad.get_current_user_id)
 ):
@@ -167,13 +187,30 @@ def lote_mover(lote: modeloDatosRecurso.LoteMover,current_user_id: int = Depends
 
 #Endpoint 15. Usuario empieza la carga por chunks de un recurso
 @router.post("/upload/init")
-def init_upload(current_user_id: int = Depends(funcionesSeguridad.get_current_user_id)):
-    """Paso 1: Solicitar un ID de subida"""
+def init_upload(
+    tamano_total: Optional[int] = Form(None),
+    tamano_chunk: Optional[int] = Form(None),
+    current_user_id: int = Depends(funcionesSeguridad.get_current_user_id)
+):
+    """Paso 1: Solicitar un ID de subida.
+    Si el cliente indica tamano_total y tamano_chunk, el fichero final se reserva ya en uploads/
+    y cada chunk se escribe directamente en su posición (sin part_N ni reensamblado)."""
+    modo_directo = tamano_total is not None and tamano_chunk is not None
+    if modo_directo:
+        if tamano_total < 0 or tamano_chunk <= 0:
+            raise HTTPException(status_code=400, detail="Tamaños de subida no válidos")
+        # Comprobamos la cuota antes de reservar el espacio en disco
+        puede, msg = consultasRecursos.verificar_espacio_usuario(current_user_id, tamano_total)
+        if not puede:
+            raise HTTPException(status_code=507, detail=msg)
     upload_id = str(uuid.uuid4())
-    utilidadesFicheros.iniciar_carga_chunk(upload_id)
-    return {"upload_id": upload_id}
+    try:
+        utilidadesFicheros.iniciar_carga_chunk(upload_id, tamano_total, tamano_chunk, current_user_id)
+    except OSError as e:
+        raise HTTPException(status_code=507, detail=f"No se pudo reservar el espacio: {e}")
+    return {"upload_id": upload_id, "modo": "directo" if modo_directo else "trozos"}
 
-#~Endpoint 16. Usuario carga un nuevo chunk del recurso
+#~Endpoint 16. Usuario carga un nuevo chunk del recurso (multipart: versiones antiguas de la app; la actual usa el 16b)
 @router.post("/upload/chunk")
 async def upload_chunk(
     upload_id: str = Form(...),
@@ -182,10 +219,67 @@ async def upload_chunk(
     current_user_id: int = Depends(funcionesSeguridad.get_current_user_id)
 ):
     """Paso 2: Subir un trocito"""
-    content = await file.read()
-    utilidadesFicheros.guardar_chunk(upload_id, chunk_index, content)
+    if not utilidadesFicheros.es_propietario_carga(upload_id, current_user_id):
+        raise HTTPException(status_code=404, detail="Subida no encontrada")
+    # La copia se hace por bloques y fuera del event loop para no bloquear al resto de peticiones
+    try:
+        await run_in_threadpool(utilidadesFicheros.guardar_chunk, upload_id, chunk_index, file.file)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        await file.close()
     return {"mensaje": "Chunk recibido"}
 
+#~Endpoint 16b. Usuario carga un chunk enviando los bytes en crudo (sin multipart)
+@router.put("/upload/chunk/{upload_id}/{chunk_index}")
+async def upload_chunk_stream(
+    upload_id: str,
+    chunk_index: int,
+    request: Request,
+    current_user_id: int = Depends(funcionesSeguridad.get_current_user_id)
+):
+    """Paso 2 (alternativo): el cuerpo se escribe en disco según llega, sin fichero temporal intermedio"""
+    if not utilidadesFicheros.es_propietario_carga(upload_id, current_user_id):
+        raise HTTPException(status_code=404, detail="Subida no encontrada")
+    try:
+        escritura = await run_in_threadpool(utilidadesFicheros.abrir_chunk, upload_id, chunk_index)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    buffer = bytearray()
+    try:
+        async for bloque in request.stream():
+            buffer += bloque
+            if len(buffer) >= utilidadesFicheros.TAMANO_BUFFER:
+                await run_in_threadpool(utilidadesFicheros.escribir_bloque, escritura, bytes(buffer))
+                buffer.clear()
+        if buffer:
+            await run_in_threadpool(utilidadesFicheros.escribir_bloque, escritura, bytes(buffer))
+        await run_in_threadpool(utilidadesFicheros.cerrar_chunk, upload_id, chunk_index, escritura)
+    except ValueError as e:
+        await run_in_threadpool(escritura["destino"].close)
+        raise HTTPException(status_code=400, detail=str(e))
+    except BaseException:
+        await run_in_threadpool(escritura["destino"].close)
+        raise
+    return {"mensaje": "Chunk recibido", "bytes": escritura["escritos"], "crc32": f"{escritura['crc']:08x}"}
+
+#~Endpoint 16c. Usuario consulta qué chunks de una subida ya tiene el servidor (para reanudarla)
+@router.get("/upload/estado/{upload_id}")
+def estado_upload(upload_id: str, current_user_id: int = Depends(funcionesSeguridad.get_current_user_id)):
+    if not utilidadesFicheros.es_propietario_carga(upload_id, current_user_id):
+        raise HTTPException(status_code=404, detail="Subida no encontrada")
+    estado = utilidadesFicheros.estado_carga(upload_id)
+    if estado is None:
+        raise HTTPException(status_code=404, detail="Subida no encontrada o ya completada")
+    return estado
+
+#~Endpoint 16d. Antes de subir, el cliente pregunta qué contenidos (por hash) ya tiene el servidor
+@router.post("/upload/hashes")
+def registrar_por_hash(datos: modeloDatosRecurso.ConsultaHashes, current_user_id: int = Depends(funcionesSeguridad.get_current_user_id)):
+    """Los que ya existen se dan de alta sin transferir bytes; el resto se marcan NO_EXISTE para subirlos por chunks"""
+    resultados = consultasRecursos.registrar_por_hash(current_user_id, datos.archivos)
+    return {"resultados": resultados}
+
 #~Endpoint 17. Usuario ha completado la carga de un recurso
 @router.post("/upload/complete")
 def complete_upload(
@@ -198,10 +292,12 @@ def complete_upload(
     fecha: Optional[datetime] = Form(None),
     current_user_id: int = Depends(funcionesSeguridad.get_current_user_id)
 ):
-    """Paso 3: Ensamblar y procesar"""
+    """Paso 3: Ensamblar y registrar. Miniatura y metadatos se generan después en segundo plano"""
+    if not utilidadesFicheros.es_propietario_carga(upload_id, current_user_id):
+        raise HTTPException(status_code=404, detail="Subida no encontrada")
     try:
         # 1. Ensamblar
-        ruta_final = utilidadesFicheros.ensamblar_archivo(upload_id, nombre_archivo, total_chunks)
+        ruta_final, hash_contenido = utilidadesFicheros.ensamblar_archivo(upload_id, nombre_archivo, total_chunks)
         
         # Limpieza id_album
         id_album_int = None
@@ -209,9 +305,9 @@ def complete_upload(
             try: id_album_int = int(id_album)
             except: pass
 
-        # 2. Procesar (BD, Cuota, Miniaturas, Hash Check)
+        # 2. Procesar (BD, Cuota, Deduplicación por hash) y encolar miniatura + metadatos
         exito, res = consultasRecursos.procesar_archivo_local(
-            current_user_id, ruta_final, nombre_archivo, tipo, fecha, id_album_int, reemplazar
+            current_user_id, ruta_final, nombre_archivo, tipo, fecha, id_album_int, reemplazar, hash_contenido
         )
 
         if not exito:
@@ -226,7 +322,8 @@ def complete_upload(
             code = 507 if "cuota" in str(res).lower() or "espacio" in str(res).lower() else 500
             raise HTTPException(status_code=code, detail=str(res))
 
-        return {"mensaje": "Subida completada exitosamente", "info": res}
+        utilidadesTrabajos.avisar_trabajo_nuevo()
+        return {"mensaje": "Subida completada exitosamente", "info": res, "id_recurso": res, "estado_procesado": "PENDIENTE"}
 
     except HTTPException as he:
         raise he
@@ -234,26 +331,26 @@ def complete_upload(
         print(f"Error completando subida: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+#~Endpoint 17b. Estado del procesado en segundo plano (miniatura y metadatos) de un recurso
+@router.get("/recurso/estado_procesado/{id_recurso}")
+def estado_procesado(id_recurso: int, current_user_id: int = Depends(funcionesSeguridad.get_current_user_id)):
+    permiso, _ = consultasRecursos.obtener_recurso_por_id(id_recurso, current_user_id)
+    if not permiso:
+        raise HTTPException(status_code=403, detail="No tienes acceso")
+    estado = consultasTrabajos.obtener_estado_procesado(id_recurso)
+    if estado is None:
+        raise HTTPException(status_code=404, detail="Recurso no encontrado")
+    return estado
+
 #~Endpoint 18. Usuario borra un recurso de manera definitiva en la cloud
 @router.delete("/recurso/eliminar-definitivo/{id_recurso}")
 def eliminar_recurso_definitivo(id_recurso: int, current_user_id: int = Depends(funcionesSeguridad.get_current_user_id)):
     exito, resultado = consultasRecursos.eliminar_definitivamente_bd(id_recurso, current_user_id)
     if not exito:
         raise HTTPException(status_code=400, detail=str(resultado))
-    if resultado and isinstance(resultado, str): 
-        try:
-            if os.path.exists(resultado):
-                os.remove(resultado)
-            ruta_thumbnail = resultado.replace("uploads", "thumbnails")
-            if os.path.exists(ruta_thumbnail):
-                os.remove(ruta_thumbnail)
-            else:
-                nombre_sin_ext = os.path.splitext(ruta_thumbnail)[0]
-                ruta_thumb_jpg = nombre_sin_ext + ".jpg"
-                if os.path.exists(ruta_thumb_jpg):
-                    os.remove(ruta_thumb_jpg)   
-        except Exception as e:
-            print(f"Error borrando archivos físicos (BD ya limpia): {e}")
+    # Solo recibimos ruta si ningún otro recurso comparte ya ese fichero físico
+    if resultado and isinstance(resultado, str):
+        utilidadesFicheros.borrar_fichero_fisico(resultado)
     return {"mensaje": "Recurso eliminado permanentemente"}
 
 #---------------------------------------------------------------------------------------------------------
@@ -261,37 +358,62 @@ def eliminar_recurso_definitivo(id_recurso: int, current_user_id: int = Depends(
 #------------------------------------------------------------------------------------------------------------------
 
 @router.get("/recurso/archivo/{id_recurso}")
-def obtener_archivo_fisico(id_recurso: int, size: str = None, current_user_id: int = Depends(funcionesSeguridad.get_current_user_id)):
+async def obtener_archivo_fisico(request: Request, id_recurso: int, size: str = None, v: str = None, current_user_id: int = Depends(funcionesSeguridad.get_current_user_id)):
     # 1. Verificar permiso y obtener ruta de la BD
-    exito, res = consultasRecursos.obtener_recurso_por_id(id_recurso, current_user_id)
+    exito, res = await consultasRecursos.obtener_recurso_por_id_async(id_recurso, current_user_id)
     if not exito:
         raise HTTPException(status_code=403, detail="Acceso denegado o recurso no encontrado")
     
     # 'res' es el diccionario con los datos. 'enlace' tiene la ruta física (ej: .../static/uploads/foto.jpg)
     ruta_original = res['enlace']
+    preset = utilidadesMiniaturas.elegir_preset(size)
+    fecha = res['fecha_subida']
+    # Las URLs de los listados llevan ?v=<version>: si coincide, el contenido de esa URL no cambia nunca
+    inmutable = v is not None and v == utilidadesHttp.version_recurso(res)
+
+    # 2. Si el cliente ya tiene esta versión, 304 sin tocar el disco
+    etag = utilidadesHttp.etag_recurso(res, preset or "original")
+    if utilidadesHttp.no_modificado(request, etag, fecha):
+        return utilidadesHttp.respuesta_no_modificado(etag, fecha, inmutable)
+
+    # 3. Si se pide un tamaño (?size=small|medium|large o ?size=<px>) servimos el derivado más cercano
+    if preset and os.path.exists(ruta_original):
+        # Si falta se genera ahora (y se queda en disco para las siguientes peticiones)
+        ruta_derivado = await run_in_threadpool(utilidadesMultimedia.obtener_derivado, ruta_original, res['tipo'], preset)
+        if ruta_derivado and os.path.exists(ruta_derivado):
+            return utilidadesHttp.responder_fichero(request, ruta_derivado, etag, fecha, inmutable)
+        # Si no se pudo generar, devolvemos el original (con su propio ETag y sin fijarlo en caché:
+        # la próxima vez esta URL ya debería dar el derivado)
+        inmutable = False
     
-    # 2. Lógica para servir miniatura si se pide (?size=small)
-    if size == "small":
-        # Calculamos la ruta de la miniatura basándonos en la del original
-        # Reemplazamos la carpeta 'uploads' por 'thumbnails' en la ruta
-        ruta_thumb = ruta_original.replace("uploads", "thumbnails")
-        
-        # Si es video, la miniatura es .jpg aunque el original sea .mp4
-        if res['tipo'] == 'VIDEO':
-             nombre_sin_ext = os.path.splitext(ruta_thumb)[0]
-             ruta_thumb = nombre_sin_ext + ".jpg"
-
-        if os.path.exists(ruta_thumb):
-            return FileResponse(ruta_thumb)
-        else:
-            # Si no hay miniatura, devolvemos original (si es imagen)
-            if res['tipo'] == 'IMAGEN':
-                 return FileResponse(ruta_original)
-    
-    # 3. Servir archivo original
+    # 4. Servir archivo original (Range -> 206 para poder saltar en los vídeos)
     if not os.path.exists(ruta_original):
         raise HTTPException(status_code=404, detail="El archivo físico no existe en el servidor")
 
-    return FileResponse(ruta_original)
+    return utilidadesHttp.responder_fichero(request, ruta_original, utilidadesHttp.etag_recurso(res, "original"), fecha, inmutable)
+
+#~Endpoint 19b. Medios con URL firmada (las miniaturas de los listados): sin JWT ni BD, solo HMAC
+@router.get("/media/{nombre_fisico}")
+def obtener_media_firmada(request: Request, nombre_fisico: str, size: str, t: str, v: str, exp: int, sig: str):
+    if not funcionesSeguridad.verificar_url_media(nombre_fisico, t, size, v, exp, sig):
+        raise HTTPException(status_code=403, detail="URL no válida o caducada")
+    # La firma cubre el nombre, pero por si acaso: nada de rutas fuera de uploads/
+    if os.path.basename(nombre_fisico) != nombre_fisico:
+        raise HTTPException(status_code=400, detail="Nombre no válido")
+    ruta_original = os.path.join(UPLOADS_DIR, nombre_fisico)
+    preset = utilidadesMiniaturas.elegir_preset(size)
+    etag = f'"{nombre_fisico}-{v}-{preset or "original"}"'
+    max_age = exp - int(time.time())
+    if utilidadesHttp.no_modificado(request, etag, None):
+        return utilidadesHttp.respuesta_no_modificado(etag, max_age=max_age)
+    if not os.path.exists(ruta_original):
+        raise HTTPException(status_code=404, detail="El archivo físico no existe en el servidor")
+    if preset:
+        ruta_derivado = utilidadesMultimedia.obtener_derivado(ruta_original, t, preset)
+        if ruta_derivado and os.path.exists(ruta_derivado):
+            return utilidadesHttp.responder_fichero(request, ruta_derivado, etag, max_age=max_age)
+        # Sin derivado servimos el original, sin dejarlo fijado en caché
+        return utilidadesHttp.responder_fichero(request, ruta_original, f'"{nombre_fisico}-{v}-original"')
+    return utilidadesHttp.responder_fichero(request, ruta_original, etag, max_age=max_age)
 
 
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
 from typing import List, Optional
 
@@ -45,4 +45,15 @@ class CrearEnlace(BaseModel):
 
 class RecursoFavorito(BaseModel):
     id_recurso: int
-    es_favorito: bool
\ No newline at end of file
+    es_favorito: bool
+
+class ArchivoHash(BaseModel):
+    hash: str = Field(..., min_length=64, max_length=64)
+    tamano: int = Field(..., ge=0)
+    nombre: str
+    tipo: str
+    fecha: Optional[datetime] = None
+    id_album: Optional[int] = None
+
+class ConsultaHashes(BaseModel):
+    archivos: List[ArchivoHash] = Field(..., max_length=500)
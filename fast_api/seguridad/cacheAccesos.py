@@ -0,0 +1,121 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional, Iterable
+
+# Caché en memoria de "¿puede el usuario U ver el recurso R? y ¿dónde está su fichero?".
+# Solo se guardan accesos concedidos: una denegación se vuelve a consultar siempre, así un permiso
+# recién dado se ve al momento. Los permisos que se quitan (y los cambios en el recurso) invalidan
+# las entradas afectadas desde las funciones de consultasRecursos / consultasAlbum que los hacen.
+# El TTL es la red de seguridad para cambios hechos por otras vías (p.ej. a mano en la BD).
+#
+# Generaciones: una consulta que leyó la BD antes de una revocación puede llegar a guardar() después de
+# la invalidación y dejar el permiso viejo en caché todo el TTL. Por eso se lee generacion() ANTES de la
+# consulta y guardar() descarta la fila si el recurso, el usuario o la caché entera se invalidaron entremedias.
+
+TTL_SEGUNDOS = float(os.getenv("ACL_CACHE_TTL", "60"))
+MAX_ENTRADAS = int(os.getenv("ACL_CACHE_MAX", "20000"))
+
+_entradas = OrderedDict()  # (id_usuario, id_recurso) -> (caduca, fila del recurso)
+_por_recurso = {}          # id_recurso -> {id_usuario, ...}
+_por_usuario = {}          # id_usuario -> {id_recurso, ...}
+_gen_recurso = {}          # id_recurso -> nº de invalidaciones
+_gen_usuario = {}          # id_usuario -> nº de invalidaciones
+_gen_global = 0
+_lock = threading.Lock()
+_estadisticas = {"aciertos": 0, "fallos": 0, "invalidaciones": 0, "descartadas": 0}
+# Otras cachés que dependen de los recursos (p.ej. cacheEnlaces) se enteran de las invalidaciones.
+# Reciben la lista de ids, o None si se invalida todo. Se llaman fuera del _lock
+_suscriptores = []
+
+def suscribir(funcion):
+    _suscriptores.append(funcion)
+
+def _avisar(ids_recursos):
+    for funcion in _suscriptores:
+        try:
+            funcion(ids_recursos)
+        except Exception as e:
+            print(f"Error avisando invalidación de caché: {e}")
+
+def _quitar(clave):
+    """Borra una entrada y sus índices. Llamar con _lock cogido"""
+    if _entradas.pop(clave, None) is None:
+        return
+    id_usuario, id_recurso = clave
+    usuarios = _por_recurso.get(id_recurso)
+    if usuarios:
+        usuarios.discard(id_usuario)
+        if not usuarios: del _por_recurso[id_recurso]
+    recursos = _por_usuario.get(id_usuario)
+    if recursos:
+        recursos.discard(id_recurso)
+        if not recursos: del _por_usuario[id_usuario]
+
+def obtener(id_usuario: int, id_recurso: int) -> Optional[dict]:
+    """Fila del recurso si el acceso está en caché y vigente, None si hay que ir a la BD"""
+    clave = (id_usuario, id_recurso)
+    with _lock:
+        entrada = _entradas.get(clave)
+        if entrada is None or entrada[0] < time.monotonic():
+            if entrada is not None:
+                _quitar(clave)
+            _estadisticas["fallos"] += 1
+            return None
+        _entradas.move_to_end(clave)
+        _estadisticas["aciertos"] += 1
+        # Copia: quien llama puede modificar el diccionario (p.ej. borrar 'enlace')
+        return dict(entrada[1])
+
+def generacion(id_usuario: int, id_recurso: int) -> tuple:
+    """Leer antes de consultar la BD y pasárselo a guardar()"""
+    with _lock:
+        return (_gen_global, _gen_usuario.get(id_usuario, 0), _gen_recurso.get(id_recurso, 0))
+
+def guardar(id_usuario: int, id_recurso: int, recurso: dict, generacion_leida: tuple):
+    clave = (id_usuario, id_recurso)
+    with _lock:
+        if generacion_leida != (_gen_global, _gen_usuario.get(id_usuario, 0), _gen_recurso.get(id_recurso, 0)):
+            # Hubo una invalidación mientras se consultaba: la fila puede ser de antes del cambio
+            _estadisticas["descartadas"] += 1
+            return
+        _entradas[clave] = (time.monotonic() + TTL_SEGUNDOS, dict(recurso))
+        _entradas.move_to_end(clave)
+        _por_recurso.setdefault(id_recurso, set()).add(id_usuario)
+        _por_usuario.setdefault(id_usuario, set()).add(id_recurso)
+        while len(_entradas) > MAX_ENTRADAS:
+            _quitar(next(iter(_entradas)))
+
+def invalidar_recursos(ids_recursos: Iterable[int]):
+    """El recurso ha cambiado (borrado, movido, reemplazado, compartición revocada...): fuera para todos"""
+    ids_recursos = list(ids_recursos)
+    with _lock:
+        for id_recurso in ids_recursos:
+            _gen_recurso[id_recurso] = _gen_recurso.get(id_recurso, 0) + 1
+            for id_usuario in list(_por_recurso.get(id_recurso, ())):
+                _quitar((id_usuario, id_recurso))
+        _estadisticas["invalidaciones"] += 1
+    _avisar(ids_recursos)
+
+def invalidar_usuario(id_usuario: int):
+    """El usuario ha perdido accesos en bloque (p.ej. ha salido de un álbum)"""
+    with _lock:
+        _gen_usuario[id_usuario] = _gen_usuario.get(id_usuario, 0) + 1
+        for id_recurso in list(_por_usuario.get(id_usuario, ())):
+            _quitar((id_usuario, id_recurso))
+        _estadisticas["invalidaciones"] += 1
+
+def invalidar_todo():
+    global _gen_global
+    with _lock:
+        _gen_global += 1
+        _entradas.clear()
+        _por_recurso.clear()
+        _por_usuario.clear()
+        _estadisticas["invalidaciones"] += 1
+    _avisar(None)
+
+def estadisticas() -> dict:
+    with _lock:
+        return {**_estadisticas, "entradas": len(_entradas), "ttl": TTL_SEGUNDOS}
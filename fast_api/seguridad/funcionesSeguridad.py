@@ -1,4 +1,8 @@
 import os
+import time
+import hmac
+import base64
+import hashlib
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
 from typing import Optional
@@ -44,4 +48,60 @@ async def get_current_user_id(token: str = Depends(oauth2_scheme)):
             raise credentials_exception
         return int(user_id) # IMPORTANTE: Convertimos a int porque la base de datos espera un número
     except (JWTError, ValueError):
-        raise credentials_exception # Si el token está mal formado, caducado o el ID no es un número
\ No newline at end of file
+        raise credentials_exception # Si el token está mal formado, caducado o el ID no es un número
+#-------------------------------------------------------------------------------------------------------
+#                                   URLS DE MEDIOS FIRMADAS
+#--------------------------------------------------------------------------------------------------------
+# Los listados devuelven URLs firmadas con HMAC(SECRET_KEY) y caducidad. La ruta /media las valida solo
+# con CPU (sin JWT ni BD): quien tiene la URL puede ver ese fichero hasta que caduque.
+MEDIA_URL_TTL = int(os.getenv("MEDIA_URL_TTL", str(6 * 3600)))
+# La caducidad se redondea a este intervalo: dentro de él las URLs no cambian y el cliente las cachea
+MEDIA_URL_INTERVALO = 3600
+
+def caducidad_url_media() -> int:
+    ahora = int(time.time())
+    return ((ahora + MEDIA_URL_TTL) // MEDIA_URL_INTERVALO + 1) * MEDIA_URL_INTERVALO
+
+def _firma_media(nombre_fisico: str, tipo: str, size: str, version: str, exp: int) -> str:
+    mensaje = f"{nombre_fisico}|{tipo}|{size}|{version}|{exp}".encode()
+    digest = hmac.new(SECRET_KEY.encode(), mensaje, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:16]).decode().rstrip("=")
+
+def firmar_url_media(nombre_fisico: str, tipo: str, size: str, version: str, exp: int) -> str:
+    """exp se calcula una vez por listado (caducidad_url_media) y se reutiliza para todas sus URLs"""
+    firma = _firma_media(nombre_fisico, tipo, size, version, exp)
+    return f"/media/{nombre_fisico}?size={size}&t={tipo}&v={version}&exp={exp}&sig={firma}"
+
+def verificar_url_media(nombre_fisico: str, tipo: str, size: str, version: str, exp: int, firma: str) -> bool:
+    if exp < time.time():
+        return False
+    return hmac.compare_digest(_firma_media(nombre_fisico, tipo, size, version, exp), firma)
+#-------------------------------------------------------------------------------------------------------
+#                               DESBLOQUEO DE ENLACES PÚBLICOS CON CONTRASEÑA
+#--------------------------------------------------------------------------------------------------------
+# bcrypt es lento a propósito: solo se paga una vez. Tras acertar la contraseña el navegador recibe un valor
+# "exp.firma" firmado con HMAC para ese token de enlace, que las rutas del enlace validan en microsegundos.
+# La firma incluye un trozo del hash de la contraseña: si el dueño la cambia, los desbloqueos anteriores dejan de valer.
+ENLACE_DESBLOQUEO_TTL = int(os.getenv("ENLACE_DESBLOQUEO_TTL", str(12 * 3600)))
+
+def _firma_desbloqueo(token_enlace: str, password_hash: str, exp: int) -> str:
+    huella = hashlib.sha256(password_hash.encode()).hexdigest()[:16]
+    mensaje = f"enlace|{token_enlace}|{exp}|{huella}".encode()
+    digest = hmac.new(SECRET_KEY.encode(), mensaje, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:16]).decode().rstrip("=")
+
+def firmar_desbloqueo_enlace(token_enlace: str, password_hash: str) -> str:
+    exp = int(time.time()) + ENLACE_DESBLOQUEO_TTL
+    return f"{exp}.{_firma_desbloqueo(token_enlace, password_hash, exp)}"
+
+def verificar_desbloqueo_enlace(token_enlace: str, password_hash: str, valor: Optional[str]) -> bool:
+    if not valor:
+        return False
+    exp, _, firma = valor.partition(".")
+    try:
+        exp = int(exp)
+    except ValueError:
+        return False
+    if exp < time.time():
+        return False
+    return hmac.compare_digest(_firma_desbloqueo(token_enlace, password_hash, exp), firma)
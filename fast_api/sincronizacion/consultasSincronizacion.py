@@ -0,0 +1,147 @@
+from fast_api import db
+from mysql.connector import Error
+from typing import Tuple, Any, Iterable
+
+# Máximo de filas del registro que se entregan por llamada a /sync (el cliente repite con el nuevo 'seq')
+LIMITE_CAMBIOS = 1000
+# seq se asigna al insertar, pero se hace visible al hacer commit: una transacción larga (o que espera un
+# bloqueo) puede confirmar un seq menor que otro ya entregado. Por eso el cursor solo avanza sobre filas
+# anteriores al inicio de la transacción abierta más antigua (information_schema.innodb_trx): las de una
+# transacción que sigue abierta tienen fecha >= su trx_started. Leer innodb_trx necesita el privilegio
+# PROCESS para el usuario de la aplicación (GRANT PROCESS ON *.* TO ...).
+_SQL_INICIO_TRANSACCION_MAS_ANTIGUA = """
+    SELECT COALESCE(MIN(trx_started), NOW()) AS limite
+    FROM information_schema.innodb_trx
+    WHERE trx_mysql_thread_id <> CONNECTION_ID()
+"""
+
+#-------------------------------------------------------------------------------------------------------
+#                                   REGISTRO DE CAMBIOS (sincronización)
+#--------------------------------------------------------------------------------------------------------
+# Cada función que modifica recursos o álbumes apunta aquí qué ha cambiado y para quién, con el cursor
+# (y la transacción) de quien llama: si hay rollback, el registro también desaparece.
+# Para altas y cambios se registra DESPUÉS de modificar; para bajas, ANTES: así los que pierden el acceso
+# todavía salen en las relaciones y se enteran de que el recurso ya no es visible para ellos.
+# Se guarda solo "qué entidad y qué operación": /sync devuelve el estado actual, no el detalle del cambio.
+
+def _marcadores(ids: list) -> str:
+    return ','.join(['%s'] * len(ids))
+
+def registrar_cambios_recursos(cursor, ids_recursos: Iterable[int], operacion: str):
+    """Una fila por cada persona que ve el recurso: dueños, receptores y miembros de sus álbumes"""
+    ids = list(ids_recursos)
+    if not ids:
+        return
+    marcadores = _marcadores(ids)
+    cursor.execute(f"""
+        INSERT INTO Registro_Cambios (id_persona, entidad, id_entidad, operacion)
+        SELECT DISTINCT Interesados.id_persona, 'RECURSO', Interesados.id_recurso, %s
+        FROM (
+            SELECT RP.id_persona, RP.id_recurso FROM Recurso_Persona RP WHERE RP.id_recurso IN ({marcadores})
+            UNION
+            SELECT RC.id_receptor, RC.id_recurso FROM Recurso_Compartido RC WHERE RC.id_recurso IN ({marcadores})
+            UNION
+            SELECT MA.id_persona, RA.id_recurso
+            FROM Recurso_Album RA
+            JOIN Miembro_Album MA ON MA.id_album = RA.id_album
+            WHERE RA.id_recurso IN ({marcadores})
+        ) AS Interesados
+    """, (operacion, *ids, *ids, *ids))
+
+def registrar_cambios_albumes(cursor, ids_albumes: Iterable[int], operacion: str):
+    """Una fila por cada miembro del álbum y por cada miembro del álbum padre (ve la subcarpeta)"""
+    ids = list(ids_albumes)
+    if not ids:
+        return
+    marcadores = _marcadores(ids)
+    cursor.execute(f"""
+        INSERT INTO Registro_Cambios (id_persona, entidad, id_entidad, operacion)
+        SELECT DISTINCT Interesados.id_persona, 'ALBUM', Interesados.id_album, %s
+        FROM (
+            SELECT MA.id_persona, MA.id_album FROM Miembro_Album MA WHERE MA.id_album IN ({marcadores})
+            UNION
+            SELECT MP.id_persona, A.id
+            FROM Album A
+            JOIN Miembro_Album MP ON MP.id_album = A.id_album_padre
+            WHERE A.id IN ({marcadores})
+        ) AS Interesados
+    """, (operacion, *ids, *ids))
+
+def registrar_contenido_album(cursor, id_album: int, ids_personas: Iterable[int], operacion: str):
+    """Todos los recursos del álbum para unas personas concretas (quien entra o sale del álbum)"""
+    for id_persona in set(ids_personas):
+        cursor.execute("""
+            INSERT INTO Registro_Cambios (id_persona, entidad, id_entidad, operacion)
+            SELECT %s, 'RECURSO', RA.id_recurso, %s FROM Recurso_Album RA WHERE RA.id_album = %s
+        """, (id_persona, operacion, id_album))
+
+def obtener_cambios(id_persona: int, desde: int, limite: int = LIMITE_CAMBIOS) -> Tuple[bool, Any]:
+    """
+    Cambios del usuario con seq > desde. Devuelve:
+      {"seq": último seq entregado, "reiniciar": bool, "hay_mas": bool, "recursos": {id: op}, "albumes": {id: op}}
+    'reiniciar' indica que faltan cambios (purgados o 'desde' inválido): el cliente debe recargar todo.
+    """
+    connection = None
+    cursor = None
+    try:
+        connection = db.get_connection()
+        cursor = connection.cursor(dictionary=True)
+        # Antes que cualquier lectura de InnoDB: la instantánea de esta conexión se toma después, así que
+        # incluye todo lo confirmado por las transacciones que ya no salen en innodb_trx
+        cursor.execute(_SQL_INICIO_TRANSACCION_MAS_ANTIGUA)
+        limite_estable = cursor.fetchone()['limite']
+        cursor.execute("SELECT MIN(seq) AS minimo FROM Registro_Cambios")
+        minimo = cursor.fetchone()['minimo']
+        cursor.execute("""
+            SELECT seq FROM Registro_Cambios
+            WHERE fecha < %s
+            ORDER BY seq DESC
+            LIMIT 1
+        """, (limite_estable,))
+        fila = cursor.fetchone()
+        maximo = fila['seq'] if fila else 0
+        # seq es global y AUTO_INCREMENT: si 'desde' queda por debajo del más antiguo que conservamos,
+        # algo se purgó entremedias (un rollback también deja huecos: en ese caso solo cuesta una recarga)
+        if desde <= 0 or (minimo is not None and desde < minimo - 1):
+            return True, {"seq": maximo, "reiniciar": True, "hay_mas": False, "recursos": {}, "albumes": {}}
+
+        cursor.execute("""
+            SELECT seq, entidad, id_entidad, operacion
+            FROM Registro_Cambios
+            WHERE id_persona = %s AND seq > %s AND seq <= %s
+            ORDER BY seq
+            LIMIT %s
+        """, (id_persona, desde, maximo, limite + 1))
+        filas = cursor.fetchall()
+        hay_mas = len(filas) > limite
+        filas = filas[:limite]
+        recursos = {}
+        albumes = {}
+        # Solo interesa la última operación de cada entidad
+        for fila in filas:
+            destino = recursos if fila['entidad'] == 'RECURSO' else albumes
+            destino[fila['id_entidad']] = fila['operacion']
+        # Sin más cambios propios el cliente avanza hasta el máximo estable (no volverá a mirar lo ya revisado)
+        seq = filas[-1]['seq'] if hay_mas else max(maximo, desde)
+        return True, {"seq": seq, "reiniciar": False, "hay_mas": hay_mas, "recursos": recursos, "albumes": albumes}
+    except Error as e:
+        print(f"Error obteniendo cambios de {id_persona}: {e}")
+        return False, str(e)
+    finally:
+        if cursor: cursor.close()
+        if connection and connection.is_connected(): connection.close()
+
+def purgar_registro_cambios(dias: int = 30):
+    """Los clientes que lleven más tiempo sin sincronizar reciben 'reiniciar' y recargan todo"""
+    connection = None
+    cursor = None
+    try:
+        connection = db.get_connection()
+        cursor = connection.cursor()
+        cursor.execute("DELETE FROM Registro_Cambios WHERE fecha < NOW() - INTERVAL %s DAY", (dias,))
+        connection.commit()
+    except Error as e:
+        print(f"Error purgando registro de cambios: {e}")
+    finally:
+        if cursor: cursor.close()
+        if connection and connection.is_connected(): connection.close()
@@ -0,0 +1,50 @@
+from fastapi import APIRouter, HTTPException, Depends, Query
+import fast_api.sincronizacion.consultasSincronizacion as consultasSincronizacion
+import fast_api.recurso.consultasRecursos as consultasRecursos
+import fast_api.album.consultasAlbum as consultasAlbum
+import fast_api.seguridad.funcionesSeguridad as funcionesSeguridad
+router = APIRouter()
+
+#~Endpoint 1. Cambios desde la última sincronización
+@router.get("/sync")
+def sincronizar(
+    since: int = Query(0, ge=0),
+    current_user_id: int = Depends(funcionesSeguridad.get_current_user_id)
+):
+    """
+    El cliente guarda el 'seq' de la respuesta y lo manda como ?since= en la siguiente llamada.
+    Con reiniciar=True debe descartar lo que tiene y recargar (/recurso/mis_recursos, /album/mis_albumes);
+    con hay_mas=True debe volver a llamar enseguida con el nuevo seq.
+    Los recursos y álbumes vienen con su estado actual; los que cambiaron y ya no ve van en *_eliminados.
+    """
+    exito, cambios = consultasSincronizacion.obtener_cambios(current_user_id, since)
+    if not exito:
+        raise HTTPException(status_code=500, detail=str(cambios))
+    respuesta = {
+        "seq": cambios["seq"],
+        "reiniciar": cambios["reiniciar"],
+        "hay_mas": cambios["hay_mas"],
+        "recursos": [],
+        "recursos_eliminados": [],
+        "albumes": [],
+        "albumes_eliminados": [],
+    }
+    if cambios["reiniciar"]:
+        return respuesta
+
+    ids_recursos = list(cambios["recursos"])
+    exito, recursos = consultasRecursos.obtener_recursos_por_ids(current_user_id, ids_recursos)
+    if not exito:
+        raise HTTPException(status_code=500, detail=str(recursos))
+    visibles = {r['id'] for r in recursos}
+    respuesta["recursos"] = recursos
+    respuesta["recursos_eliminados"] = [i for i in ids_recursos if i not in visibles]
+
+    ids_albumes = list(cambios["albumes"])
+    exito, albumes = consultasAlbum.obtener_albumes_por_ids(current_user_id, ids_albumes)
+    if not exito:
+        raise HTTPException(status_code=500, detail=str(albumes))
+    visibles = {a['id'] for a in albumes}
+    respuesta["albumes"] = albumes
+    respuesta["albumes_eliminados"] = [i for i in ids_albumes if i not in visibles]
+    return respuesta
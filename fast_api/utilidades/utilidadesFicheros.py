@@ -1,43 +1,320 @@
 import os
+import json
+import errno
+import hashlib
 import shutil
+import struct
+import threading
+import time
+import uuid
+import zlib
+from typing import Optional, Tuple
+import fast_api.utilidades.utilidadesMiniaturas as utilidadesMiniaturas
 
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) 
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 STATIC_DIR = os.path.join(BASE_DIR, "static")
 UPLOAD_TEMP_DIR = os.path.join(STATIC_DIR, "temp_chunks")
 UPLOADS_DIR = os.path.join(STATIC_DIR, "uploads")
 
-def iniciar_carga_chunk(upload_id: str):
-    path = os.path.join(UPLOAD_TEMP_DIR, upload_id)
+# Ficheros de control que se guardan en temp_chunks/<upload_id>/
+FICHERO_INFO = "info.json"  # dueño de la subida y, en modo directo, tamaño total y de chunk
+FICHERO_TROZOS = "trozos"   # un registro de tamaño fijo por chunk recibido
+
+# Registro por chunk: recibido (1 byte), longitud (4 bytes), crc32 (4 bytes).
+# Se escribe con pwrite en la posición indice * tamaño, así chunks en paralelo no se pisan.
+FORMATO_TROZO = struct.Struct("<BII")
+
+# Tamaño del buffer con el que se copian los chunks (memoria fija por subida)
+TAMANO_BUFFER = 256 * 1024
+
+# SHA-256 que se va calculando mientras llegan los chunks en orden: {upload_id: {siguiente, sha, bytes}}
+_hashes_en_curso = {}
+_lock_hashes = threading.Lock()
+
+def _ruta_temporal(upload_id: str) -> str:
+    # El upload_id viene del cliente: solo aceptamos UUIDs para no salirnos de temp_chunks
+    return os.path.join(UPLOAD_TEMP_DIR, str(uuid.UUID(upload_id)))
+
+def _ruta_parcial(upload_id: str) -> str:
+    # El fichero final se crea ya dentro de uploads/ para que al completar baste con un rename
+    return os.path.join(UPLOADS_DIR, f"{uuid.UUID(upload_id)}.part")
+
+def _leer_info(upload_id: str):
+    """Devuelve la info de la subida o None si no existe"""
+    ruta_info = os.path.join(_ruta_temporal(upload_id), FICHERO_INFO)
+    if not os.path.exists(ruta_info):
+        return None
+    with open(ruta_info, "r") as f:
+        return json.load(f)
+
+def _es_modo_directo(info) -> bool:
+    return info is not None and info.get("tamano_chunk") is not None
+
+def _leer_trozos(upload_id: str) -> dict:
+    """Devuelve {indice: (longitud, crc32)} de los chunks recibidos"""
+    ruta = os.path.join(_ruta_temporal(upload_id), FICHERO_TROZOS)
+    if not os.path.exists(ruta):
+        return {}
+    with open(ruta, "rb") as f:
+        datos = f.read()
+    trozos = {}
+    for indice, (recibido, longitud, crc) in enumerate(FORMATO_TROZO.iter_unpack(datos[:len(datos) - len(datos) % FORMATO_TROZO.size])):
+        if recibido == 1:
+            trozos[indice] = (longitud, crc)
+    return trozos
+
+def iniciar_carga_chunk(upload_id: str, tamano_total: int = None, tamano_chunk: int = None, id_usuario: int = None):
+    path = _ruta_temporal(upload_id)
     os.makedirs(path, exist_ok=True)
+    info = {"id_usuario": id_usuario, "tamano_total": None, "tamano_chunk": None, "total_chunks": None}
+
+    if tamano_total is not None and tamano_chunk is not None:
+        # MODO DIRECTO: reservamos el fichero final con su tamaño definitivo
+        os.makedirs(UPLOADS_DIR, exist_ok=True)
+        with open(_ruta_parcial(upload_id), "wb") as f:
+            if tamano_total > 0:
+                try:
+                    # Reserva real de bloques (evita fragmentar la SD y falla pronto si no hay sitio)
+                    os.posix_fallocate(f.fileno(), 0, tamano_total)
+                except AttributeError:
+                    f.truncate(tamano_total)
+                except OSError as e:
+                    if e.errno == errno.ENOSPC:
+                        raise
+                    f.truncate(tamano_total)  # El sistema de ficheros no soporta fallocate
+        info["tamano_total"] = tamano_total
+        info["tamano_chunk"] = tamano_chunk
+        info["total_chunks"] = (tamano_total + tamano_chunk - 1) // tamano_chunk
+
+    with open(os.path.join(path, FICHERO_TROZOS), "wb") as f:
+        if info["total_chunks"]:
+            f.truncate(info["total_chunks"] * FORMATO_TROZO.size)
+    with open(os.path.join(path, FICHERO_INFO), "w") as f:
+        json.dump(info, f)
     return path
 
-def guardar_chunk(upload_id: str, index: int, file_bytes):
-    path = os.path.join(UPLOAD_TEMP_DIR, upload_id)
-    # Guardamos como part_0, part_1, etc.
-    chunk_name = f"part_{index}"
-    with open(os.path.join(path, chunk_name), "wb") as f:
-        f.write(file_bytes)
+def es_propietario_carga(upload_id: str, id_usuario: int) -> bool:
+    try:
+        info = _leer_info(upload_id)
+    except ValueError:
+        return False
+    # Subidas iniciadas antes de guardar el dueño: no hay forma de comprobarlo
+    return info is None or info.get("id_usuario") in (None, id_usuario)
+
+def _hash_en_curso(upload_id: str, index: int):
+    """
+    Si el chunk es el siguiente en orden, devuelve una copia del SHA-256 acumulado para
+    seguir calculándolo mientras se escribe. Si llega fuera de orden devuelve None y el
+    resto del hash se calculará al completar la subida.
+    """
+    with _lock_hashes:
+        estado = _hashes_en_curso.get(upload_id)
+        if estado is None and index == 0:
+            estado = _hashes_en_curso[upload_id] = {"siguiente": 0, "sha": hashlib.sha256(), "bytes": 0}
+        if estado is None:
+            return None
+        if index < estado["siguiente"]:
+            # Reenvío de un chunk ya incluido en el hash: ya no podemos fiarnos del acumulado
+            del _hashes_en_curso[upload_id]
+            return None
+        if index != estado["siguiente"]:
+            return None
+        return estado["sha"].copy()
+
+def _confirmar_hash(upload_id: str, index: int, sha, escritos: int):
+    with _lock_hashes:
+        estado = _hashes_en_curso.get(upload_id)
+        if estado is not None and estado["siguiente"] == index:
+            estado["sha"] = sha
+            estado["siguiente"] = index + 1
+            estado["bytes"] += escritos
+
+def abrir_chunk(upload_id: str, index: int) -> dict:
+    """
+    Prepara el destino de un chunk. Devuelve el estado de la escritura:
+    fichero destino, bytes esperados (None en modo clásico), bytes escritos, crc32 y sha256 parcial.
+    """
+    path = _ruta_temporal(upload_id)
+    if not os.path.isdir(path):
+        raise ValueError("La subida no existe o ya se completó")
+    if index < 0:
+        raise ValueError(f"Índice de chunk fuera de rango: {index}")
+    info = _leer_info(upload_id)
+    if not _es_modo_directo(info):
+        # Escribimos en .tmp y renombramos al cerrar para que un trozo a medias no cuente como recibido
+        destino = open(os.path.join(path, f"part_{index}.tmp"), "wb")
+        return {"destino": destino, "esperado": None, "escritos": 0, "crc": 0, "sha": None}
+
+    # MODO DIRECTO: escribimos el trozo en su posición dentro del fichero final
+    if index >= info["total_chunks"]:
+        raise ValueError(f"Índice de chunk fuera de rango: {index}")
+    offset = index * info["tamano_chunk"]
+    esperado = min(info["tamano_chunk"], info["tamano_total"] - offset)
+    destino = open(_ruta_parcial(upload_id), "r+b")
+    destino.seek(offset)
+    return {"destino": destino, "esperado": esperado, "escritos": 0, "crc": 0, "sha": _hash_en_curso(upload_id, index)}
 
-def ensamblar_archivo(upload_id: str, nombre_final: str, total_chunks: int) -> str:
-    temp_path = os.path.join(UPLOAD_TEMP_DIR, upload_id)
+def escribir_bloque(escritura: dict, bloque: bytes):
+    """Escribe un bloque actualizando los checksums del chunk"""
+    escritura["escritos"] += len(bloque)
+    if escritura["esperado"] is not None and escritura["escritos"] > escritura["esperado"]:
+        raise ValueError(f"El chunk supera los {escritura['esperado']} bytes esperados")
+    escritura["destino"].write(bloque)
+    escritura["crc"] = zlib.crc32(bloque, escritura["crc"])
+    if escritura["sha"] is not None:
+        escritura["sha"].update(bloque)
+
+def cerrar_chunk(upload_id: str, index: int, escritura: dict):
+    """Cierra el destino y, si el chunk llegó entero, lo registra como recibido"""
+    escritura["destino"].close()
+    path = _ruta_temporal(upload_id)
+    escritos, esperado = escritura["escritos"], escritura["esperado"]
+    if esperado is None:
+        os.replace(os.path.join(path, f"part_{index}.tmp"), os.path.join(path, f"part_{index}"))
+    elif escritos != esperado:
+        raise ValueError(f"El chunk {index} mide {escritos} bytes y se esperaban {esperado}")
+    fd = os.open(os.path.join(path, FICHERO_TROZOS), os.O_WRONLY)
+    try:
+        os.pwrite(fd, FORMATO_TROZO.pack(1, escritos, escritura["crc"]), index * FORMATO_TROZO.size)
+    finally:
+        os.close(fd)
+    if escritura["sha"] is not None:
+        _confirmar_hash(upload_id, index, escritura["sha"], escritos)
+
+def guardar_chunk(upload_id: str, index: int, origen):
+    """Copia un chunk desde un fichero abierto usando un buffer fijo (nunca carga el chunk entero)"""
+    escritura = abrir_chunk(upload_id, index)
+    try:
+        while True:
+            bloque = origen.read(TAMANO_BUFFER)
+            if not bloque:
+                break
+            escribir_bloque(escritura, bloque)
+    except Exception:
+        escritura["destino"].close()
+        raise
+    cerrar_chunk(upload_id, index, escritura)
+
+def estado_carga(upload_id: str):
+    """
+    Resume lo recibido de una subida para poder reanudarla.
+    Devuelve None si la subida no existe.
+    """
+    path = _ruta_temporal(upload_id)
+    if not os.path.isdir(path):
+        return None
+    info = _leer_info(upload_id) or {}
+    trozos = _leer_trozos(upload_id)
+    total_chunks = info.get("total_chunks")
+
+    # Bitmap: bit i a 1 si el chunk i está guardado (el bit más alto del primer byte es el chunk 0)
+    num_bits = total_chunks if total_chunks is not None else (max(trozos) + 1 if trozos else 0)
+    bitmap = bytearray((num_bits + 7) // 8)
+    for indice in trozos:
+        bitmap[indice // 8] |= 0x80 >> (indice % 8)
+
+    estado = {
+        "upload_id": upload_id,
+        "modo": "directo" if _es_modo_directo(info) else "trozos",
+        "total_chunks": total_chunks,
+        "tamano_chunk": info.get("tamano_chunk"),
+        "tamano_total": info.get("tamano_total"),
+        "bitmap": bitmap.hex(),
+        "recibidos": [
+            {"indice": indice, "tamano": longitud, "crc32": f"{crc:08x}"}
+            for indice, (longitud, crc) in sorted(trozos.items())
+        ],
+        "bytes_recibidos": sum(longitud for longitud, _ in trozos.values()),
+    }
+    if total_chunks is not None:
+        estado["faltan"] = [i for i in range(total_chunks) if i not in trozos]
+    return estado
+
+def calcular_hash(ruta: str, sha=None, desde: int = 0) -> str:
+    """SHA-256 de un fichero; con sha y desde se continúa un hash ya calculado hasta ese byte"""
+    sha = sha or hashlib.sha256()
+    with open(ruta, "rb") as f:
+        f.seek(desde)
+        while True:
+            bloque = f.read(TAMANO_BUFFER)
+            if not bloque:
+                break
+            sha.update(bloque)
+    return sha.hexdigest()
+
+def ensamblar_archivo(upload_id: str, nombre_final: str, total_chunks: int) -> Tuple[str, str]:
+    """Deja el fichero completo en uploads/ y devuelve (ruta_final, sha256 del contenido)"""
+    temp_path = _ruta_temporal(upload_id)
     final_dir = UPLOADS_DIR
     os.makedirs(final_dir, exist_ok=True)
-    
+
     # Generar nombre único final (manteniendo extensión)
-    import uuid
     _, ext = os.path.splitext(nombre_final)
     nombre_fisico = f"{uuid.uuid4()}{ext}"
     ruta_final = os.path.join(final_dir, nombre_fisico)
 
+    with _lock_hashes:
+        estado_hash = _hashes_en_curso.pop(upload_id, None)
+
+    info = _leer_info(upload_id)
+    if _es_modo_directo(info):
+        # MODO DIRECTO: solo comprobamos que estén todos los trozos y renombramos
+        if total_chunks != info["total_chunks"]:
+            raise Exception(f"Se esperaban {info['total_chunks']} trozos y se indicaron {total_chunks}")
+        trozos = _leer_trozos(upload_id)
+        faltan = [i for i in range(total_chunks) if i not in trozos]
+        if faltan:
+            raise Exception(f"Falta el trozo {faltan[0]}")
+        os.replace(_ruta_parcial(upload_id), ruta_final)
+        shutil.rmtree(temp_path)
+        # Si los chunks llegaron en orden el hash ya está hecho; si no, solo se relee la parte pendiente
+        if estado_hash is not None:
+            return ruta_final, calcular_hash(ruta_final, estado_hash["sha"], estado_hash["bytes"])
+        return ruta_final, calcular_hash(ruta_final)
+
+    sha = hashlib.sha256()
     with open(ruta_final, "wb") as outfile:
         for i in range(total_chunks):
             chunk_path = os.path.join(temp_path, f"part_{i}")
             if not os.path.exists(chunk_path):
                 raise Exception(f"Falta el trozo {i}")
-            
+
             with open(chunk_path, "rb") as infile:
-                shutil.copyfileobj(infile, outfile)
-    
+                while True:
+                    bloque = infile.read(TAMANO_BUFFER)
+                    if not bloque:
+                        break
+                    sha.update(bloque)
+                    outfile.write(bloque)
+
     # Limpiar temporales
     shutil.rmtree(temp_path)
-    return ruta_final
\ No newline at end of file
+    return ruta_final, sha.hexdigest()
+
+def borrar_fichero_fisico(ruta: str):
+    """Borra un original y todos sus derivados (miniatura, que para vídeos es .jpg, y los WebP)"""
+    try:
+        for ruta_borrar in [ruta] + utilidadesMiniaturas.rutas_derivados(ruta):
+            if os.path.exists(ruta_borrar):
+                os.remove(ruta_borrar)
+    except Exception as e:
+        print(f"Error borrando fichero físico {ruta}: {e}")
+
+def limpiar_cargas_abandonadas(horas: int = 24):
+    """Borra las subidas que nunca se completaron (trozos y ficheros .part reservados)"""
+    limite = time.time() - horas * 3600
+    if os.path.exists(UPLOAD_TEMP_DIR):
+        for upload_id in os.listdir(UPLOAD_TEMP_DIR):
+            path = os.path.join(UPLOAD_TEMP_DIR, upload_id)
+            try:
+                # Cada chunk recibido actualiza el registro de trozos, no la carpeta
+                ruta_actividad = os.path.join(path, FICHERO_TROZOS)
+                if not os.path.exists(ruta_actividad): ruta_actividad = path
+                if os.path.getmtime(ruta_actividad) < limite:
+                    with _lock_hashes:
+                        _hashes_en_curso.pop(upload_id, None)
+                    shutil.rmtree(path, ignore_errors=True)
+                    if os.path.exists(_ruta_parcial(upload_id)):
+                        os.remove(_ruta_parcial(upload_id))
+            except Exception as e:
+                print(f"Error limpiando subida abandonada {upload_id}: {e}")
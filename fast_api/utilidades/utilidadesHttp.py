@@ -0,0 +1,123 @@
+import os
+import mimetypes
+from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional
+from urllib.parse import quote
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+
+# Con ?v=<version> correcta la URL identifica una versión concreta del contenido: se puede cachear para siempre.
+# Sin ella el cliente guarda la respuesta pero la revalida (If-None-Match -> 304, sin abrir el fichero)
+CACHE_INMUTABLE = "private, max-age=31536000, immutable"
+CACHE_REVALIDAR = "private, no-cache"
+
+# Quién envía los bytes de los ficheros una vez autorizada la petición:
+#   directo  -> FileResponse desde Python (por defecto, sin nada delante)
+#   nginx    -> cabecera X-Accel-Redirect con PREFIJO_INTERNO + ruta relativa a static/. Requiere en nginx:
+#                   location /_interno/ { internal; alias /ruta/a/fast_api/static/; }
+#   sendfile -> cabecera X-Sendfile con la ruta absoluta (Apache mod_xsendfile, lighttpd)
+# En los dos últimos el servidor web hace el sendfile del kernel y los Range; el worker de uvicorn queda libre al momento.
+MODO_ENTREGA = os.getenv("MODO_ENTREGA", "directo").strip().lower()
+PREFIJO_INTERNO = "/" + os.getenv("PREFIJO_INTERNO", "/_interno/").strip("/") + "/"
+STATIC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static")
+
+def version_recurso(recurso: dict) -> str:
+    """Identificador de la versión del contenido: cambia al reemplazar el fichero (fecha_subida se actualiza)"""
+    fecha = recurso.get('fecha_subida')
+    return str(int(fecha.timestamp())) if fecha else "0"
+
+def etag_recurso(recurso: dict, variante: str = "original") -> str:
+    """ETag fuerte: mismo contenido y misma variante (original, small, medium...) => mismo ETag"""
+    base = recurso.get('hash_contenido') or f"{recurso['id']}-{version_recurso(recurso)}-{recurso.get('tamano', 0)}"
+    return f'"{base}-{variante}"'
+
+def _etag_coincide(cabecera: str, etag: str) -> bool:
+    for candidato in cabecera.split(","):
+        candidato = candidato.strip()
+        if candidato == "*":
+            return True
+        # If-None-Match usa comparación débil: W/"x" equivale a "x"
+        if candidato.startswith("W/"):
+            candidato = candidato[2:]
+        if candidato == etag:
+            return True
+    return False
+
+def no_modificado(request: Request, etag: str, ultima_modificacion: Optional[datetime]) -> bool:
+    """True si el cliente ya tiene esta versión (If-None-Match / If-Modified-Since)"""
+    if request.method not in ("GET", "HEAD"):
+        return False
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # Si viene If-None-Match, If-Modified-Since se ignora (RFC 9110)
+        return _etag_coincide(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and ultima_modificacion:
+        try:
+            fecha_cliente = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        # Las fechas HTTP tienen resolución de segundos
+        return int(ultima_modificacion.timestamp()) <= int(fecha_cliente.timestamp())
+    return False
+
+def cabeceras_cache(etag: str, ultima_modificacion: Optional[datetime] = None, inmutable: bool = False,
+                    max_age: Optional[int] = None) -> dict:
+    if max_age is not None:
+        # URL firmada: su contenido no cambia, pero deja de valer al caducar
+        cache_control = f"private, max-age={max(0, max_age)}, immutable"
+    else:
+        cache_control = CACHE_INMUTABLE if inmutable else CACHE_REVALIDAR
+    cabeceras = {
+        "ETag": etag,
+        "Cache-Control": cache_control,
+    }
+    if ultima_modificacion:
+        cabeceras["Last-Modified"] = formatdate(ultima_modificacion.timestamp(), usegmt=True)
+    return cabeceras
+
+def respuesta_no_modificado(etag: str, ultima_modificacion: Optional[datetime] = None, inmutable: bool = False,
+                            max_age: Optional[int] = None) -> Response:
+    return Response(status_code=304, headers=cabeceras_cache(etag, ultima_modificacion, inmutable, max_age))
+
+def responder_fichero(request: Request, ruta: str, etag: str, ultima_modificacion: Optional[datetime] = None,
+                      inmutable: bool = False, filename: Optional[str] = None, max_age: Optional[int] = None) -> Response:
+    """
+    Sirve un fichero con validadores de caché propios del recurso:
+      - 304 si el cliente ya tiene esta versión (sin tocar el disco)
+      - 200 / 206 / 416 para peticiones normales y Range (lo resuelve FileResponse con nuestro ETag,
+        así If-Range también se valida contra él)
+    En modo nginx / sendfile la respuesta va vacía y el servidor web de delante envía el fichero.
+    """
+    if no_modificado(request, etag, ultima_modificacion):
+        return respuesta_no_modificado(etag, ultima_modificacion, inmutable, max_age)
+    cabeceras = cabeceras_cache(etag, ultima_modificacion, inmutable, max_age)
+    if MODO_ENTREGA in ("nginx", "sendfile"):
+        respuesta = _respuesta_delegada(ruta, cabeceras, filename)
+        if respuesta is not None:
+            return respuesta
+    return FileResponse(ruta, headers=cabeceras, filename=filename)
+
+def _content_disposition(filename: str) -> str:
+    """Igual que FileResponse: attachment con filename*=utf-8'' si el nombre no es ASCII"""
+    nombre_quoted = quote(filename)
+    if nombre_quoted != filename:
+        return f"attachment; filename*=utf-8''{nombre_quoted}"
+    return f'attachment; filename="{filename}"'
+
+def _respuesta_delegada(ruta: str, cabeceras: dict, filename: Optional[str]) -> Optional[Response]:
+    """Respuesta vacía con la redirección interna. None si el fichero no se puede delegar (se sirve directo)"""
+    ruta_absoluta = os.path.realpath(ruta)
+    if MODO_ENTREGA == "nginx":
+        relativa = os.path.relpath(ruta_absoluta, os.path.realpath(STATIC_DIR))
+        # nginx solo puede servir lo que cuelga del alias: lo de fuera de static/ va por Python
+        if relativa.startswith(".."):
+            return None
+        cabeceras["X-Accel-Redirect"] = PREFIJO_INTERNO + quote(relativa.replace(os.sep, "/"))
+    else:
+        cabeceras["X-Sendfile"] = ruta_absoluta
+    if filename:
+        cabeceras["Content-Disposition"] = _content_disposition(filename)
+    tipo_mime = mimetypes.guess_type(filename or ruta)[0] or "application/octet-stream"
+    return Response(status_code=200, headers=cabeceras, media_type=tipo_mime)
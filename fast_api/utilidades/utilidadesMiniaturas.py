@@ -0,0 +1,234 @@
+import io
+import os
+import threading
+from typing import Optional
+from PIL import Image, ExifTags, ImageOps
+import cv2
+try:
+    import pillow_heif
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+except ImportError:
+    pillow_heif = None
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATIC_DIR = os.path.join(BASE_DIR, "static")
+THUMBNAILS_DIR = os.path.join(STATIC_DIR, "thumbnails")
+DERIVADOS_DIR = os.path.join(STATIC_DIR, "derivados")
+TAMANO_MINIATURA = (300, 300)
+# Presets de tamaño (lado mayor en px). 'small' es la miniatura de siempre (carpeta thumbnails/),
+# el resto son WebP en static/derivados/<preset>/ y solo se generan para imágenes
+PRESETS = {
+    "small": 300,   # Rejilla de la galería
+    "medium": 1080, # Pantalla del móvil
+    "large": 2048,  # Zoom
+}
+CALIDAD_WEBP = 80
+# Diferencia de proporción máxima para aceptar una vista previa embebida (algunas cámaras la rellenan con bandas negras)
+TOLERANCIA_PROPORCION = 0.02
+
+def ruta_miniatura(ruta_fisica: str, tipo: str) -> str:
+    """Ruta de la miniatura de un fichero de uploads/ (los vídeos siempre tienen miniatura .jpg)"""
+    nombre_fisico = os.path.basename(ruta_fisica)
+    if tipo == "VIDEO":
+        nombre_fisico = os.path.splitext(nombre_fisico)[0] + ".jpg"
+    return os.path.join(THUMBNAILS_DIR, nombre_fisico)
+
+def ruta_derivado(ruta_fisica: str, tipo: str, preset: str) -> str:
+    if preset == "small":
+        return ruta_miniatura(ruta_fisica, tipo)
+    nombre = os.path.splitext(os.path.basename(ruta_fisica))[0] + ".webp"
+    return os.path.join(DERIVADOS_DIR, preset, nombre)
+
+def rutas_derivados(ruta_fisica: str) -> list:
+    """Todas las rutas de derivados que puede tener un original (para borrarlos junto a él)"""
+    nombre_base = os.path.splitext(os.path.basename(ruta_fisica))[0]
+    rutas = [
+        os.path.join(THUMBNAILS_DIR, os.path.basename(ruta_fisica)),
+        os.path.join(THUMBNAILS_DIR, nombre_base + ".jpg"),
+    ]
+    for preset in PRESETS:
+        if preset != "small":
+            rutas.append(os.path.join(DERIVADOS_DIR, preset, nombre_base + ".webp"))
+    return rutas
+
+def elegir_preset(size: Optional[str]) -> Optional[str]:
+    """
+    Traduce el parámetro ?size= a un preset: acepta el nombre ('small', 'medium', 'large')
+    o un tamaño en px, en cuyo caso se elige el preset más pequeño que lo cubre.
+    None significa servir el original.
+    """
+    if not size:
+        return None
+    size = size.strip().lower()
+    if size in PRESETS:
+        return size
+    try:
+        pixeles = int(size.rstrip("px"))
+    except ValueError:
+        return None
+    for preset, lado in sorted(PRESETS.items(), key=lambda p: p[1]):
+        if pixeles <= lado:
+            return preset
+    return None
+
+#-------------------------------------------------------------------------------------------------------
+#                                   VISTAS PREVIAS EMBEBIDAS
+#--------------------------------------------------------------------------------------------------------
+
+def _tamano_final(ancho: int, alto: int):
+    """Tamaño que tendrá la miniatura de una imagen ancho x alto (igual que Image.thumbnail)"""
+    escala = min(TAMANO_MINIATURA[0] / ancho, TAMANO_MINIATURA[1] / alto, 1)
+    return max(1, round(ancho * escala)), max(1, round(alto * escala))
+
+def _vista_previa_valida(previa: Image.Image, ancho: int, alto: int) -> bool:
+    """Solo vale si es al menos tan grande como la miniatura final y tiene la misma proporción"""
+    objetivo = _tamano_final(ancho, alto)
+    if previa.width < objetivo[0] or previa.height < objetivo[1]:
+        return False
+    return abs(previa.width / previa.height - ancho / alto) <= TOLERANCIA_PROPORCION * (ancho / alto)
+
+def _vista_previa_exif(img: Image.Image) -> Optional[Image.Image]:
+    """Miniatura JPEG del IFD1 del EXIF (tags JPEGInterchangeFormat / Length)"""
+    datos = img.info.get("exif")
+    if not datos:
+        return None
+    if datos.startswith(b"Exif\x00\x00"):
+        datos = datos[6:]
+    ifd1 = img.getexif().get_ifd(ExifTags.IFD.IFD1)
+    inicio = ifd1.get(0x0201)
+    longitud = ifd1.get(0x0202)
+    if not inicio or not longitud or inicio + longitud > len(datos):
+        return None
+    previa = Image.open(io.BytesIO(datos[inicio:inicio + longitud]))
+    previa.load()
+    return previa
+
+def _vista_previa_heif(img: Image.Image) -> Optional[Image.Image]:
+    """Miniatura que guardan los HEIC/HEIF junto a la imagen principal"""
+    if pillow_heif is None or img.format not in ("HEIF", "AVIF"):
+        return None
+    previa = pillow_heif.thumbnail(img, min_box=max(TAMANO_MINIATURA))
+    if previa is img:
+        return None
+    return previa
+
+def _vista_previa(img: Image.Image) -> Optional[Image.Image]:
+    ancho, alto = img.size
+    for extraer in (_vista_previa_heif, _vista_previa_exif):
+        try:
+            previa = extraer(img)
+        except Exception:
+            continue
+        if previa is not None and _vista_previa_valida(previa, ancho, alto):
+            return previa
+    return None
+
+#-------------------------------------------------------------------------------------------------------
+#                                   GENERACION DE MINIATURAS
+#--------------------------------------------------------------------------------------------------------
+# Todo se escribe a un temporal y se renombra: el worker de la cola y la generación bajo demanda pueden
+# coincidir con el mismo fichero, y nadie debe servir una imagen a medio escribir.
+
+def _ruta_temporal(ruta_destino: str) -> str:
+    """Temporal en la misma carpeta (os.replace atómico) conservando la extensión (Pillow deduce el formato)"""
+    carpeta, nombre = os.path.split(ruta_destino)
+    return os.path.join(carpeta, f".tmp-{os.getpid()}-{threading.get_ident()}-{nombre}")
+
+def _guardar_atomico(img: Image.Image, ruta_destino: str, **opciones):
+    temporal = _ruta_temporal(ruta_destino)
+    try:
+        img.save(temporal, **opciones)
+        os.replace(temporal, ruta_destino)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+
+def miniatura_imagen(ruta_fisica: str, ruta_thumb: str, rapido: bool = True):
+    """
+    rapido=True: vista previa embebida (EXIF / HEIF) si es suficiente; si no, decodificación reducida
+    (draft de JPEG, escala 1/2..1/8). La decodificación completa queda como último recurso.
+    rapido=False: el camino clásico (se mantiene para el benchmark).
+    """
+    with Image.open(ruta_fisica) as img:
+        fuente = _vista_previa(img) if rapido else None
+        if fuente is None:
+            if rapido and img.format == "JPEG":
+                img.draft(img.mode, TAMANO_MINIATURA)
+            fuente = img
+        fuente.thumbnail(TAMANO_MINIATURA)
+        if fuente.mode in ("RGBA", "P"): fuente = fuente.convert("RGB")
+        _guardar_atomico(fuente, ruta_thumb)
+
+def miniatura_video(ruta_fisica: str, ruta_thumb: str) -> bool:
+    cam = cv2.VideoCapture(ruta_fisica)
+    try:
+        cam.set(cv2.CAP_PROP_POS_FRAMES, 10)
+        ret, frame = cam.read()
+        if not ret:
+            return False
+        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        with Image.fromarray(frame_rgb) as img:
+            img.thumbnail(TAMANO_MINIATURA)
+            _guardar_atomico(img, ruta_thumb, format="JPEG")
+        return True
+    finally:
+        cam.release()
+
+def derivado_imagen(ruta_fisica: str, ruta_destino: str, lado: int):
+    """Versión WebP de una imagen con el lado mayor limitado a 'lado' (orientación EXIF ya aplicada)"""
+    os.makedirs(os.path.dirname(ruta_destino), exist_ok=True)
+    with Image.open(ruta_fisica) as img:
+        if img.format == "JPEG":
+            img.draft(img.mode, (lado, lado))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((lado, lado))
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "A" in img.getbands() or img.mode == "P" else "RGB")
+        _guardar_atomico(img, ruta_destino, format="WEBP", quality=CALIDAD_WEBP, method=4)
+
+def aplica_preset(tipo: str, preset: str) -> bool:
+    """Miniatura (small) para imágenes y vídeos; el resto de presets solo para imágenes"""
+    if preset == "small":
+        return tipo in ("IMAGEN", "VIDEO")
+    return tipo == "IMAGEN" and preset in PRESETS
+
+def generar_derivado(ruta_fisica: str, tipo: str, preset: str) -> Optional[str]:
+    """Genera (si falta) un derivado concreto. Devuelve su ruta o None si no aplica a este tipo"""
+    if not aplica_preset(tipo, preset):
+        return None
+    if preset == "small":
+        return generar_miniatura(ruta_fisica, tipo)
+    ruta_destino = ruta_derivado(ruta_fisica, tipo, preset)
+    if not os.path.exists(ruta_destino):
+        derivado_imagen(ruta_fisica, ruta_destino, PRESETS[preset])
+    return ruta_destino
+
+def generar_derivados(ruta_fisica: str, tipo: str) -> dict:
+    """Genera todos los presets. Un fallo en uno no impide los demás. Devuelve {preset: ruta o None}"""
+    resultado = {}
+    for preset in PRESETS:
+        try:
+            resultado[preset] = generar_derivado(ruta_fisica, tipo, preset)
+        except Exception as e:
+            print(f"Warning derivado {preset}: {e}")
+            resultado[preset] = None
+    return resultado
+
+def generar_miniatura(ruta_fisica: str, tipo: str) -> Optional[str]:
+    """
+    Genera la miniatura 300x300 de una imagen o un vídeo (frame 10).
+    Si ya existe (fichero deduplicado) no se vuelve a generar. Devuelve la ruta o None.
+    """
+    if tipo not in ("IMAGEN", "VIDEO"):
+        return None
+    os.makedirs(THUMBNAILS_DIR, exist_ok=True)
+    ruta_thumb = ruta_miniatura(ruta_fisica, tipo)
+    if os.path.exists(ruta_thumb):
+        return ruta_thumb
+
+    if tipo == "IMAGEN":
+        miniatura_imagen(ruta_fisica, ruta_thumb)
+    elif not miniatura_video(ruta_fisica, ruta_thumb):
+        return None
+    return ruta_thumb
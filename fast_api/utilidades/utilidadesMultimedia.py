@@ -0,0 +1,186 @@
+import os
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+# OJO: este módulo se importa también en los procesos hijos. No debe importar nada que abra
+# conexiones (db, consultas...), solo el código puro de miniaturas y metadatos.
+import fast_api.utilidades.utilidadesMiniaturas as utilidadesMiniaturas
+import fast_api.utilidades.utilidadesMetadatos as utilidadesMetadatos
+
+# Procesos que decodifican imágenes / vídeos a la vez (la Raspberry tiene 4 núcleos: dejamos margen a la API)
+MEDIA_WORKERS = int(os.getenv("MEDIA_WORKERS", "2"))
+# Tareas que pueden esperar en cola además de las que se están ejecutando
+MEDIA_COLA_MAX = int(os.getenv("MEDIA_COLA_MAX", "4"))
+
+# Derivados bajo demanda: cuánto espera una petición a que se genere y cuánto se recuerda un fallo
+ESPERA_DERIVADO = float(os.getenv("MEDIA_ESPERA_DERIVADO", "20"))
+ESPERA_COLA_DERIVADO = 2
+TTL_FALLO_DERIVADO = 600
+
+_pool: Optional[ProcessPoolExecutor] = None
+_lock_pool = threading.Lock()
+_huecos = threading.BoundedSemaphore(MEDIA_WORKERS + MEDIA_COLA_MAX)
+
+class MotorSaturado(Exception):
+    """No hay hueco en la cola del motor multimedia dentro del tiempo de espera"""
+    pass
+
+def _inicializar_proceso():
+    # Un hilo por proceso: el paralelismo lo marca MEDIA_WORKERS, no OpenCV
+    try:
+        import cv2
+        cv2.setNumThreads(1)
+    except Exception:
+        pass
+    # Menos prioridad que el servidor para que la API siga respondiendo durante una ráfaga
+    try:
+        os.nice(5)
+    except OSError:
+        pass
+
+def _procesar_en_proceso(ruta: str, tipo: str) -> dict:
+    """Se ejecuta en un proceso hijo: derivados (miniatura, medium, large) + metadatos de un fichero"""
+    resultado = {"miniatura": None, "derivados": {}, "meta": None, "aviso": None}
+    try:
+        # Sin derivados el recurso sigue siendo válido: se sirve el original
+        resultado["derivados"] = utilidadesMiniaturas.generar_derivados(ruta, tipo)
+        resultado["miniatura"] = resultado["derivados"].get("small")
+    except Exception as e:
+        resultado["aviso"] = f"Warning derivados: {e}"
+    if tipo in ("IMAGEN", "VIDEO"):
+        resultado["meta"] = utilidadesMetadatos.obtener_exif(ruta)
+    return resultado
+
+def _derivado_en_proceso(ruta: str, tipo: str, preset: str) -> Optional[str]:
+    """Se ejecuta en un proceso hijo: genera un único derivado"""
+    return utilidadesMiniaturas.generar_derivado(ruta, tipo, preset)
+
+def _obtener_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _lock_pool:
+        if _pool is None:
+            # 'spawn': los hijos no heredan el pool de MySQL ni los hilos del servidor
+            _pool = ProcessPoolExecutor(
+                max_workers=MEDIA_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_inicializar_proceso
+            )
+        return _pool
+
+def _reiniciar_pool(pool_roto: ProcessPoolExecutor):
+    """Si un hijo muere (p.ej. el OOM killer con una foto enorme) el pool queda inservible: se crea otro"""
+    global _pool
+    with _lock_pool:
+        if _pool is pool_roto:
+            _pool = None
+    pool_roto.shutdown(wait=False, cancel_futures=True)
+
+def enviar(funcion, *args, espera: Optional[float] = None) -> Future:
+    """
+    Envía una tarea al pool respetando el límite de cola.
+    Bloquea hasta que haya hueco (o lanza MotorSaturado pasados 'espera' segundos).
+    """
+    if not _huecos.acquire(timeout=espera):
+        raise MotorSaturado("Motor multimedia saturado")
+    pool = _obtener_pool()
+    try:
+        futuro = pool.submit(funcion, *args)
+    except BrokenProcessPool:
+        _huecos.release()
+        _reiniciar_pool(pool)
+        raise
+    except Exception:
+        _huecos.release()
+        raise
+    futuro.add_done_callback(lambda _: _huecos.release())
+    return futuro
+
+def procesar_medio(ruta: str, tipo: str, timeout: Optional[float] = None) -> dict:
+    """Genera derivados y extrae metadatos en el motor. Devuelve {"miniatura", "derivados", "meta", "aviso"}"""
+    pool = _obtener_pool()
+    try:
+        resultado = enviar(_procesar_en_proceso, ruta, tipo).result(timeout)
+    except BrokenProcessPool:
+        _reiniciar_pool(pool)
+        raise
+    if resultado["aviso"]:
+        print(resultado["aviso"])
+    return resultado
+
+#-------------------------------------------------------------------------------------------------------
+#                           DERIVADOS BAJO DEMANDA (single-flight)
+#--------------------------------------------------------------------------------------------------------
+# Recursos antiguos o cuya miniatura falló no tienen derivados. El primero que los pide los genera;
+# las peticiones simultáneas del mismo derivado esperan a esa misma generación en vez de lanzar otra.
+
+_en_curso = {}        # (ruta, preset) -> Future con la ruta generada
+_fallidos = {}        # (ruta, preset) -> instante del último fallo
+_lock_en_curso = threading.Lock()
+
+def _apuntar_fallo(clave: tuple):
+    """No se reintenta hasta TTL_FALLO_DERIVADO (de paso se limpian los fallos ya caducados)"""
+    with _lock_en_curso:
+        ahora = time.monotonic()
+        for k in [k for k, t in _fallidos.items() if ahora - t >= TTL_FALLO_DERIVADO]:
+            del _fallidos[k]
+        _fallidos[clave] = ahora
+
+def obtener_derivado(ruta: str, tipo: str, preset: str) -> Optional[str]:
+    """
+    Devuelve la ruta del derivado, generándolo si falta. None si no aplica, si falló hace poco,
+    o si el motor está saturado / tarda más de ESPERA_DERIVADO (quien llama sirve el original).
+    """
+    if not utilidadesMiniaturas.aplica_preset(tipo, preset):
+        return None
+    ruta_destino = utilidadesMiniaturas.ruta_derivado(ruta, tipo, preset)
+    if os.path.exists(ruta_destino):
+        return ruta_destino
+    clave = (ruta, preset)
+    with _lock_en_curso:
+        fallo = _fallidos.get(clave)
+        if fallo and time.monotonic() - fallo < TTL_FALLO_DERIVADO:
+            return None
+        futuro = _en_curso.get(clave)
+        propio = futuro is None
+        if propio:
+            futuro = Future()
+            _en_curso[clave] = futuro
+    if not propio:
+        try:
+            return futuro.result(ESPERA_DERIVADO)
+        except Exception:
+            return None
+
+    resultado = None
+    pool = _obtener_pool()
+    try:
+        resultado = enviar(_derivado_en_proceso, ruta, tipo, preset, espera=ESPERA_COLA_DERIVADO).result(ESPERA_DERIVADO)
+        if resultado is None:
+            # El preset aplica pero no salió nada (p.ej. un vídeo sin frame 10): mismo trato que un error
+            _apuntar_fallo(clave)
+    except (MotorSaturado, TimeoutError):
+        # No es culpa del fichero: no lo apuntamos como fallido (la generación sigue y quedará en disco)
+        pass
+    except BrokenProcessPool:
+        _reiniciar_pool(pool)
+    except Exception as e:
+        print(f"Error generando derivado {preset} de {ruta}: {e}")
+        _apuntar_fallo(clave)
+    finally:
+        with _lock_en_curso:
+            _en_curso.pop(clave, None)
+        futuro.set_result(resultado)
+    return resultado
+
+def iniciar():
+    _obtener_pool()
+
+def detener():
+    global _pool
+    with _lock_pool:
+        pool, _pool = _pool, None
+    if pool:
+        pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,59 @@
+import os
+import threading
+import fast_api.recurso.consultasTrabajos as consultasTrabajos
+import fast_api.utilidades.utilidadesMultimedia as utilidadesMultimedia
+
+# Número de hilos que consumen la cola de procesado. Solo reparten trabajo: el CPU lo limita el motor multimedia
+NUM_WORKERS = int(os.getenv("TRABAJOS_WORKERS", str(utilidadesMultimedia.MEDIA_WORKERS)))
+# Cada cuánto se vuelve a mirar la tabla si nadie ha avisado de trabajo nuevo (segundos)
+ESPERA_COLA = 5
+
+_hay_trabajo = threading.Event()
+_parar = threading.Event()
+_hilos = []
+
+def avisar_trabajo_nuevo():
+    """Despierta a los workers en cuanto se encola algo (si no, lo verán en el siguiente sondeo)"""
+    _hay_trabajo.set()
+
+def procesar_trabajo(trabajo: dict):
+    """Genera la miniatura y extrae los metadatos de un recurso (en el pool de procesos)"""
+    ruta = trabajo['enlace']
+    tipo = trabajo['tipo']
+    if not os.path.exists(ruta):
+        raise FileNotFoundError(f"No existe el fichero {ruta}")
+    resultado = utilidadesMultimedia.procesar_medio(ruta, tipo)
+    exito, msg = consultasTrabajos.completar_trabajo(trabajo['id'], trabajo['id_recurso'], resultado["meta"])
+    if not exito:
+        raise RuntimeError(msg)
+
+def _bucle_worker():
+    while not _parar.is_set():
+        trabajo = consultasTrabajos.reclamar_trabajo()
+        if trabajo is None:
+            _hay_trabajo.wait(ESPERA_COLA)
+            _hay_trabajo.clear()
+            continue
+        try:
+            procesar_trabajo(trabajo)
+        except Exception as e:
+            print(f"Error procesando recurso {trabajo['id_recurso']}: {e}")
+            consultasTrabajos.fallar_trabajo(trabajo['id'], trabajo['id_recurso'], trabajo['intentos'] + 1, str(e))
+
+def iniciar_workers():
+    recuperados = consultasTrabajos.recuperar_trabajos_interrumpidos()
+    if recuperados:
+        print(f"Recuperados {recuperados} trabajos de procesado interrumpidos")
+    _parar.clear()
+    for i in range(NUM_WORKERS):
+        hilo = threading.Thread(target=_bucle_worker, name=f"worker-procesado-{i}", daemon=True)
+        hilo.start()
+        _hilos.append(hilo)
+
+def detener_workers(timeout: float = 10):
+    """Los trabajos a medias al apagar se recuperan en el siguiente arranque"""
+    _parar.set()
+    _hay_trabajo.set()
+    for hilo in _hilos:
+        hilo.join(timeout)
+    _hilos.clear()
@@ -0,0 +1,87 @@
+import os
+import zipfile
+from typing import Iterable, Iterator, Tuple
+
+# ZIP que se genera mientras se envía: cada trozo que escribe zipfile se entrega al cliente al momento,
+# así la memoria no depende del tamaño del archivo (la descarga de un álbum de vídeos de 2 GB cabe en la Pi).
+# Sobre un destino sin seek zipfile escribe los tamaños y el CRC detrás de cada entrada (data descriptor).
+
+TAMANO_BLOQUE_ZIP = 1024 * 1024
+# Formatos ya comprimidos: DEFLATE solo gastaría CPU para ganar unos bytes
+EXTENSIONES_SIN_COMPRIMIR = {
+    ".jpg", ".jpeg", ".heic", ".heif", ".avif", ".png", ".webp", ".gif",
+    ".mp4", ".mov", ".m4v", ".mkv", ".webm", ".avi", ".3gp",
+    ".mp3", ".m4a", ".aac", ".ogg", ".opus", ".flac",
+    ".zip", ".gz", ".7z", ".rar", ".pdf", ".docx", ".xlsx", ".pptx",
+}
+
+class _Salida:
+    """Destino de zipfile que solo acumula lo escrito hasta que el generador lo recoge (sin tell/seek)"""
+    def __init__(self):
+        self._trozos = []
+
+    def write(self, datos) -> int:
+        self._trozos.append(bytes(datos))
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def recoger(self) -> bytes:
+        datos = b"".join(self._trozos)
+        self._trozos.clear()
+        return datos
+
+def tipo_compresion(nombre: str) -> int:
+    extension = os.path.splitext(nombre)[1].lower()
+    return zipfile.ZIP_STORED if extension in EXTENSIONES_SIN_COMPRIMIR else zipfile.ZIP_DEFLATED
+
+def nombres_unicos(archivos: Iterable[Tuple[str, str, str]]) -> Iterator[Tuple[str, str]]:
+    """
+    De (ruta_fisica, carpeta, nombre) a (ruta_fisica, ruta_dentro_del_zip) sin repetidos:
+    dos 'IMG_0001.jpg' en la misma carpeta quedan como 'IMG_0001.jpg' e 'IMG_0001 (2).jpg'
+    """
+    usados = set()
+    for ruta, carpeta, nombre in archivos:
+        nombre = (nombre or os.path.basename(ruta)).replace("/", "_").replace("\\", "_")
+        base, extension = os.path.splitext(nombre)
+        destino = f"{carpeta}/{nombre}" if carpeta else nombre
+        contador = 2
+        while destino.lower() in usados:
+            nombre = f"{base} ({contador}){extension}"
+            destino = f"{carpeta}/{nombre}" if carpeta else nombre
+            contador += 1
+        usados.add(destino.lower())
+        yield ruta, destino
+
+def generar_zip(archivos: Iterable[Tuple[str, str]]) -> Iterator[bytes]:
+    """
+    Genera el ZIP a trozos a partir de pares (ruta_fisica, nombre_dentro_del_zip).
+    Los ficheros que no existen o no se pueden leer se saltan (el resto del ZIP sigue siendo válido).
+    """
+    salida = _Salida()
+    with zipfile.ZipFile(salida, "w", allowZip64=True) as zip_file:
+        for ruta, nombre in archivos:
+            try:
+                origen = open(ruta, "rb")
+            except OSError as e:
+                print(f"Warning ZIP: se omite {ruta}: {e}")
+                continue
+            with origen:
+                # from_file rellena fecha y tamaño: con el tamaño zipfile decide si la entrada necesita ZIP64
+                info = zipfile.ZipInfo.from_file(ruta, arcname=nombre)
+                info.compress_type = tipo_compresion(nombre)
+                with zip_file.open(info, "w") as destino:
+                    while True:
+                        bloque = origen.read(TAMANO_BLOQUE_ZIP)
+                        if not bloque:
+                            break
+                        destino.write(bloque)
+                        datos = salida.recoger()
+                        if datos:
+                            yield datos
+            datos = salida.recoger()
+            if datos:
+                yield datos
+    # Directorio central: se escribe al cerrar el ZipFile
+    yield salida.recoger()
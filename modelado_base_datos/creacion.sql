@@ -4,6 +4,8 @@
 DROP TRIGGER IF EXISTS borrar_recurso_huerfano;
 
 -- Tablas dependientes de Recurso, Album o Persona
+DROP TABLE IF EXISTS Registro_Cambios;
+DROP TABLE IF EXISTS Trabajo_Procesado;
 DROP TABLE IF EXISTS Metadatos;
 DROP TABLE IF EXISTS EnlacePublico_Contenido;
 DROP TABLE IF EXISTS EnlacePublico;
@@ -25,6 +27,9 @@ DROP TABLE IF EXISTS Control_Acceso;
 DROP TABLE IF EXISTS Recurso;
 DROP TABLE IF EXISTS Persona;
 
+-- Migraciones aplicadas (la crea fast_api/migrar.py): al recrear el esquema se vuelven a comprobar todas
+DROP TABLE IF EXISTS Version_Esquema;
+
 
 /* ==========================================================
    CREACIÓN DE TABLAS
@@ -67,8 +72,16 @@ CREATE TABLE Recurso(
     fecha_eliminacion DATETIME DEFAULT NULL,
     tamano BIGINT DEFAULT 0,
     favorito BOOLEAN DEFAULT 0,
+    hash_contenido CHAR(64) NULL, -- SHA-256 del fichero: varios recursos pueden compartir el mismo 'enlace'
+    estado_procesado ENUM('PENDIENTE', 'PROCESANDO', 'COMPLETADO', 'ERROR') NOT NULL DEFAULT 'COMPLETADO', -- Miniatura y metadatos
     CONSTRAINT pk_recurso PRIMARY KEY(id),
-    CONSTRAINT fk_recurso_creador FOREIGN KEY (id_creador) REFERENCES Persona(id) ON DELETE SET NULL
+    CONSTRAINT fk_recurso_creador FOREIGN KEY (id_creador) REFERENCES Persona(id) ON DELETE SET NULL,
+    INDEX idx_recurso_hash (hash_contenido, tamano),
+    INDEX idx_recurso_enlace (enlace), -- Recuento de referencias al borrar ficheros físicos
+    INDEX idx_recurso_fecha (fecha_real, id), -- Listado paginado por cursor (fecha_real, id)
+    INDEX idx_recurso_creador_uso (id_creador, fecha_eliminacion, tamano), -- Cuota (SUM) y papelera sin leer filas
+    INDEX idx_recurso_creador_nombre (id_creador, nombre), -- ¿Ya existe este nombre? (cada subida)
+    INDEX idx_recurso_eliminacion (fecha_eliminacion) -- Purga automática de la papelera
 ) ENGINE=InnoDB;
 
 CREATE TABLE Recurso_Persona(
@@ -76,7 +89,8 @@ CREATE TABLE Recurso_Persona(
     id_persona INT NOT NULL,
     CONSTRAINT pk_recurso_persona PRIMARY KEY(id_recurso, id_persona),
     CONSTRAINT fk_recurso_persona_recurso FOREIGN KEY(id_recurso) REFERENCES Recurso(id) ON DELETE CASCADE,
-    CONSTRAINT fk_recurso_persona_persona FOREIGN KEY(id_persona) REFERENCES Persona(id) ON DELETE CASCADE
+    CONSTRAINT fk_recurso_persona_persona FOREIGN KEY(id_persona) REFERENCES Persona(id) ON DELETE CASCADE,
+    INDEX idx_recurso_persona_persona (id_persona, id_recurso) -- Recursos de un usuario (la PK empieza por id_recurso)
 ) ENGINE=InnoDB;
 
 CREATE TABLE Album(
@@ -147,7 +161,8 @@ CREATE TABLE Recurso_Compartido (
     CONSTRAINT pk_recurso_compartido PRIMARY KEY(id_recurso, id_emisor, id_receptor),
     CONSTRAINT fk_recurso_compartido_recurso FOREIGN KEY (id_recurso) REFERENCES Recurso(id) ON DELETE CASCADE,
     CONSTRAINT fk_recurso_compartido_emisor FOREIGN KEY (id_emisor) REFERENCES Persona(id) ON DELETE CASCADE,
-    CONSTRAINT fk_recurso_compartido_receptor FOREIGN KEY (id_receptor) REFERENCES Persona(id) ON DELETE CASCADE
+    CONSTRAINT fk_recurso_compartido_receptor FOREIGN KEY (id_receptor) REFERENCES Persona(id) ON DELETE CASCADE,
+    INDEX idx_compartido_receptor (id_receptor, id_recurso) -- Lo compartido conmigo
 ) ENGINE=InnoDB;
 
 CREATE TABLE EnlacePublico (
@@ -175,6 +190,36 @@ CREATE TABLE EnlacePublico_Contenido (
     CONSTRAINT fk_contenido_album FOREIGN KEY (id_album) REFERENCES Album(id) ON DELETE CASCADE
 ) ENGINE=InnoDB;
 
+CREATE TABLE Trabajo_Procesado (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    id_recurso INT NOT NULL,
+    estado ENUM('PENDIENTE', 'EN_PROCESO', 'COMPLETADO', 'ERROR') NOT NULL DEFAULT 'PENDIENTE',
+    intentos INT NOT NULL DEFAULT 0,
+    error VARCHAR(500) NULL,
+    fecha_creacion DATETIME DEFAULT CURRENT_TIMESTAMP,
+    fecha_inicio DATETIME NULL,
+    fecha_fin DATETIME NULL,
+    disponible_desde DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP, -- Tras un fallo: no se reintenta antes
+    CONSTRAINT fk_trabajo_recurso FOREIGN KEY (id_recurso) REFERENCES Recurso(id) ON DELETE CASCADE,
+    INDEX idx_trabajo_estado (estado, id)
+) ENGINE=InnoDB;
+
+-- Registro de cambios para la sincronización incremental (/sync?since=<seq>). Una fila por persona afectada.
+-- Sin FK a la entidad: la fila de un recurso borrado tiene que sobrevivir para avisar del borrado
+-- /sync lee information_schema.innodb_trx para no adelantar el cursor por encima de transacciones abiertas:
+-- el usuario de la aplicación necesita GRANT PROCESS ON *.* (ver consultasSincronizacion.obtener_cambios)
+CREATE TABLE Registro_Cambios (
+    seq BIGINT AUTO_INCREMENT PRIMARY KEY,
+    id_persona INT NOT NULL,
+    entidad ENUM('RECURSO', 'ALBUM') NOT NULL,
+    id_entidad INT NOT NULL,
+    operacion VARCHAR(30) NOT NULL,
+    fecha DATETIME DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT fk_registro_persona FOREIGN KEY (id_persona) REFERENCES Persona(id) ON DELETE CASCADE,
+    INDEX idx_registro_persona_seq (id_persona, seq),
+    INDEX idx_registro_fecha (fecha)
+) ENGINE=InnoDB;
+
 CREATE TABLE Metadatos (
     id INT AUTO_INCREMENT PRIMARY KEY,
     id_recurso INT NOT NULL,
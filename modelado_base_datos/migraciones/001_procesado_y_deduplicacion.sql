@@ -0,0 +1,19 @@
+-- Deduplicación por contenido (hash) y procesado en segundo plano de miniaturas y metadatos
+ALTER TABLE Recurso ADD COLUMN hash_contenido CHAR(64) NULL;
+ALTER TABLE Recurso ADD COLUMN estado_procesado ENUM('PENDIENTE', 'PROCESANDO', 'COMPLETADO', 'ERROR') NOT NULL DEFAULT 'COMPLETADO';
+CREATE INDEX idx_recurso_hash ON Recurso (hash_contenido, tamano);
+-- Recuento de referencias al borrar ficheros físicos
+CREATE INDEX idx_recurso_enlace ON Recurso (enlace);
+
+CREATE TABLE Trabajo_Procesado (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    id_recurso INT NOT NULL,
+    estado ENUM('PENDIENTE', 'EN_PROCESO', 'COMPLETADO', 'ERROR') NOT NULL DEFAULT 'PENDIENTE',
+    intentos INT NOT NULL DEFAULT 0,
+    error VARCHAR(500) NULL,
+    fecha_creacion DATETIME DEFAULT CURRENT_TIMESTAMP,
+    fecha_inicio DATETIME NULL,
+    fecha_fin DATETIME NULL,
+    CONSTRAINT fk_trabajo_recurso FOREIGN KEY (id_recurso) REFERENCES Recurso(id) ON DELETE CASCADE,
+    INDEX idx_trabajo_estado (estado, id)
+) ENGINE=InnoDB;
@@ -0,0 +1,6 @@
+-- Listado paginado por cursor (fecha_real, id) de /recurso/mis_recursos
+CREATE INDEX idx_recurso_fecha ON Recurso (fecha_real, id);
+-- Recursos de un usuario (la PK de Recurso_Persona empieza por id_recurso)
+CREATE INDEX idx_recurso_persona_persona ON Recurso_Persona (id_persona, id_recurso);
+-- Lo compartido conmigo
+CREATE INDEX idx_compartido_receptor ON Recurso_Compartido (id_receptor, id_recurso);
@@ -0,0 +1,12 @@
+-- Registro de cambios para la sincronización incremental (/sync?since=<seq>)
+CREATE TABLE Registro_Cambios (
+    seq BIGINT AUTO_INCREMENT PRIMARY KEY,
+    id_persona INT NOT NULL,
+    entidad ENUM('RECURSO', 'ALBUM') NOT NULL,
+    id_entidad INT NOT NULL,
+    operacion VARCHAR(30) NOT NULL,
+    fecha DATETIME DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT fk_registro_persona FOREIGN KEY (id_persona) REFERENCES Persona(id) ON DELETE CASCADE,
+    INDEX idx_registro_persona_seq (id_persona, seq),
+    INDEX idx_registro_fecha (fecha)
+) ENGINE=InnoDB;
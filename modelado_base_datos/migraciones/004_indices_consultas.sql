@@ -0,0 +1,23 @@
+-- Índices para los predicados más usados de los módulos consultas*, elegidos por la forma de las consultas.
+-- No hay planes capturados de una BD real: revisar con "python -m fast_api.migrar --explain" antes y
+-- después de aplicar la migración (la columna "índice" de cada consulta indica cuál elige MySQL).
+--
+-- Cuota y uso (verificar_espacio_usuario, obtener_uso_almacenamiento_usuario, actualizar_cuota, listar_usuarios_con_uso)
+-- y papelera (WHERE id_creador = ? AND fecha_eliminacion IS NOT NULL ORDER BY fecha_eliminacion DESC).
+-- Cubre las tres columnas que leen: el SUM(tamano) puede salir solo del índice.
+CREATE INDEX idx_recurso_creador_uso ON Recurso (id_creador, fecha_eliminacion, tamano);
+
+-- check_recurso_existe_en_album (cada subida): WHERE id_creador = ? AND nombre = ? AND fecha_eliminacion IS NULL.
+CREATE INDEX idx_recurso_creador_nombre ON Recurso (id_creador, nombre);
+
+-- purgar_papelera_automatica: WHERE fecha_eliminacion < NOW() - INTERVAL n DAY.
+CREATE INDEX idx_recurso_eliminacion ON Recurso (fecha_eliminacion);
+
+-- Sin índice nuevo (ya existe uno con esas columnas al principio):
+--   Recurso_Compartido(id_receptor)      -> idx_compartido_receptor (id_receptor, id_recurso), migración 002
+--   Miembro_Album(id_persona)            -> índice implícito de fk_miembro_album_persona; InnoDB le añade la PK
+--                                           (id_album), así que ya cubre "álbumes de una persona"
+--   Album(id_album_padre)                -> índice implícito de fk_album_padre (subálbumes, CTE de enlaces)
+--   EnlacePublico_Contenido(id_enlace)   -> índice implícito de fk_contenido_enlace
+--   Recurso_Album(id_recurso)            -> índice implícito de fk_recurso_album_recurso + PK (id_album)
+-- Un índice explícito sobre las mismas columnas solo duplicaría escrituras y memoria del buffer pool.
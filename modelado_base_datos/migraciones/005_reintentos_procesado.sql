@@ -0,0 +1,2 @@
+-- Un trabajo de procesado que falla no se vuelve a reclamar hasta disponible_desde (espera exponencial)
+ALTER TABLE Trabajo_Procesado ADD COLUMN disponible_desde DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP;
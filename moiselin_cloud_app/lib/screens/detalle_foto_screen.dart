@@ -749,7 +749,8 @@ class _DetalleRecursoScreenState extends State<DetalleRecursoScreen> {
           child: Hero(
           tag: "recurso_${widget.recurso.id}",
           child: CachedNetworkImage(
-            imageUrl: url,
+            // Derivado de 2048px: suficiente para hacer zoom sin bajar el original
+            imageUrl: "$url?size=large",
             httpHeaders: {"Authorization": "Bearer ${widget.token}"},
             fit: BoxFit.contain,
             placeholder: (context, url) => const Center(child: CircularProgressIndicator(color: Colors.white)),
@@ -1104,7 +1104,8 @@ void _mostrarDialogoUrl(String url) {
                              } else {
                                final recurso = _recursosFiltrados[index - _albumesFiltrados.length];
                                final isSelected = _recursosSeleccionados.contains(recurso.id);
-                               final urlImagen = "${ApiService.baseUrl}/recurso/archivo/${recurso.id}?size=small";
+                               // URL firmada del listado (no pasa por JWT ni BD en el servidor)
+                               final urlImagen = recurso.getUrlCompleta(ApiService.baseUrl, usarThumbnail: true);
                                
                                return GestureDetector(
                                 onLongPress: () => _toggleSeleccionRecurso(recurso.id),
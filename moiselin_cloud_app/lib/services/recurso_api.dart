@@ -360,17 +360,23 @@ class RecursoApiService {
       int totalSize = await archivo.length();
       String fileName = path.basename(archivo.path);
       
-      // 1. INIT
+      int chunkSize = 1 * 1024 * 1024; // 1MB
+      int totalChunks = (totalSize / chunkSize).ceil();
+
+      // 1. INIT (con los tamaños el servidor escribe cada chunk directamente en el fichero final)
       final respInit = await http.post(
         Uri.parse('$baseUrl/upload/init'),
-        headers: {'Authorization': 'Bearer $token'}
+        headers: {'Authorization': 'Bearer $token'},
+        body: {
+          'tamano_total': totalSize.toString(),
+          'tamano_chunk': chunkSize.toString(),
+        },
       );
+      if (respInit.statusCode == 507) return jsonDecode(respInit.body)['detail'];
       if (respInit.statusCode != 200) return "Error iniciando subida";
       String uploadId = jsonDecode(respInit.body)['upload_id'];
 
       // 2. CHUNKS
-      int chunkSize = 1 * 1024 * 1024; // 1MB
-      int totalChunks = (totalSize / chunkSize).ceil();
       
       var accessFile = await archivo.open();
       
@@ -384,14 +390,15 @@ class RecursoApiService {
         await accessFile.setPosition(start);
         await accessFile.readInto(buffer);
 
-        var request = http.MultipartRequest('POST', Uri.parse('$baseUrl/upload/chunk'));
-        request.headers['Authorization'] = 'Bearer $token';
-        request.fields['upload_id'] = uploadId;
-        request.fields['chunk_index'] = i.toString();
-        
-        request.files.add(http.MultipartFile.fromBytes('file', buffer, filename: 'chunk_$i'));
-
-        var respChunk = await request.send();
+        // Bytes en crudo (sin multipart): el servidor los escribe en disco según llegan, sin fichero temporal
+        final respChunk = await http.put(
+          Uri.parse('$baseUrl/upload/chunk/$uploadId/$i'),
+          headers: {
+            'Authorization': 'Bearer $token',
+            'Content-Type': 'application/octet-stream',
+          },
+          body: buffer,
+        );
         if (respChunk.statusCode != 200) {
           await accessFile.close();
           return "Error subiendo parte ${i+1}";